@@ -3,41 +3,204 @@ The main file of the FastAPI application.
 Here we connect all the paths and the logic of the API.
 """
 
-import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
 
-import uvicorn
-from fastapi import FastAPI
+import httpx
+from fastapi import FastAPI, Request, Response, status
 from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
 from fastapi.staticfiles import StaticFiles
-from src import country, favorite
-
-# Create a parser
-parser = argparse.ArgumentParser(description="Run the FastAPI application.")
-# Add the API key argument
-parser.add_argument(
-    "--api_key", type=str, required=True, help="The API key for the OpenWeatherMap API."
+from src import (
+    cache,
+    chart,
+    client,
+    config,
+    country,
+    country_index,
+    favorite,
+    favorites_store,
+    metrics,
+    openapi,
+    prefetch,
+    profiling,
+    timing,
+    upstream,
+    weather,
+)
+from src.responses import (
+    EncodedJSONResponse,
+    JSONResponse,
+    PrettyJSONMiddleware,
 )
-# Parse the arguments
-args = parser.parse_args()
 
-country.set_api_key(args.api_key)
+logger = logging.getLogger(__name__)
+
+# The settings are read from the environment, so every worker process started by
+# the server gets the same settings
+settings = config.Settings.from_env()
+
+
+def configure(settings: config.Settings) -> None:
+    """
+    Apply the settings to the modules of the application.
+    :param settings: The settings.
+    """
+    # Every worker gets its share of the quota of the keys
+    weather.key_pool.configure(
+        settings.owm_calls_per_minute / settings.worker_processes,
+        settings.owm_queue_timeout,
+    )
+    country.set_api_key(settings.api_key)
+    weather.set_share_radius(settings.weather_share_km)
+    upstream.set_urls(
+        settings.rest_countries_url,
+        settings.openweathermap_url,
+        settings.quickchart_url,
+    )
+    country.set_batch_concurrency(settings.batch_concurrency)
+    chart.set_backend(settings.chart_backend)
+    chart.chart_cache.configure(settings.chart_cache_bytes, settings.chart_cache_dir)
+    timing.set_enabled(settings.server_timing)
+    profiling.configure(
+        settings.admin_key,
+        settings.profile_rate,
+        settings.profile_slow,
+        settings.profile_dir,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the shared resources when the application starts,
+    and release them when it stops.
+    :param app: The application.
+    """
+    startup_started = time.perf_counter()
+    configure(settings)
+    app.state.openapi = openapi.load_openapi(app)
+    chart.start(settings.chart_workers)
+    app.state.favorites = favorites_store.create_store(settings.favorites_db)
+    app.state.http_client = client.create_client(
+        client.ClientSettings(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+            connect_timeout=settings.connect_timeout,
+            read_timeout=settings.read_timeout,
+            http2=settings.http2,
+            retries=settings.retries,
+            retry_backoff=settings.retry_backoff,
+            budget=settings.upstream_budget,
+            breaker_threshold=settings.breaker_threshold,
+            breaker_reset=settings.breaker_reset,
+            hedge=settings.hedge,
+        ),
+        upstream.urls(),
+    )
+    await country_index.load(app.state.http_client, settings.countries_snapshot)
+    refresh_task = asyncio.create_task(
+        country_index.refresh_periodically(
+            app.state.http_client,
+            settings.countries_refresh,
+            settings.countries_snapshot,
+        )
+    )
+    prefetch_task = None
+    if settings.prefetch != prefetch.OFF:
+        prefetch_task = asyncio.create_task(
+            prefetch.prefetch_periodically(
+                app.state.http_client,
+                app.state.favorites,
+                settings.prefetch,
+                settings.prefetch_interval,
+            )
+        )
+    # The import is measured from the start of the process by the bootstrap
+    # module, when the server runs it
+    app.state.startup = {
+        "startup_seconds": time.perf_counter() - startup_started,
+        "cpu_seconds": time.process_time(),
+    }
+    if hasattr(app.state, "import_seconds"):
+        app.state.startup["import_seconds"] = app.state.import_seconds
+    metrics.record_start(app.state.startup)
+    logger.info(
+        "Worker %d started: import %.0f ms, startup %.0f ms, %.0f ms of CPU",
+        os.getpid(),
+        app.state.startup.get("import_seconds", 0.0) * 1000,
+        app.state.startup["startup_seconds"] * 1000,
+        app.state.startup["cpu_seconds"] * 1000,
+    )
+    yield
+    refresh_task.cancel()
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    await app.state.http_client.aclose()
+    app.state.favorites.close()
+    chart.shutdown()
+    metrics.mark_process_dead()
+
 
 app = FastAPI(
     root_path="/api",
     title="Countries API",
     description="This is a simple API that returns information about countries",
     version="1.0",
+    # The OpenAPI document is pre-generated, see src/openapi.py
+    openapi_url=None,
     docs_url=None,
     redoc_url=None,
+    lifespan=lifespan,
+    default_response_class=JSONResponse,
 )
 
+app.add_middleware(PrettyJSONMiddleware)
+app.add_middleware(timing.ServerTimingMiddleware)
+app.add_middleware(profiling.ProfilerMiddleware)
+# Added last, so it is the outermost middleware and measures the whole request
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 app.include_router(country.router)
 app.include_router(favorite.router)
 
 
+@app.exception_handler(httpx.HTTPError)
+async def upstream_error_handler(request: Request, error: httpx.HTTPError):
+    """
+    Answer with a 502, 503 or 504 when an upstream API could not be reached,
+    even after the retries.
+    """
+    return client.upstream_error(error).to_response()
+
+
+@app.exception_handler(sqlite3.OperationalError)
+async def database_error_handler(request: Request, error: sqlite3.OperationalError):
+    """
+    Answer with a 503 when the favorites database stayed locked by another
+    worker for too long. Any other error is a fault, answered with a 500.
+    """
+    if not favorites_store.is_busy(error):
+        raise error
+    logger.warning("Error querying the favorites database: %s", error)
+    return Response(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content="The favorites database is busy, try again later",
+    )
+
+
 # Documentation routes
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json(request: Request):
+    return EncodedJSONResponse(request.app.state.openapi)
+
+
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
     return get_swagger_ui_html(
@@ -78,5 +241,85 @@ async def root():
     return {"message": "Welcome to Countries API"}
 
 
+@app.get(
+    "/cache",
+    responses={
+        200: {
+            "description": "The statistics of the in-process caches and of the "
+            "OpenWeatherMap quota",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "caches": [
+                            {
+                                "name": "countries",
+                                "size": 12,
+                                "maxsize": 512,
+                                "hits": 480,
+                                "stale_hits": 0,
+                                "stale_errors": 0,
+                                "misses": 12,
+                                "coalesced": 3,
+                                "evictions": 0,
+                                "inflight": 0,
+                            }
+                        ],
+                        "quota": {
+                            "keys": 2,
+                            "calls_per_minute": 120,
+                            "waiting": 0,
+                            "waited": 14,
+                            "rejected": 0,
+                        },
+                    },
+                },
+            },
+        }
+    },
+)
+async def cache_stats():
+    """
+    This path returns the size and the hit/miss counters of the caches,
+    which can be used to size them, and the use of the OpenWeatherMap quota
+    by this worker.
+    :return:
+    """
+    return {
+        "caches": [c.stats() for c in cache.caches.values()],
+        "quota": weather.key_pool.stats(),
+    }
+
+
+@app.get(
+    "/metrics",
+    response_class=Response,
+    responses={
+        200: {
+            "description": "The metrics of the application, in the Prometheus format",
+            "content": {
+                "text/plain": {
+                    "example": "# HELP http_requests_in_progress The number of "
+                    "requests in progress.\n"
+                    "# TYPE http_requests_in_progress gauge\n"
+                    "http_requests_in_progress 1.0\n",
+                },
+            },
+        },
+        501: {"description": "prometheus_client is not installed"},
+    },
+)
+async def get_metrics():
+    """
+    This path returns the latency of the requests by route and of the upstream
+    calls by host, the requests in progress and the cache events, to be scraped
+    by Prometheus. With several workers, it covers all of them.
+    :return:
+    """
+    return metrics.metrics_response()
+
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="localhost", port=8000, reload=True)
+    # Prefer `python -m src.server`: the worker processes do not re-run this module
+    from src.server import main
+
+    main()
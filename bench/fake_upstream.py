@@ -0,0 +1,241 @@
+"""
+A local stand-in for the upstream APIs, to benchmark the application offline.
+It emulates the paths of REST Countries, OpenWeatherMap and QuickChart used by
+the application, with a configurable latency, jitter and error rate:
+
+    python -m bench.fake_upstream --port 9000 --latency 50 --jitter 20
+
+The application is pointed at it with:
+
+    APP_REST_COUNTRIES_URL=http://127.0.0.1:9000/v3.1
+    APP_OPENWEATHERMAP_URL=http://127.0.0.1:9000/data/2.5
+    APP_QUICKCHART_URL=http://127.0.0.1:9000/chart
+"""
+
+import argparse
+import asyncio
+import base64
+import math
+import random
+import time
+from dataclasses import dataclass
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+REGIONS = {
+    "Africa": ["Eastern Africa", "Western Africa", "Northern Africa"],
+    "Americas": ["South America", "North America", "Caribbean"],
+    "Asia": ["Eastern Asia", "Southern Asia", "Western Asia"],
+    "Europe": ["Western Europe", "Northern Europe", "Southern Europe"],
+    "Oceania": ["Polynesia", "Melanesia"],
+}
+# A transparent 1x1 PNG, returned as the chart
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8"
+    "AAAAASUVORK5CYII="
+)
+
+
+def make_countries(count: int = 250, seed: int = 0) -> list[dict]:
+    """
+    Generate countries in the format of the REST Countries API.
+    The countries are named "Country 1" to "Country <count>", and their
+    capitals are spread over the globe.
+
+    :param count: The number of countries.
+    :param seed: The seed of the random generator, for reproducible countries.
+
+    :return: The countries.
+    """
+    rng = random.Random(seed)
+    regions = list(REGIONS)
+    countries = []
+    for i in range(1, count + 1):
+        region = regions[i % len(regions)]
+        subregion = REGIONS[region][i % len(REGIONS[region])]
+        countries.append(
+            {
+                "name": {
+                    "common": f"Country {i}",
+                    "official": f"Republic of Country {i}",
+                },
+                "altSpellings": [f"C{i}"],
+                "region": region,
+                "subregion": subregion,
+                "continents": [
+                    subregion if region == "Americas" else region,
+                ],
+                "capital": [f"Capital {i}"],
+                "capitalInfo": {
+                    "latlng": [
+                        round(rng.uniform(-60, 70), 2),
+                        round(rng.uniform(-180, 180), 2),
+                    ]
+                },
+                "population": rng.randint(10_000, 200_000_000),
+                "area": float(rng.randint(100, 10_000_000)),
+            }
+        )
+    return countries
+
+
+def temperature(latitude: float, longitude: float, timestamp: float) -> float:
+    """
+    Get a plausible temperature: warmer near the equator and in the afternoon.
+    :param latitude: The latitude.
+    :param longitude: The longitude.
+    :param timestamp: The UNIX timestamp.
+    :return: The temperature in Celsius, as the application asks for metric units.
+    """
+    solar_hour = (timestamp / 3600 + longitude / 15) % 24
+    daily = 5 * math.sin((solar_hour - 9) / 24 * 2 * math.pi)
+    return round(30 - 0.5 * abs(latitude) + daily, 2)
+
+
+@dataclass
+class Behavior:
+    """
+    How the fake upstream answers.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+
+def create_app(behavior: Behavior, countries: list[dict]) -> Starlette:
+    """
+    Create the fake upstream application.
+    :param behavior: The latency, jitter and error rate of the answers.
+    :param countries: The countries served by the fake REST Countries API.
+    :return: The application.
+    """
+    by_name = {}
+    for country in countries:
+        by_name[country["name"]["common"].casefold()] = country
+        by_name[country["name"]["official"].casefold()] = country
+
+    async def delay() -> Response | None:
+        """
+        Wait for the configured latency, and fail with the configured error rate.
+        """
+        seconds = behavior.latency + random.uniform(-behavior.jitter, behavior.jitter)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+        if random.random() < behavior.error_rate:
+            return Response("Service unavailable", status_code=503)
+        return None
+
+    async def all_countries(request: Request) -> Response:
+        return await delay() or JSONResponse(countries)
+
+    async def region(request: Request) -> Response:
+        name = request.path_params["region"].casefold()
+        matches = [
+            c
+            for c in countries
+            if name in (c["region"].casefold(), c["subregion"].casefold())
+        ]
+        if not matches:
+            return await delay() or JSONResponse({"status": 404}, status_code=404)
+        return await delay() or JSONResponse(matches)
+
+    async def name(request: Request) -> Response:
+        country = by_name.get(request.path_params["name"].casefold())
+        if country is None:
+            return await delay() or JSONResponse({"status": 404}, status_code=404)
+        return await delay() or JSONResponse([country])
+
+    def coordinates(request: Request) -> tuple[float, float] | None:
+        if not request.query_params.get("appid"):
+            return None
+        return float(request.query_params["lat"]), float(request.query_params["lon"])
+
+    async def weather(request: Request) -> Response:
+        location = coordinates(request)
+        if location is None:
+            return JSONResponse({"cod": 401}, status_code=401)
+        now = time.time()
+        return await delay() or JSONResponse(
+            {"dt": int(now), "main": {"temp": temperature(*location, now)}}
+        )
+
+    async def forecast(request: Request) -> Response:
+        location = coordinates(request)
+        if location is None:
+            return JSONResponse({"cod": 401}, status_code=401)
+        start = int(time.time() // 10800 + 1) * 10800
+        slots = int(request.query_params.get("cnt", 40))
+        return await delay() or JSONResponse(
+            {
+                "cnt": slots,
+                "list": [
+                    {
+                        "dt": start + i * 10800,
+                        "main": {"temp": temperature(*location, start + i * 10800)},
+                    }
+                    for i in range(slots)
+                ],
+            }
+        )
+
+    async def chart(request: Request) -> Response:
+        await request.body()
+        return await delay() or Response(PNG, media_type="image/png")
+
+    return Starlette(
+        routes=[
+            Route("/v3.1/all", all_countries),
+            Route("/v3.1/region/{region}", region),
+            Route("/v3.1/name/{name}", name),
+            Route("/data/2.5/weather", weather),
+            Route("/data/2.5/forecast", forecast),
+            Route("/chart", chart, methods=["POST"]),
+        ]
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Run the fake upstream.
+    :param argv: The command line arguments, by default those of the process.
+    """
+    parser = argparse.ArgumentParser(description="Run the fake upstream APIs.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--latency", type=float, default=50, help="The mean latency in ms."
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=10,
+        help="The maximum deviation from the mean latency in ms.",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="The fraction of the requests answered with a 503.",
+    )
+    parser.add_argument(
+        "--countries", type=int, default=250, help="The number of countries."
+    )
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    behavior = Behavior(args.latency / 1000, args.jitter / 1000, args.error_rate)
+    uvicorn.run(
+        create_app(behavior, make_countries(args.countries)),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+An open-loop load generator: requests are sent at a fixed rate whatever the
+response times, and every latency is measured from the time its request was
+scheduled, so a slow server cannot hide its queueing delay.
+
+    python -m bench.loadgen --url http://127.0.0.1:8000 --rps 200 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import string
+import time
+from dataclasses import dataclass, field
+
+import httpx
+
+from bench.fake_upstream import REGIONS
+
+# The routes of the default scenario: template of the path and relative weight.
+# The placeholders are replaced by a random value for every request.
+ROUTES = {
+    "/country": 1,
+    "/country/{country}": 4,
+    "/country/{country}/temperature": 4,
+    "/country/{country}/forecast/{days}": 1,
+    "/country/search?q={prefix}": 2,
+    "/country/nearest?lat={lat}&lon={lon}&k=5": 1,
+    "/country/warmest?continent={region}&k=3": 1,
+    "/country/info?continent={region}": 1,
+    "/favorite": 1,
+}
+
+
+def fill(template: str, countries: int, rng: random.Random) -> str:
+    """
+    Replace the placeholders of a route template by random values.
+    :param template: The template of the path.
+    :param countries: The number of countries of the fake upstream.
+    :param rng: The random generator.
+    :return: The path.
+    """
+    return template.format(
+        country=f"Country {rng.randint(1, countries)}",
+        days=rng.randint(1, 5),
+        prefix=rng.choice(["Country ", "C", "Republic"])
+        + rng.choice(string.digits[1:]),
+        region=rng.choice(list(REGIONS)),
+        lat=round(rng.uniform(-90, 90), 2),
+        lon=round(rng.uniform(-180, 180), 2),
+    )
+
+
+@dataclass
+class RouteStats:
+    """
+    The results of the requests of one route.
+    """
+
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+
+    def record(self, latency: float, status_code: int | None) -> None:
+        """
+        Record a response.
+        :param latency: The latency in seconds.
+        :param status_code: The status code, or None if the request failed.
+        """
+        self.latencies.append(latency)
+        self.statuses[status_code or 0] = self.statuses.get(status_code or 0, 0) + 1
+        if status_code is None or status_code >= 500:
+            self.errors += 1
+
+    def summary(self, duration: float) -> dict:
+        """
+        Summarize the results.
+        :param duration: The duration of the run in seconds.
+        :return: The number of requests, the throughput, the number of errors and the
+            latency percentiles in milliseconds.
+        """
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / duration, 1),
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        }
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Get a percentile of sorted values, with the nearest-rank method.
+    :param values: The sorted values.
+    :param percent: The percentile, between 0 and 100.
+    :return: The percentile, or 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+async def run(
+    url: str,
+    rps: float,
+    duration: float,
+    routes: dict[str, float] = ROUTES,
+    countries: int = 250,
+    connections: int = 256,
+    seed: int = 0,
+) -> dict[str, RouteStats]:
+    """
+    Send requests at a fixed rate.
+    :param url: The base URL of the application.
+    :param rps: The number of requests per second.
+    :param duration: The number of seconds to send requests for.
+    :param routes: The route templates and their relative weights.
+    :param countries: The number of countries of the fake upstream.
+    :param connections: The maximum number of connections to the application.
+    :param seed: The seed of the random generator, for reproducible runs.
+    :return: The results by route template.
+    """
+    rng = random.Random(seed)
+    templates = list(routes)
+    weights = list(routes.values())
+    stats = {template: RouteStats() for template in templates}
+    limits = httpx.Limits(
+        max_connections=connections, max_keepalive_connections=connections
+    )
+
+    async with httpx.AsyncClient(
+        base_url=url, limits=limits, timeout=httpx.Timeout(30.0)
+    ) as client:
+
+        async def send(template: str, path: str, scheduled: float) -> None:
+            try:
+                response = await client.get(path)
+                status_code = response.status_code
+            except httpx.HTTPError:
+                status_code = None
+            stats[template].record(time.perf_counter() - scheduled, status_code)
+
+        tasks = set()
+        start = time.perf_counter()
+        for i in range(int(rps * duration)):
+            scheduled = start + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            template = rng.choices(templates, weights)[0]
+            task = asyncio.create_task(
+                send(template, fill(template, countries, rng), scheduled)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    return stats
+
+
+def report(stats: dict[str, RouteStats], duration: float) -> dict[str, dict]:
+    """
+    Print the results as a table.
+    :param stats: The results by route template.
+    :param duration: The duration of the run in seconds.
+    :return: The summaries by route template, with the total under "all".
+    """
+    total = RouteStats()
+    for route_stats in stats.values():
+        total.latencies.extend(route_stats.latencies)
+        total.errors += route_stats.errors
+        for status_code, count in route_stats.statuses.items():
+            total.statuses[status_code] = total.statuses.get(status_code, 0) + count
+    summaries = {template: s.summary(duration) for template, s in stats.items()}
+    summaries["all"] = total.summary(duration)
+
+    width = max(len(template) for template in summaries)
+    print(
+        f"{'route':<{width}} {'requests':>8} {'rps':>8} {'errors':>6} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for template, summary in summaries.items():
+        print(
+            f"{template:<{width}} {summary['requests']:>8} {summary['rps']:>8} "
+            f"{summary['errors']:>6} {summary['p50']:>8} {summary['p95']:>8} "
+            f"{summary['p99']:>8} {summary['max']:>8}"
+        )
+    return summaries
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the options of the load generator to a parser.
+    :param parser: The parser.
+    """
+    parser.add_argument(
+        "--rps", type=float, default=100, help="The number of requests per second."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="The duration in seconds."
+    )
+    parser.add_argument(
+        "--routes",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Only request these route templates, with equal weights.",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=256,
+        help="The maximum number of connections to the application.",
+    )
+    parser.add_argument(
+        "--countries",
+        type=int,
+        default=250,
+        help="The number of countries of the fake upstream.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--json", type=str, default=None, help="Write the results to a JSON file."
+    )
+
+
+def routes_from_args(args: argparse.Namespace) -> dict[str, float]:
+    """
+    Get the routes to request.
+    :param args: The options added by add_arguments.
+    :return: The route templates and their relative weights.
+    """
+    return {route: 1 for route in args.routes} if args.routes else ROUTES
+
+
+def run_from_args(url: str, args: argparse.Namespace) -> dict[str, dict]:
+    """
+    Run the load generator with parsed options, and report the results.
+    :param url: The base URL of the application.
+    :param args: The options added by add_arguments.
+    :return: The summaries by route template.
+    """
+    stats = asyncio.run(
+        run(
+            url,
+            args.rps,
+            args.duration,
+            routes_from_args(args),
+            args.countries,
+            args.connections,
+            args.seed,
+        )
+    )
+    summaries = report(stats, args.duration)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {"rps": args.rps, "duration": args.duration, "routes": summaries},
+                f,
+                indent=4,
+            )
+    return summaries
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Run the load generator against a running application.
+    :param argv: The command line arguments, by default those of the process.
+    """
+    parser = argparse.ArgumentParser(description="Send requests at a fixed rate.")
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="http://127.0.0.1:8000",
+        help="The base URL of the application.",
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    run_from_args(args.url, args)
+
+
+if __name__ == "__main__":
+    main()
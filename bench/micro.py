@@ -0,0 +1,300 @@
+"""
+Microbenchmarks of the handlers. The application is called in-process through
+an ASGI transport, and the upstream APIs are replaced by the fake upstream,
+also called in-process, so the results measure the code of the application
+only. Every benchmark reports its operations per second and the peak memory
+it allocates per operation.
+
+    python -m bench.micro                # compare with the baseline
+    python -m bench.micro --update       # write the baseline
+    python -m bench.micro get_country    # run some benchmarks only
+
+The run fails when a benchmark is slower, or allocates more, than its baseline
+by more than the threshold, and when a benchmark has no baseline. Baselines
+depend on the machine, so they are not committed: record them with --update on
+the machine that runs the comparison, before the change being measured.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import httpx
+
+from bench.fake_upstream import Behavior, create_app, make_countries
+
+BASELINE_PATH = "bench/micro_baseline.json"
+# The relative slowdown or allocation growth over the baseline that fails the run
+THRESHOLD = 0.2
+UPSTREAM_URL = "http://upstream"
+COUNTRY = "Country 7"
+
+
+@dataclass
+class Benchmark:
+    """
+    An operation to measure.
+    """
+
+    name: str
+    run: Callable[[], Awaitable]
+    setup: Callable[[], None] | None = None
+
+
+async def measure(benchmark: Benchmark, seconds: float) -> dict:
+    """
+    Measure the operations per second and the allocations of a benchmark.
+    The setup of every operation, if any, is not measured.
+
+    :param benchmark: The benchmark.
+    :param seconds: The minimum number of seconds to run the operation for.
+
+    :return: The operations per second, and the peak bytes allocated per operation.
+    """
+    gc.collect()
+    # Warm up the caches and the code paths
+    for _ in range(3):
+        if benchmark.setup:
+            benchmark.setup()
+        await benchmark.run()
+
+    operations = 0
+    elapsed = 0.0
+    while elapsed < seconds:
+        if benchmark.setup:
+            benchmark.setup()
+        start = time.perf_counter()
+        await benchmark.run()
+        elapsed += time.perf_counter() - start
+        operations += 1
+
+    # The allocations are measured separately, as tracing slows everything down
+    allocations = max(10, min(operations, 100))
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(allocations):
+        if benchmark.setup:
+            benchmark.setup()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await benchmark.run()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        "ops_per_second": round(operations / elapsed, 1),
+        "peak_bytes": allocated // allocations,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare results with their baseline.
+    :param results: The results by benchmark name.
+    :param baseline: The baseline results by benchmark name.
+    :param threshold: The relative regression that fails the run.
+    :return: The regressions and the benchmarks without a baseline, as messages.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            regressions.append(f"{name}: no baseline, run with --update to record one")
+            continue
+        if result["ops_per_second"] < base["ops_per_second"] * (1 - threshold):
+            regressions.append(
+                f"{name}: {result['ops_per_second']} ops/s, "
+                f"baseline {base['ops_per_second']} ops/s"
+            )
+        if result["peak_bytes"] > base["peak_bytes"] * (1 + threshold):
+            regressions.append(
+                f"{name}: {result['peak_bytes']} bytes/op, "
+                f"baseline {base['peak_bytes']} bytes/op"
+            )
+    return regressions
+
+
+async def run(names: list[str], seconds: float) -> dict:
+    """
+    Run the benchmarks against the application with the fake upstream.
+    :param names: The names of the benchmarks to run, or an empty list for all.
+    :param seconds: The minimum number of seconds to run every benchmark for.
+    :return: The results by benchmark name.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        # The index is loaded from a snapshot, and the application is configured
+        # before it is imported
+        snapshot = os.path.join(directory, "countries.json")
+        countries = make_countries()
+        with open(snapshot, "w", encoding="utf-8") as f:
+            json.dump(countries, f)
+        os.environ.update(
+            {
+                "APP_API_KEY": "bench",
+                # The fake upstream has no quota
+                "APP_OWM_CALLS_PER_MINUTE": "1000000",
+                "APP_PREFETCH": "off",
+                "APP_COUNTRIES_SNAPSHOT": snapshot,
+                "APP_REST_COUNTRIES_URL": f"{UPSTREAM_URL}/v3.1",
+                "APP_OPENWEATHERMAP_URL": f"{UPSTREAM_URL}/data/2.5",
+                "APP_QUICKCHART_URL": f"{UPSTREAM_URL}/chart",
+                "APP_CHART_WORKERS": "1",
+            }
+        )
+        from app import app
+        from src import country, quota, weather
+
+        async with app.router.lifespan_context(app):
+            # The upstream calls go to the fake upstream, in-process, with the
+            # API key added by the quota transport as in the application
+            await app.state.http_client.aclose()
+            upstream = httpx.AsyncClient(
+                transport=quota.QuotaTransport(
+                    httpx.ASGITransport(app=create_app(Behavior(), countries)),
+                    quota.key_pool,
+                )
+            )
+            app.state.http_client = upstream
+            client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url="http://bench"
+            )
+            timestamps = [1_700_000_000 + i * 10800 for i in range(40)]
+            renders = iter(range(sys.maxsize))
+
+            async def get(url: str) -> None:
+                response = await client.get(url)
+                assert response.status_code < 400, (url, response.status_code)
+
+            async def add_and_remove_favorite() -> None:
+                for method in ("POST", "DELETE"):
+                    response = await client.request(
+                        method, "/favorite", json={"name": COUNTRY}
+                    )
+                    assert response.status_code == 200, response.text
+
+            async def render_chart() -> None:
+                # A new temperature every time, so the chart is not cached
+                temperatures = [float(next(renders))] + [20.0] * 39
+                await country.get_chart(upstream, timestamps, temperatures, COUNTRY)
+
+            async def translate() -> None:
+                country.translate_hours_to_days(timestamps)
+
+            # Wait for the chart worker to start, so it does not slow down the
+            # first benchmarks
+            await render_chart()
+            await client.post("/favorite", json={"name": "Country 3"})
+            benchmarks = [
+                Benchmark("get_countries", lambda: get("/country")),
+                Benchmark(
+                    "get_countries_region", lambda: get("/country?continent=Europe")
+                ),
+                Benchmark("get_country", lambda: get(f"/country/{COUNTRY}")),
+                Benchmark(
+                    "get_temperature", lambda: get(f"/country/{COUNTRY}/temperature")
+                ),
+                Benchmark(
+                    "get_temperature_miss",
+                    lambda: get(f"/country/{COUNTRY}/temperature"),
+                    setup=weather.current_cache.clear,
+                ),
+                Benchmark(
+                    "get_forecast", lambda: get(f"/country/{COUNTRY}/forecast/3")
+                ),
+                Benchmark(
+                    "get_forecast_miss",
+                    lambda: get(f"/country/{COUNTRY}/forecast/3"),
+                    setup=weather.forecast_cache.clear,
+                ),
+                Benchmark(
+                    "get_chart",
+                    lambda: country.get_chart(
+                        upstream, timestamps, [20.0] * 40, COUNTRY
+                    ),
+                ),
+                Benchmark("get_chart_render", render_chart),
+                Benchmark("translate_hours_to_days", translate),
+                Benchmark("get_favorites", lambda: get("/favorite")),
+                Benchmark(
+                    "get_favorites_expand",
+                    lambda: get("/favorite?expand=info,temperature"),
+                ),
+                Benchmark("add_and_remove_favorite", add_and_remove_favorite),
+            ]
+
+            results = {}
+            for benchmark in benchmarks:
+                if names and benchmark.name not in names:
+                    continue
+                results[benchmark.name] = await measure(benchmark, seconds)
+                print(
+                    f"{benchmark.name:<26} "
+                    f"{results[benchmark.name]['ops_per_second']:>10} ops/s "
+                    f"{results[benchmark.name]['peak_bytes']:>10} bytes/op"
+                )
+            await client.aclose()
+        return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Run the microbenchmarks, and compare them with the baseline.
+    :param argv: The command line arguments, by default those of the process.
+    :return: The exit code, 1 if a benchmark regressed or has no baseline.
+    """
+    parser = argparse.ArgumentParser(description="Run the microbenchmarks.")
+    parser.add_argument(
+        "names", nargs="*", help="The benchmarks to run, by default all of them."
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=1.0,
+        help="The minimum number of seconds every benchmark runs for.",
+    )
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="The relative regression over the baseline that fails the run.",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Write the results to the baseline instead of comparing them.",
+    )
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.names, args.seconds))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.update:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"Wrote {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"No baseline in {args.baseline}, run with --update to record one")
+        return 1
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+The benchmark suite: it starts the fake upstream and the application pointed at
+it, drives the application with the load generator, and reports the throughput
+and the latency percentiles of every route. No internet access or API key is
+needed:
+
+    python -m bench.run --rps 200 --duration 30 --latency 50 --workers 2
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import loadgen
+
+HOST = "127.0.0.1"
+
+
+def start(args: list[str], env: dict[str, str] | None = None) -> subprocess.Popen:
+    """
+    Start a Python module in a subprocess.
+    :param args: The module and its arguments.
+    :param env: Environment variables added to those of this process.
+    :return: The process.
+    """
+    return subprocess.Popen(
+        [sys.executable, "-m", *args],
+        env={**os.environ, **(env or {})},
+    )
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    """
+    Wait until a server answers.
+    :param url: A URL of the server.
+    :param process: The process of the server.
+    :param timeout: The maximum number of seconds to wait.
+    :raises RuntimeError: If the server stopped or did not answer in time.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} stopped with exit code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not answer in {timeout} seconds")
+
+
+def stop(process: subprocess.Popen) -> None:
+    """
+    Stop a server gracefully, or kill it if it does not stop.
+    :param process: The process of the server.
+    """
+    process.terminate()
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Run the benchmark.
+    :param argv: The command line arguments, by default those of the process.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the application against a fake upstream."
+    )
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--upstream_port", type=int, default=9100)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=50,
+        help="The mean latency of the fake upstream in ms.",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=10,
+        help="The maximum deviation from the mean latency in ms.",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="The fraction of the upstream requests answered with a 503.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="The number of server workers."
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=2,
+        help="The number of seconds of load before the measured run.",
+    )
+    loadgen.add_arguments(parser)
+    args, server_args = parser.parse_known_args(argv)
+
+    upstream_url = f"http://{HOST}:{args.upstream_port}"
+    url = f"http://{HOST}:{args.port}"
+    upstream = start(
+        [
+            "bench.fake_upstream",
+            "--port",
+            str(args.upstream_port),
+            "--latency",
+            str(args.latency),
+            "--jitter",
+            str(args.jitter),
+            "--error_rate",
+            str(args.error_rate),
+            "--countries",
+            str(args.countries),
+        ]
+    )
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            wait_ready(f"{upstream_url}/v3.1/all", upstream)
+            # The other options are passed to the server, e.g. --chart_backend
+            server = start(
+                [
+                    "src.server",
+                    "--port",
+                    str(args.port),
+                    "--workers",
+                    str(args.workers),
+                    "--no_access_log",
+                    *server_args,
+                ],
+                env={
+                    "APP_API_KEY": "bench",
+                    # The fake upstream has no quota
+                    "APP_OWM_CALLS_PER_MINUTE": "1000000",
+                    "APP_REST_COUNTRIES_URL": f"{upstream_url}/v3.1",
+                    "APP_OPENWEATHERMAP_URL": f"{upstream_url}/data/2.5",
+                    "APP_QUICKCHART_URL": f"{upstream_url}/chart",
+                    "APP_FAVORITES_DB": os.path.join(directory, "favorites.db"),
+                },
+            )
+            wait_ready(url, server)
+            if args.warmup > 0:
+                print(f"Warming up for {args.warmup} seconds")
+                asyncio.run(
+                    loadgen.run(
+                        url,
+                        args.rps,
+                        args.warmup,
+                        loadgen.routes_from_args(args),
+                        args.countries,
+                        args.connections,
+                        args.seed + 1,
+                    )
+                )
+            print(f"Sending {args.rps} requests per second for {args.duration} s")
+            loadgen.run_from_args(url, args)
+        finally:
+            if server is not None:
+                stop(server)
+            stop(upstream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+The module the worker processes of the server start from: it imports the
+application, and measures how long the process took to get there.
+A spawned worker imports the module of the server, and with it most of the
+application, before this module, so the import is measured from the start of
+the process where possible.
+"""
+
+import os
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+
+def process_age() -> float | None:
+    """
+    Get the time since the process started, from the process table of Linux.
+    :return: The number of seconds, or None if the start of the process is unknown.
+    """
+    try:
+        with open("/proc/self/stat") as file:
+            # The process name may contain spaces, the start time is the 20th
+            # field after it, in clock ticks since the boot
+            ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+        started = ticks / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+from app import app  # noqa: E402
+
+age = process_age()
+app.state.import_seconds = time.perf_counter() - IMPORT_STARTED if age is None else age
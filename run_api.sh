@@ -4,7 +4,7 @@
 
 cleanup() {
   # Get the PID of the Python process
-  local pid=$(ps -ef | grep '[p]ython -m app' | awk '{print $2}')
+  local pid=$(ps -ef | grep '[p]ython -m src.server' | awk '{print $2}')
 
   # If the process is running, kill it
   if [[ -n $pid ]]; then
@@ -42,9 +42,10 @@ run_server() {
     exit 1
   fi
   
-  python -m app --api_key "$1"
+  # The other arguments are passed to the server, e.g. --workers 4
+  python -m src.server --api_key "$@"
 }
 
-run_server "$1"
+run_server "$@"
 
 exit 0
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+This module contains the helpers to fetch the data of many countries
+concurrently, with a bounded number of upstream calls in flight.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import httpx
+from fastapi.responses import StreamingResponse
+
+from src.client import UpstreamError, upstream_error
+from src.models import StreamFormat
+from src.responses import dumps
+
+# The default number of countries fetched at the same time
+BATCH_CONCURRENCY = 10
+
+
+async def fan_out(
+    names: list[str],
+    fetch: Callable[[str], Awaitable[Any]],
+    concurrency: int = BATCH_CONCURRENCY,
+) -> AsyncIterator[tuple[str, Any]]:
+    """
+    Fetch the data of many countries concurrently.
+    The results are yielded as soon as they are available, so in completion
+    order. A failed country yields its UpstreamError instead of failing the
+    whole batch. The pending calls are cancelled if the caller stops iterating.
+
+    :param names: The names of the countries.
+    :param fetch: The coroutine function fetching the data of one country.
+    :param concurrency: The maximum number of countries fetched at the same time.
+
+    :return: An asynchronous iterator of (country name, result or error) pairs.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(name: str) -> tuple[str, Any]:
+        async with semaphore:
+            try:
+                return name, await fetch(name)
+            except UpstreamError as error:
+                return name, error
+            except httpx.HTTPError as error:
+                return name, upstream_error(error)
+
+    tasks = [asyncio.create_task(run(name)) for name in names]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def result_to_dict(name: str, result: Any, key: str) -> dict:
+    """
+    Convert the result of one country to a dictionary for a batch response.
+
+    :param name: The name of the country.
+    :param result: The result, or the UpstreamError of the country.
+    :param key: The key of the result in the dictionary.
+
+    :return: The dictionary, with the error and its status code on failure.
+    """
+    if isinstance(result, UpstreamError):
+        return {"country": name, "error": result.detail, "status": result.status_code}
+    return {"country": name, key: result}
+
+
+def stream_response(
+    names: list[str],
+    fetch: Callable[[str], Awaitable[Any]],
+    key: str,
+    stream: StreamFormat,
+    concurrency: int = BATCH_CONCURRENCY,
+) -> StreamingResponse:
+    """
+    Stream the data of many countries, one line or event per country, as soon
+    as each country is fetched.
+
+    With NDJSON, every line is the JSON object of one country. With
+    Server-Sent Events, every country is a `result` event, and an `end` event
+    is sent once all the countries are done.
+
+    :param names: The names of the countries.
+    :param fetch: The coroutine function fetching the data of one country.
+    :param key: The key of the result in the JSON objects.
+    :param stream: The streaming format.
+    :param concurrency: The maximum number of countries fetched at the same time.
+
+    :return: The streaming response.
+    """
+
+    async def ndjson() -> AsyncIterator[bytes]:
+        async for name, result in fan_out(names, fetch, concurrency):
+            yield dumps(result_to_dict(name, result, key)) + b"\n"
+
+    async def sse() -> AsyncIterator[bytes]:
+        async for name, result in fan_out(names, fetch, concurrency):
+            data = dumps(result_to_dict(name, result, key))
+            yield b"event: result\ndata: " + data + b"\n\n"
+        yield b"event: end\ndata: " + dumps({"count": len(names)}) + b"\n\n"
+
+    if stream == StreamFormat.sse:
+        return StreamingResponse(
+            sse(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
@@ -0,0 +1,401 @@
+"""
+This module contains the in-process caches used in front of the upstream APIs.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any, Awaitable, Callable, Hashable
+
+# All the caches of the application, by name
+caches: dict[str, "TTLCache | ByteLRUCache"] = {}
+# Functions called with the name of a cache and the event it counted ("hit",
+# "stale_hit", "stale_error", "disk_hit", "miss", "coalesced" or "eviction"),
+# e.g. to export
+# the counters as metrics
+listeners: list[Callable[[str, str], None]] = []
+
+
+def _notify(name: str, event: str) -> None:
+    """
+    Notify the listeners of a cache event.
+    :param name: The name of the cache.
+    :param event: The event.
+    """
+    for listener in listeners:
+        listener(name, event)
+
+
+@dataclass
+class CacheEntry:
+    """
+    A value stored in a cache, with the moment it was stored.
+    """
+
+    value: Any
+    created: float = field(default_factory=time.monotonic)
+
+    @property
+    def age(self) -> float:
+        """
+        The number of seconds since the value was stored.
+        """
+        return time.monotonic() - self.created
+
+
+class TTLCache:
+    """
+    A bounded cache with least-recently-used and time-based eviction.
+
+    Values are fresh for `ttl` seconds. After that, they are served stale for
+    another `stale_ttl` seconds while they are reloaded in the background
+    (stale-while-revalidate). Concurrent loads of the same key are collapsed
+    into a single call of the loader (single-flight). If reloading an expired
+    value fails, it is still served for `stale_if_error` seconds.
+
+    A load goes on when its callers are cancelled, so its value is cached for
+    the next ones. The `waiting` function is told who still waits for it, e.g.
+    to lower the priority of the calls of a load nobody waits for any more.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        stale_ttl: float = 0.0,
+        stale_if_error: float = 0.0,
+        waiting: Callable[[asyncio.Task], AbstractContextManager] | None = None,
+    ):
+        """
+        :param name: The name of the cache, used to report its statistics.
+        :param maxsize: The maximum number of entries.
+        :param ttl: The number of seconds a value is fresh.
+        :param stale_ttl: The number of seconds a value is served stale after
+            it expired, while it is being reloaded.
+        :param stale_if_error: The number of seconds a value is served after it
+            expired (and after `stale_ttl`) when it cannot be reloaded.
+        :param waiting: A function returning a context manager entered by every
+            caller while it waits for a load, with the task of the load.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stale_if_error = stale_if_error
+        self.waiting = waiting or (lambda task: nullcontext())
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.stale_errors = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        caches[name] = self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get a value from the cache, loading it if it is missing or expired.
+        :param key: The key of the value.
+        :param loader: The coroutine function that loads the value.
+        :return: The value.
+        """
+        return (await self.get_entry(key, loader)).value
+
+    async def get_entry(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> CacheEntry:
+        """
+        Get an entry from the cache, loading it if it is missing or expired.
+        Errors raised by the loader are not cached: the expired entry is returned
+        instead, if it is recent enough, or the error is raised.
+
+        :param key: The key of the value.
+        :param loader: The coroutine function that loads the value.
+
+        :return: The cache entry.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = entry.age
+            if age < self.ttl:
+                self.hits += 1
+                _notify(self.name, "hit")
+                self._entries.move_to_end(key)
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                _notify(self.name, "stale_hit")
+                self._entries.move_to_end(key)
+                # Nobody waits for the reload
+                with self.waiting(self._load(key, loader)):
+                    pass
+                return entry
+            if age >= self.ttl + self.stale_ttl + self.stale_if_error:
+                del self._entries[key]
+                entry = None
+
+        if key in self._inflight:
+            self.coalesced += 1
+            _notify(self.name, "coalesced")
+        else:
+            self.misses += 1
+            _notify(self.name, "miss")
+        try:
+            return await self._wait(self._load(key, loader))
+        except Exception:
+            if entry is None:
+                raise
+            # The provider is failing: the expired value is better than an error
+            self.stale_errors += 1
+            _notify(self.name, "stale_error")
+            return entry
+
+    async def refresh(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> CacheEntry:
+        """
+        Reload a value, even if it is still fresh, e.g. before it expires.
+        A load of the same key already in progress is reused.
+
+        :param key: The key of the value.
+        :param loader: The coroutine function that loads the value.
+
+        :return: The new cache entry.
+        """
+        return await self._wait(self._load(key, loader))
+
+    def peek(self, key: Hashable) -> CacheEntry | None:
+        """
+        Get an entry without loading it or updating the statistics.
+        :param key: The key of the value.
+        :return: The cache entry, or None if it is not cached.
+        """
+        return self._entries.get(key)
+
+    def set(self, key: Hashable, value: Any) -> CacheEntry:
+        """
+        Store a value in the cache, evicting the least recently used entries
+        if the cache is full.
+        :param key: The key of the value.
+        :param value: The value.
+        :return: The new cache entry.
+        """
+        entry = CacheEntry(value)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            _notify(self.name, "eviction")
+        return entry
+
+    def cache_headers(self, entry: CacheEntry) -> dict[str, str]:
+        """
+        Get the HTTP caching headers of a response built from a cache entry.
+        :param entry: The cache entry.
+        :return: The Age and Cache-Control headers.
+        """
+        age = int(entry.age)
+        max_age = max(int(self.ttl) - age, 0)
+        return {"Age": str(age), "Cache-Control": f"public, max-age={max_age}"}
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Remove a value from the cache.
+        :param key: The key of the value.
+        """
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all the values from the cache.
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of the cache.
+        :return: A dictionary with the size and the hit/miss counters.
+        """
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "stale_errors": self.stale_errors,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+        }
+
+    def _load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> asyncio.Task:
+        """
+        Start loading a value, unless it is already being loaded.
+        :param key: The key of the value.
+        :param loader: The coroutine function that loads the value.
+        :return: The task loading the value.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fill(key, loader))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return task
+
+    async def _wait(self, task: asyncio.Task) -> CacheEntry:
+        """
+        Wait for a load. Cancelling the caller does not cancel the load.
+        :param task: The task loading the value.
+        :return: The new cache entry.
+        """
+        with self.waiting(task):
+            return await asyncio.shield(task)
+
+    async def _fill(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> CacheEntry:
+        return self.set(key, await loader())
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception, so a failed background reload is not reported
+        # as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+
+class ByteLRUCache:
+    """
+    A least-recently-used cache of binary values, bounded by their total size.
+    Values evicted from memory can be spilled to a directory, from where they
+    are loaded back when they are requested again. The keys must be valid file
+    names, such as hashes of the content.
+    """
+
+    def __init__(self, name: str, max_bytes: int, directory: str | None = None):
+        """
+        :param name: The name of the cache, used to report its statistics.
+        :param max_bytes: The maximum total size of the values kept in memory.
+        :param directory: The directory the evicted values are spilled to, if any.
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        caches[name] = self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def configure(self, max_bytes: int, directory: str | None = None) -> None:
+        """
+        Change the size of the cache and the directory it spills to.
+        :param max_bytes: The maximum total size of the values kept in memory.
+        :param directory: The directory the evicted values are spilled to, if any.
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    async def get(self, key: str) -> bytes | None:
+        """
+        Get a value from memory, or from the spill directory.
+        :param key: The key of the value.
+        :return: The value, or None if it is not cached.
+        """
+        value = self._entries.get(key)
+        if value is not None:
+            self.hits += 1
+            _notify(self.name, "hit")
+            self._entries.move_to_end(key)
+            return value
+        if self.directory:
+            try:
+                value = await asyncio.to_thread(self._read, key)
+            except OSError:
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                _notify(self.name, "disk_hit")
+                await self.set(key, value)
+                return value
+        self.misses += 1
+        _notify(self.name, "miss")
+        return None
+
+    async def set(self, key: str, value: bytes) -> None:
+        """
+        Store a value in memory, evicting (and spilling) the least recently used
+        values if the cache is full. Values larger than the cache are not stored.
+        :param key: The key of the value.
+        :param value: The value.
+        """
+        if len(value) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = value
+        self.size += len(value)
+        evicted = []
+        while self.size > self.max_bytes:
+            evicted_key, evicted_value = self._entries.popitem(last=False)
+            self.size -= len(evicted_value)
+            self.evictions += 1
+            _notify(self.name, "eviction")
+            evicted.append((evicted_key, evicted_value))
+        if self.directory and evicted:
+            await asyncio.to_thread(self._spill, evicted)
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of the cache.
+        :return: A dictionary with the size and the hit/miss counters.
+        """
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _read(self, key: str) -> bytes | None:
+        path = os.path.join(self.directory, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _spill(self, entries: list[tuple[str, bytes]]) -> None:
+        for key, value in entries:
+            path = os.path.join(self.directory, key)
+            if os.path.exists(path):
+                continue
+            # Write to a temporary file first, so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
@@ -0,0 +1,206 @@
+"""
+This module renders the forecast charts.
+Charts are drawn in-process with matplotlib, in a pool of worker processes so
+the rasterization does not block the event loop. QuickChart can still be used
+as the backend, and is the fallback when matplotlib is not installed.
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import io
+import json
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from src import timing
+from src.cache import ByteLRUCache
+
+LOCAL = "local"
+QUICKCHART = "quickchart"
+BACKENDS = (LOCAL, QUICKCHART)
+
+MATPLOTLIB_AVAILABLE = importlib.util.find_spec("matplotlib") is not None
+
+# The size of the charts, the same as the QuickChart default
+CHART_WIDTH = 500
+CHART_HEIGHT = 300
+CHART_DPI = 100
+LINE_COLOR = "#36a2eb"
+# The maximum number of labels on the x-axis
+MAX_TICKS = 10
+# Fonts tried for the emojis of the chart titles, if they are installed
+EMOJI_FONTS = ["Noto Emoji", "Noto Color Emoji", "Segoe UI Emoji", "Symbola"]
+CHART_WORKERS = 2
+# The rendered charts kept in memory, by hash of their configuration
+CHART_CACHE_BYTES = 32 * 1024 * 1024
+
+backend = LOCAL if MATPLOTLIB_AVAILABLE else QUICKCHART
+_executor: ProcessPoolExecutor | None = None
+
+chart_cache = ByteLRUCache("charts", max_bytes=CHART_CACHE_BYTES)
+
+
+def set_backend(name: str) -> None:
+    """
+    Set the backend used to render the charts.
+    The local backend is only used if matplotlib is installed.
+    :param name: The name of the backend, "local" or "quickchart".
+    """
+    global backend
+    backend = name if MATPLOTLIB_AVAILABLE else QUICKCHART
+
+
+def chart_key(chart: dict, background_color: str) -> str:
+    """
+    Get the content address of a chart: a hash of everything that changes its
+    image. It is used both as the cache key and as the ETag of the chart.
+
+    :param chart: The Chart.js configuration of the chart.
+    :param background_color: The background color, or "transparent".
+
+    :return: The hexadecimal SHA-256 hash.
+    """
+    canonical = json.dumps(
+        {"backend": backend, "background": background_color, "chart": chart},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Check whether an If-None-Match header matches an ETag.
+    :param if_none_match: The value of the If-None-Match header, if any.
+    :param etag: The quoted ETag.
+    :return: Whether the client already has the representation.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def start(workers: int = CHART_WORKERS) -> None:
+    """
+    Start the worker processes rendering the charts, if the local backend is used.
+    :param workers: The number of worker processes.
+    """
+    global _executor
+    if backend != LOCAL:
+        return
+    _executor = ProcessPoolExecutor(workers, initializer=_init_worker)
+    # Launch the workers now, so the first chart does not pay for it
+    _executor.submit(int)
+
+
+def shutdown() -> None:
+    """
+    Stop the worker processes rendering the charts.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def render(chart: dict, background_color: str) -> bytes:
+    """
+    Render a chart in a worker process.
+    :param chart: The Chart.js configuration of the chart.
+    :param background_color: The background color, or "transparent".
+    :return: The chart as a PNG image.
+    """
+    loop = asyncio.get_running_loop()
+    with timing.span("render"):
+        return await loop.run_in_executor(
+            _executor, render_chart, chart, background_color
+        )
+
+
+def _init_worker() -> None:
+    """
+    Import matplotlib and pick the fonts once per worker process.
+    """
+    import matplotlib
+    from matplotlib import font_manager
+
+    matplotlib.use("Agg")
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    matplotlib.rcParams["font.family"] = ["DejaVu Sans"] + [
+        font for font in EMOJI_FONTS if font in installed
+    ]
+
+
+def _label(options: dict, axis: str, default: str) -> str:
+    """
+    Get the label of an axis from the Chart.js (version 2) options.
+    :param options: The options of the chart.
+    :param axis: The axis, "xAxes" or "yAxes".
+    :param default: The label if the options have none.
+    :return: The label.
+    """
+    try:
+        return options["scales"][axis][0]["scaleLabel"]["labelString"]
+    except (KeyError, IndexError):
+        return default
+
+
+def render_chart(chart: dict, background_color: str = "transparent") -> bytes:
+    """
+    Render a Chart.js line chart as a PNG image.
+    Only the parts of the configuration used by the forecast charts are supported:
+    the labels, the datasets with their label and data, and the axis labels.
+
+    :param chart: The Chart.js configuration of the chart.
+    :param background_color: The background color, or "transparent".
+
+    :return: The chart as a PNG image.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    data = chart["data"]
+    options = chart.get("options", {})
+    labels = data["labels"]
+    positions = range(len(labels))
+
+    figure = Figure(
+        figsize=(CHART_WIDTH / CHART_DPI, CHART_HEIGHT / CHART_DPI), dpi=CHART_DPI
+    )
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for dataset in data["datasets"]:
+        axes.plot(
+            positions,
+            dataset["data"],
+            label=dataset.get("label"),
+            color=LINE_COLOR,
+            marker="o",
+            markersize=3,
+        )
+
+    step = max(1, -(-len(labels) // MAX_TICKS))
+    axes.set_xticks(positions[::step], labels[::step], rotation=45, ha="right")
+    axes.tick_params(labelsize=7)
+    axes.set_xlabel(_label(options, "xAxes", "Date"))
+    axes.set_ylabel(_label(options, "yAxes", "Temperature"))
+    axes.grid(alpha=0.3)
+    # The legend is drawn above the chart, like Chart.js does
+    axes.legend(loc="lower center", bbox_to_anchor=(0.5, 1.0), frameon=False)
+
+    transparent = background_color == "transparent"
+    if not transparent:
+        figure.set_facecolor(background_color)
+
+    buffer = io.BytesIO()
+    with warnings.catch_warnings():
+        # The emojis are missing from the fonts if no emoji font is installed
+        warnings.simplefilter("ignore", UserWarning)
+        figure.tight_layout()
+        figure.savefig(buffer, format="png", transparent=transparent)
+    return buffer.getvalue()
@@ -0,0 +1,173 @@
+"""
+This module contains the shared HTTP client used to call the upstream APIs.
+The client is created once in the application lifespan and injected into the
+routers, so requests reuse warm (keep-alive) connections instead of opening a
+new connection pool for every call.
+"""
+
+import ssl
+from dataclasses import dataclass
+
+import httpx
+from fastapi import Request, Response, status
+
+from src import metrics, quota, resilience, timing
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:  # pragma: no cover - depends on the environment
+    HTTP2_AVAILABLE = False
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream API does not return the expected response.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        """
+        :param status_code: The status code to answer the client with.
+        :param detail: The error message.
+        """
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+    def to_response(self) -> Response:
+        """
+        Convert the error to a response.
+        :return: The error response.
+        """
+        return Response(status_code=self.status_code, content=self.detail)
+
+
+def upstream_error(error: httpx.HTTPError) -> UpstreamError:
+    """
+    Convert an error of the HTTP client to the error answered to the client.
+    :param error: The error of the HTTP client.
+    :return: A 503 if the upstream API is failing, a 504 if it timed out, or a
+        502 otherwise.
+    """
+    if isinstance(error, resilience.CircuitOpenError):
+        return UpstreamError(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            "The upstream API is unavailable, try again later",
+        )
+    if isinstance(error, httpx.TimeoutException):
+        return UpstreamError(
+            status.HTTP_504_GATEWAY_TIMEOUT, "The upstream API did not answer in time"
+        )
+    return UpstreamError(
+        status.HTTP_502_BAD_GATEWAY, "Error contacting the upstream API"
+    )
+
+
+@dataclass
+class ClientSettings:
+    """
+    The settings of the shared HTTP client.
+    The connection limits, the retries and the circuit breaker are applied per
+    upstream host.
+    """
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 10.0
+    http2: bool = True
+    retries: int = resilience.RETRIES
+    retry_backoff: float = resilience.RETRY_BACKOFF
+    budget: float = resilience.BUDGET
+    breaker_threshold: int = resilience.BREAKER_THRESHOLD
+    breaker_reset: float = resilience.BREAKER_RESET
+    hedge: bool = False
+
+
+def _origin(url: str) -> str:
+    """
+    Get the origin (scheme, host and port) of a URL.
+    :param url: The URL.
+    :return: The origin of the URL, usable as an httpx mount pattern.
+    """
+    parsed = httpx.URL(url)
+    origin = f"{parsed.scheme}://{parsed.host}"
+    if parsed.port:
+        origin += f":{parsed.port}"
+    return origin
+
+
+def _transport(
+    settings: ClientSettings, ssl_context: ssl.SSLContext, name: str
+) -> httpx.AsyncBaseTransport:
+    """
+    Create a transport with its own connection pool and circuit breaker.
+    Every attempt it makes takes a call from the OpenWeatherMap quota if it
+    calls OpenWeatherMap, and is measured for the metrics and the Server-Timing
+    header.
+
+    :param settings: The client settings.
+    :param ssl_context: The SSL context shared by all the transports.
+    :param name: The name of the host, used in the logs.
+
+    :return: The transport.
+    """
+    transport = httpx.AsyncHTTPTransport(
+        verify=ssl_context,
+        limits=httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+        ),
+        http2=settings.http2 and HTTP2_AVAILABLE,
+    )
+    return resilience.ResilientTransport(
+        quota.QuotaTransport(
+            metrics.instrument(timing.TimingTransport(transport)), quota.key_pool
+        ),
+        resilience.CircuitBreaker(
+            name, settings.breaker_threshold, settings.breaker_reset
+        ),
+        retries=settings.retries,
+        backoff=settings.retry_backoff,
+        budget=settings.budget,
+        hedge=settings.hedge,
+    )
+
+
+def create_client(settings: ClientSettings, hosts: list[str]) -> httpx.AsyncClient:
+    """
+    Create the shared HTTP client.
+    Every upstream host gets its own transport (and so its own connection pool),
+    which makes the connection limits apply per host.
+
+    :param settings: The client settings.
+    :param hosts: The URLs of the upstream APIs.
+
+    :return: The HTTP client.
+    """
+    # Loading the certificates is slow, so it is done once for all the transports
+    http2 = settings.http2 and HTTP2_AVAILABLE
+    ssl_context = httpx.create_ssl_context(http2=http2)
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            settings.read_timeout,
+            connect=settings.connect_timeout,
+        ),
+        transport=_transport(settings, ssl_context, "default"),
+        mounts={
+            _origin(host): _transport(settings, ssl_context, _origin(host))
+            for host in hosts
+        },
+    )
+
+
+def get_client(request: Request) -> httpx.AsyncClient:
+    """
+    Dependency returning the shared HTTP client of the application.
+    :param request: The incoming request.
+    :return: The HTTP client.
+    """
+    return request.app.state.http_client
@@ -0,0 +1,326 @@
+"""
+This module contains the settings of the application.
+Every setting is read from an environment variable (`APP_` followed by the
+setting name in capitals, e.g. `APP_API_KEY`), and can be overridden on the
+command line. The server passes its settings to the worker processes through
+the environment, so nothing is parsed when the application is imported.
+"""
+
+import argparse
+import os
+from dataclasses import Field, dataclass, field, fields
+from typing import Any, get_args
+
+from src import quota, resilience, upstream
+from src.batch import BATCH_CONCURRENCY
+from src.chart import BACKENDS, CHART_CACHE_BYTES, CHART_WORKERS
+from src.chart import backend as CHART_BACKEND
+from src.country_index import REFRESH_INTERVAL
+from src.prefetch import HOT as PREFETCH_HOT
+from src.prefetch import INTERVAL as PREFETCH_INTERVAL
+from src.prefetch import MODES as PREFETCH_MODES
+from src.profiling import PROFILE_DIR, SLOW_THRESHOLD
+from src.weather import SHARE_RADIUS
+
+ENV_PREFIX = "APP_"
+TRUE_VALUES = {"1", "true", "yes"}
+
+
+def _setting(default: Any, help: str, **kwargs) -> Any:
+    """
+    Declare a setting.
+    :param default: The default value.
+    :param help: The description of the setting.
+    :param kwargs: Other arguments of the command line option, such as choices.
+    :return: The dataclass field.
+    """
+    return field(default=default, metadata={"help": help, **kwargs})
+
+
+@dataclass
+class Settings:
+    """
+    The settings of the application and of the server running it.
+    """
+
+    # The OpenWeatherMap API
+    api_key: str = _setting(
+        "",
+        "The API key for the OpenWeatherMap API, or several API keys separated "
+        "by commas to share the calls between them.",
+    )
+    owm_calls_per_minute: float = _setting(
+        quota.CALLS_PER_MINUTE,
+        "The maximum number of calls per minute of every OpenWeatherMap API key, "
+        "shared by all the workers.",
+    )
+    owm_queue_timeout: float = _setting(
+        quota.QUEUE_TIMEOUT,
+        "The number of seconds a request waits for the OpenWeatherMap quota "
+        "before failing with a 503.",
+    )
+    weather_share_km: float = _setting(
+        SHARE_RADIUS,
+        "Capitals closer than this number of kilometers share their weather, "
+        "0 to fetch the weather of every capital.",
+    )
+    # The upstream APIs
+    rest_countries_url: str = _setting(
+        upstream.REST_COUNTRIES_URL, "The base URL of the REST Countries API."
+    )
+    openweathermap_url: str = _setting(
+        upstream.OPENWEATHERMAP_URL, "The base URL of the OpenWeatherMap API."
+    )
+    quickchart_url: str = _setting(
+        upstream.QUICKCHART_URL, "The URL of the QuickChart chart API."
+    )
+    # The upstream HTTP client
+    max_connections: int = _setting(
+        100, "The maximum number of connections per upstream host."
+    )
+    max_keepalive_connections: int = _setting(
+        20, "The maximum number of idle keep-alive connections per upstream host."
+    )
+    keepalive_expiry: float = _setting(
+        30.0, "The number of seconds an idle keep-alive connection is kept open."
+    )
+    connect_timeout: float = _setting(
+        5.0, "The timeout in seconds to connect to an upstream host."
+    )
+    read_timeout: float = _setting(
+        10.0, "The timeout in seconds to read, write and acquire a pooled connection."
+    )
+    http2: bool = _setting(True, "Use HTTP/2 for the upstream connections.")
+    retries: int = _setting(
+        resilience.RETRIES,
+        "The maximum number of retries of an upstream GET request that failed "
+        "with a connection error, a timeout or a 502/503/504.",
+    )
+    retry_backoff: float = _setting(
+        resilience.RETRY_BACKOFF,
+        "The base number of seconds waited before a retry, doubled on every "
+        "retry and randomized.",
+    )
+    upstream_budget: float = _setting(
+        resilience.BUDGET,
+        "The maximum number of seconds of all the attempts of an upstream request.",
+    )
+    breaker_threshold: int = _setting(
+        resilience.BREAKER_THRESHOLD,
+        "The number of consecutive failures of an upstream host after which it "
+        "is not called for a while.",
+    )
+    breaker_reset: float = _setting(
+        resilience.BREAKER_RESET,
+        "The number of seconds a failing upstream host is not called for.",
+    )
+    hedge: bool = _setting(
+        False,
+        "Send a second upstream GET request when the first is slower than the "
+        "95th percentile of the recent latencies, and use the fastest response.",
+    )
+    # The weather prefetcher
+    prefetch: str = _setting(
+        PREFETCH_HOT,
+        "Which weather is reloaded in the background before it expires: `hot` "
+        "for the favorite and the most requested countries, `all` for all the "
+        "capitals, or `off`.",
+        choices=PREFETCH_MODES,
+    )
+    prefetch_interval: float = _setting(
+        PREFETCH_INTERVAL,
+        "The number of seconds between two checks of the weather to reload.",
+    )
+    # The country index
+    countries_snapshot: str | None = _setting(
+        None,
+        "A JSON file with all the countries, loaded at startup instead of "
+        "fetching them. It is updated on every refresh of the country index.",
+    )
+    countries_refresh: float = _setting(
+        REFRESH_INTERVAL,
+        "The number of seconds between two refreshes of the country index.",
+    )
+    # The batch paths
+    batch_concurrency: int = _setting(
+        BATCH_CONCURRENCY,
+        "The maximum number of countries fetched at the same time by the batch "
+        "paths.",
+    )
+    # The charts
+    chart_backend: str = _setting(
+        CHART_BACKEND,
+        "Render the forecast charts locally (requires matplotlib) or with "
+        "QuickChart.",
+        choices=BACKENDS,
+    )
+    chart_workers: int = _setting(
+        CHART_WORKERS,
+        "The number of processes rendering the charts locally, per server worker.",
+    )
+    chart_cache_bytes: int = _setting(
+        CHART_CACHE_BYTES,
+        "The maximum total size of the rendered charts kept in memory.",
+    )
+    chart_cache_dir: str | None = _setting(
+        None, "A directory the rendered charts evicted from memory are spilled to."
+    )
+    # The favorites
+    favorites_db: str | None = _setting(
+        None,
+        "An SQLite database storing the favorite countries, shared by all the "
+        "workers. If not given, every worker keeps its own favorites in memory.",
+    )
+    # The metrics and the profiles
+    metrics_dir: str | None = _setting(
+        None,
+        "The directory the workers write their metrics to, so /metrics covers "
+        "all of them. If not given, a temporary directory is used with several "
+        "workers.",
+    )
+    server_timing: bool = _setting(
+        True, "Add a Server-Timing header with the time spent in every phase."
+    )
+    admin_key: str | None = _setting(
+        None,
+        "A key allowing to profile a request with `?profile=1` and an "
+        "X-Admin-Key header.",
+    )
+    profile_rate: float = _setting(
+        0.0, "The fraction of the requests profiled, written if they are slow."
+    )
+    profile_slow: float = _setting(
+        SLOW_THRESHOLD,
+        "The number of seconds after which a profiled request is written.",
+    )
+    profile_dir: str = _setting(
+        PROFILE_DIR, "The directory the profiles of the requests are written to."
+    )
+    # The server
+    host: str = _setting("127.0.0.1", "The address the server listens on.")
+    port: int = _setting(8000, "The port the server listens on.")
+    workers: int = _setting(1, "The number of worker processes.")
+    loop: str = _setting(
+        "auto",
+        "The event loop. `auto` uses uvloop when it is installed.",
+        choices=("auto", "asyncio", "uvloop"),
+    )
+    http: str = _setting(
+        "auto",
+        "The HTTP parser. `auto` uses httptools when it is installed.",
+        choices=("auto", "h11", "httptools"),
+    )
+    backlog: int = _setting(
+        2048, "The maximum number of connections waiting to be accepted."
+    )
+    keep_alive: int = _setting(
+        5, "The number of seconds an idle client connection is kept open."
+    )
+    limit_concurrency: int | None = _setting(
+        None,
+        "The maximum number of connections and tasks per worker, after which "
+        "new requests get a 503.",
+    )
+    graceful_shutdown: int = _setting(
+        30,
+        "The number of seconds the requests in progress are given to finish "
+        "on SIGTERM, before the workers stop.",
+    )
+    access_log: bool = _setting(True, "Log every request.")
+    reload: bool = _setting(
+        False, "Reload the server when the code changes, for development."
+    )
+
+    @property
+    def worker_processes(self) -> int:
+        """
+        The number of worker processes the server runs, a single one when it
+        reloads on code changes.
+        """
+        return 1 if self.reload else max(self.workers, 1)
+
+    @classmethod
+    def from_env(cls, environ: dict[str, str] | None = None) -> "Settings":
+        """
+        Read the settings from the environment.
+        :param environ: The environment variables, by default those of the process.
+        :return: The settings.
+        """
+        environ = os.environ if environ is None else environ
+        values = {}
+        for setting in fields(cls):
+            value = environ.get(ENV_PREFIX + setting.name.upper())
+            if value is not None:
+                values[setting.name] = _convert(setting, value)
+        return cls(**values)
+
+    def to_env(self) -> dict[str, str]:
+        """
+        Get the environment variables holding the settings.
+        :return: The environment variables of the settings that are set.
+        """
+        environ = {}
+        for setting in fields(self):
+            value = getattr(self, setting.name)
+            if isinstance(value, bool):
+                value = "1" if value else "0"
+            if value is not None:
+                environ[ENV_PREFIX + setting.name.upper()] = str(value)
+        return environ
+
+
+def _base_type(setting: Field) -> type:
+    """
+    Get the type of a setting, without None for an optional setting.
+    :param setting: The dataclass field of the setting.
+    :return: The type.
+    """
+    types = [kind for kind in get_args(setting.type) if kind is not type(None)]
+    return types[0] if types else setting.type
+
+
+def _convert(setting: Field, value: str) -> Any:
+    """
+    Convert the value of an environment variable to the type of a setting.
+    :param setting: The dataclass field of the setting.
+    :param value: The value of the environment variable.
+    :return: The converted value. An empty value unsets an optional setting.
+    """
+    kind = _base_type(setting)
+    if kind is bool:
+        return value.lower() in TRUE_VALUES
+    if not value and get_args(setting.type):
+        return None
+    return kind(value)
+
+
+def parse_args(argv: list[str] | None = None) -> Settings:
+    """
+    Read the settings from the environment and the command line.
+    The command line options take precedence over the environment variables.
+    :param argv: The command line arguments, by default those of the process.
+    :return: The settings.
+    """
+    defaults = Settings.from_env()
+    parser = argparse.ArgumentParser(description="Run the FastAPI application.")
+    for setting in fields(Settings):
+        default = getattr(defaults, setting.name)
+        variable = ENV_PREFIX + setting.name.upper()
+        help = f"{setting.metadata['help']} Environment variable: {variable}."
+        if isinstance(default, bool):
+            # Booleans are switched with --name, or --no_name when they are on
+            parser.add_argument(
+                f"--no_{setting.name}" if default else f"--{setting.name}",
+                dest=setting.name,
+                action="store_false" if default else "store_true",
+                help=help,
+            )
+            continue
+        parser.add_argument(
+            f"--{setting.name}",
+            type=_base_type(setting),
+            default=default,
+            choices=setting.metadata.get("choices"),
+            help=help,
+        )
+    return Settings(**vars(parser.parse_args(argv)))
@@ -2,11 +2,30 @@
 Module for the country resource
 """
 
-import json
-from datetime import datetime, timedelta
+import asyncio
+import heapq
+from datetime import datetime, timezone
+from functools import lru_cache
 
 import httpx
-from fastapi import APIRouter, Path, Query, Response, status
+from fastapi import APIRouter, Depends, Header, Path, Query, Response, status
+
+from src import chart, timing, upstream
+from src.batch import BATCH_CONCURRENCY, fan_out, result_to_dict, stream_response
+from src.cache import CacheEntry, TTLCache
+from src.client import UpstreamError, get_client
+from src.country_index import CountryIndex, get_index
+from src.geo import MAX_DISTANCE_KM
+from src.models import StreamFormat
+from src.responses import EncodedJSONResponse, JSONResponse, wants_pretty
+from src.search import MAX_RESULTS
+from src.weather import (
+    current_cache,
+    fetch_forecast,
+    fetch_temperature,
+    forecast_cache,
+    key_pool,
+)
 
 router = APIRouter(
     prefix="/country",
@@ -19,19 +38,264 @@ router = APIRouter(
     },
 )
 
-REST_COUNTRIES_URL = "https://restcountries.com/v3.1"
-OPENWEATHERMAP_URL = "https://api.openweathermap.org/data/2.5"
-QUICKCHART_URL = "https://quickchart.io/chart"
 API_KEY = ""
+# The maximum number of countries fetched at the same time by the batch paths
+batch_concurrency = BATCH_CONCURRENCY
+# The default number of seconds the warmest countries are searched for
+WARMEST_DEADLINE = 2.0
+# The number of country names suggested for an unknown country
+SUGGESTIONS = 3
+
+# The fields of the REST Countries API used by the country paths
+COUNTRY_FIELDS = "name,capital,population,area,capitalInfo"
+# Country information barely changes, so it is kept for a day and served stale
+# for up to a week while it is reloaded, or for a month if REST Countries is down
+COUNTRY_CACHE_SIZE = 512
+COUNTRY_CACHE_TTL = 24 * 60 * 60
+COUNTRY_CACHE_STALE_TTL = 7 * 24 * 60 * 60
+COUNTRY_CACHE_STALE_IF_ERROR = 30 * 24 * 60 * 60
+
+country_cache = TTLCache(
+    "countries",
+    maxsize=COUNTRY_CACHE_SIZE,
+    ttl=COUNTRY_CACHE_TTL,
+    stale_ttl=COUNTRY_CACHE_STALE_TTL,
+    stale_if_error=COUNTRY_CACHE_STALE_IF_ERROR,
+)
 
 
 def set_api_key(key: str) -> None:
     """
     Set the API key for the OpenWeatherMap API.
-    :param key: The API key.
+    :param key: The API key, or several API keys separated by commas.
     """
     global API_KEY
     API_KEY = key
+    key_pool.set_keys([k.strip() for k in key.split(",") if k.strip()])
+
+
+def set_batch_concurrency(concurrency: int) -> None:
+    """
+    Set the maximum number of countries fetched at the same time by the batch paths.
+    :param concurrency: The number of countries.
+    """
+    global batch_concurrency
+    batch_concurrency = concurrency
+
+
+async def list_countries(client: httpx.AsyncClient, continent: str | None) -> list[str]:
+    """
+    Get the names of the countries of a continent, or of all the countries.
+    The names are taken from the country index when it is loaded.
+
+    :param client: The HTTP client.
+    :param continent: The continent, or None for all the countries.
+
+    :return: The names of the countries.
+    :raises UpstreamError: If the countries could not be retrieved.
+    """
+    index = get_index()
+    if index is not None:
+        countries = index.region(continent) if continent else index.names
+        if countries is None:
+            raise UpstreamError(
+                status.HTTP_500_INTERNAL_SERVER_ERROR, "Error getting the countries"
+            )
+        return countries
+
+    if continent:
+        url = f"{upstream.REST_COUNTRIES_URL}/region/{continent}?fields=name"
+    else:
+        url = f"{upstream.REST_COUNTRIES_URL}/all?fields=name"
+
+    response = await client.get(url)
+    if response.status_code != status.HTTP_200_OK:
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error getting the countries"
+        )
+    try:
+        return [country["name"]["common"] for country in response.json()]
+    except KeyError:
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+        )
+
+
+def country_not_found(country_name: str) -> UpstreamError:
+    """
+    Get the error for a country missing from the country index, suggesting the
+    closest country names.
+    :param country_name: The name of the country.
+    :return: The error.
+    """
+    detail = "Country not found"
+    index = get_index()
+    if index is not None:
+        suggestions = index.search_index.search(country_name, SUGGESTIONS)
+        if suggestions:
+            names = ", ".join(result["country"] for result in suggestions)
+            detail = f"{detail}. Did you mean: {names}?"
+    return UpstreamError(status.HTTP_404_NOT_FOUND, detail)
+
+
+async def fetch_country(client: httpx.AsyncClient, country_name: str) -> dict:
+    """
+    Get the information of a country.
+    The country is looked up in the country index when it is loaded, and unknown
+    names are rejected without any upstream call. Otherwise, it is
+    requested from the REST Countries API; the result is cached, and concurrent
+    lookups of the same country share a single upstream call.
+
+    :param client: The HTTP client.
+    :param country_name: The name of the country.
+
+    :return: The country, as returned by the REST Countries API.
+    :raises UpstreamError: If the country could not be retrieved.
+    """
+
+    index = get_index()
+    if index is not None:
+        country = index.get(country_name)
+        if country is None:
+            raise country_not_found(country_name)
+        return country
+
+    async def load() -> dict:
+        url = (
+            f"{upstream.REST_COUNTRIES_URL}/name/{country_name}?fullText=true"
+            f"&fields={COUNTRY_FIELDS}"
+        )
+        response = await client.get(url)
+        if response.status_code != status.HTTP_200_OK:
+            raise UpstreamError(
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "Error getting the country information",
+            )
+        try:
+            return response.json()[0]
+        except (KeyError, IndexError):
+            raise UpstreamError(
+                status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+            )
+
+    return await country_cache.get(country_name.lower(), load)
+
+
+async def country_info(client: httpx.AsyncClient, country_name: str) -> dict:
+    """
+    Get the information of a country returned by the country paths.
+
+    :param client: The HTTP client.
+    :param country_name: The name of the country.
+
+    :return: The capital, its coordinates, the population and the area.
+    :raises UpstreamError: If the information could not be retrieved.
+    """
+    country = await fetch_country(client, country_name)
+    try:
+        return {
+            "capital": country["capital"],
+            "latitude": country["capitalInfo"]["latlng"][0],
+            "longitude": country["capitalInfo"]["latlng"][1],
+            "population": country["population"],
+            "area": country["area"],
+        }
+    except (KeyError, IndexError):
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+        )
+
+
+def capital_coordinates(country: dict) -> tuple[float, float]:
+    """
+    Get the coordinates of the capital of a country.
+    :param country: The country, as returned by the REST Countries API.
+    :return: The latitude and the longitude.
+    :raises UpstreamError: If the country has no coordinates.
+    """
+    try:
+        latlng = country["capitalInfo"]["latlng"]
+        return latlng[0], latlng[1]
+    except (KeyError, IndexError):
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+        )
+
+
+async def country_temperature(
+    client: httpx.AsyncClient, country_name: str
+) -> CacheEntry:
+    """
+    Get the current temperature at the capital of a country.
+
+    :param client: The HTTP client.
+    :param country_name: The name of the country.
+
+    :return: The cache entry with the temperature in Celsius.
+    :raises UpstreamError: If the temperature could not be retrieved.
+    """
+    country = await fetch_country(client, country_name)
+    latitude, longitude = capital_coordinates(country)
+
+    # Get the temperature from the OpenWeatherMap API
+    if not API_KEY:
+        raise UpstreamError(status.HTTP_400_BAD_REQUEST, "The API key is not set")
+
+    return await fetch_temperature(client, latitude, longitude)
+
+
+async def temperature_value(client: httpx.AsyncClient, country_name: str) -> float:
+    """
+    Get the current temperature at the capital of a country.
+    :param client: The HTTP client.
+    :param country_name: The name of the country.
+    :return: The temperature in Celsius.
+    """
+    return (await country_temperature(client, country_name)).value
+
+
+async def resolve_countries(
+    client: httpx.AsyncClient, continent: str | None, countries: list[str] | None
+) -> list[str]:
+    """
+    Get the names of the countries a batch path works on.
+
+    :param client: The HTTP client.
+    :param continent: The continent of the countries.
+    :param countries: The names of the countries, if no continent is given.
+
+    :return: The names of the countries, without duplicates.
+    :raises UpstreamError: If neither is given or the continent is unknown.
+    """
+    if continent:
+        return await list_countries(client, continent)
+    if countries:
+        return list(dict.fromkeys(countries))
+    raise UpstreamError(
+        status.HTTP_400_BAD_REQUEST, "A continent or a list of countries is required"
+    )
+
+
+def capitals_result(index: CountryIndex, found: list[tuple[str, float]]) -> dict:
+    """
+    Get the response of a spatial query over the capitals.
+    :param index: The country index.
+    :param found: The (country name, distance in kilometers) pairs.
+    :return: The countries with their capital, its coordinates and its distance.
+    """
+    results = []
+    for name, distance in found:
+        latitude, longitude = index.coordinates[name]
+        results.append(
+            {
+                "country": name,
+                "capital": index.get(name).get("capital", []),
+                "latitude": latitude,
+                "longitude": longitude,
+                "distance_km": round(distance, 1),
+            }
+        )
+    return {"results": results}
 
 
 @router.get(
@@ -77,36 +341,661 @@ def set_api_key(key: str) -> None:
 async def get_countries(
     continent: str = Query(
         None, description="The continent to filter the countries.", example="Europe"
-    )
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
 ) -> Response:
     """
     This path will return a list with all the countries.
     :param continent: The continent to filter the countries.
     :return: A list with the countries.
     """
-    if continent:
-        url = f"{REST_COUNTRIES_URL}/region/{continent}?fields=name"
-    else:
-        url = f"{REST_COUNTRIES_URL}/all?fields=name"
+    # The country lists of the index are encoded once
+    index = get_index()
+    if index is not None and not wants_pretty():
+        encoded = index.encoded_countries(continent)
+        if encoded is not None:
+            return EncodedJSONResponse(status_code=status.HTTP_200_OK, content=encoded)
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        if response.status_code != status.HTTP_200_OK:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error getting the countries",
-            )
-        try:
-            countries = [country["name"]["common"] for country in response.json()]
-            return Response(
-                status_code=status.HTTP_200_OK,
-                content=json.dumps({"countries": countries}, indent=4),
-            )
-        except KeyError:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error parsing the response",
-            )
+    try:
+        countries = await list_countries(client, continent)
+    except UpstreamError as error:
+        return error.to_response()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"countries": countries},
+    )
+
+
+@router.get(
+    "/temperature",
+    responses={
+        200: {
+            "description": "The temperature of every country, in the order of the "
+            "request, or in completion order when streamed. A country that failed "
+            "has an error message and a status code instead of a temperature.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "temperatures": [
+                            {"country": "Brazil", "temperature": 28.4},
+                            {
+                                "country": "Atlantis",
+                                "error": "Error getting the country information",
+                                "status": 500,
+                            },
+                        ]
+                    },
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "temperatures": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "country": {"type": "string"},
+                                        "temperature": {"type": "number"},
+                                        "error": {"type": "string"},
+                                        "status": {"type": "integer"},
+                                    },
+                                },
+                            }
+                        },
+                    },
+                },
+                "application/x-ndjson": {
+                    "example": '{"country": "Brazil", "temperature": 28.4}\n'
+                    '{"country": "Peru", "temperature": 21.7}\n',
+                },
+                "text/event-stream": {
+                    "example": 'event: result\ndata: {"country": "Brazil", '
+                    '"temperature": 28.4}\n\nevent: end\ndata: {"count": 1}\n\n',
+                },
+            },
+        },
+        400: {
+            "description": "Bad request. No continent or countries are given.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "A continent or a list of countries is required"
+                    },
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Error getting the countries"},
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+    },
+)
+async def get_temperatures(
+    continent: str = Query(
+        None,
+        description="The continent of the countries.",
+        example="South America",
+    ),
+    countries: list[str] = Query(
+        None,
+        description="The names of the countries, if no continent is given.",
+        example=["Brazil", "Peru"],
+    ),
+    stream: StreamFormat = Query(
+        None,
+        description="Stream every temperature as soon as it is known, "
+        "as NDJSON or Server-Sent Events.",
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
+) -> Response:
+    """
+    This path will return the temperature of many countries at once.
+    The countries are fetched concurrently, and a country that fails does not
+    fail the whole request.
+    :param continent: The continent of the countries.
+    :param countries: The names of the countries, if no continent is given.
+    :param stream: The streaming format, if the temperatures are streamed.
+    :return: The temperature of every country.
+    """
+    try:
+        names = await resolve_countries(client, continent, countries)
+    except UpstreamError as error:
+        return error.to_response()
+
+    def fetch(name: str):
+        return temperature_value(client, name)
+
+    if stream:
+        return stream_response(names, fetch, "temperature", stream, batch_concurrency)
+
+    results = {}
+    async for name, result in fan_out(names, fetch, batch_concurrency):
+        results[name] = result_to_dict(name, result, "temperature")
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"temperatures": [results[name] for name in names]},
+    )
+
+
+@router.get(
+    "/info",
+    responses={
+        200: {
+            "description": "The information of every country, in the order of the "
+            "request, or in completion order when streamed. A country that failed "
+            "has an error message and a status code instead of its information.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "countries": [
+                            {
+                                "country": "Spain",
+                                "info": {
+                                    "capital": ["Madrid"],
+                                    "latitude": 40.4,
+                                    "longitude": -3.68,
+                                    "population": 47351567,
+                                    "area": 505992.0,
+                                },
+                            },
+                        ]
+                    },
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "countries": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "country": {"type": "string"},
+                                        "info": {"type": "object"},
+                                        "error": {"type": "string"},
+                                        "status": {"type": "integer"},
+                                    },
+                                },
+                            }
+                        },
+                    },
+                },
+                "application/x-ndjson": {
+                    "example": '{"country": "Spain", "info": {"capital": ["Madrid"], '
+                    '"latitude": 40.4, "longitude": -3.68, "population": 47351567, '
+                    '"area": 505992.0}}\n',
+                },
+                "text/event-stream": {
+                    "example": 'event: result\ndata: {"country": "Spain", "info": '
+                    '{"capital": ["Madrid"], "latitude": 40.4, "longitude": -3.68, '
+                    '"population": 47351567, "area": 505992.0}}\n\n'
+                    'event: end\ndata: {"count": 1}\n\n',
+                },
+            },
+        },
+        400: {
+            "description": "Bad request. No continent or countries are given.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "A continent or a list of countries is required"
+                    },
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Error getting the countries"},
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+    },
+)
+async def get_infos(
+    continent: str = Query(
+        None,
+        description="The continent of the countries.",
+        example="Europe",
+    ),
+    countries: list[str] = Query(
+        None,
+        description="The names of the countries, if no continent is given.",
+        example=["Spain", "France"],
+    ),
+    stream: StreamFormat = Query(
+        None,
+        description="Stream the information of every country as soon as it is "
+        "known, as NDJSON or Server-Sent Events.",
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
+) -> Response:
+    """
+    This path will return the information of many countries at once.
+    The countries are fetched concurrently, and a country that fails does not
+    fail the whole request.
+    :param continent: The continent of the countries.
+    :param countries: The names of the countries, if no continent is given.
+    :param stream: The streaming format, if the information is streamed.
+    :return: The information of every country.
+    """
+    try:
+        names = await resolve_countries(client, continent, countries)
+    except UpstreamError as error:
+        return error.to_response()
+
+    def fetch(name: str):
+        return country_info(client, name)
+
+    if stream:
+        return stream_response(names, fetch, "info", stream, batch_concurrency)
+
+    results = {}
+    async for name, result in fan_out(names, fetch, batch_concurrency):
+        results[name] = result_to_dict(name, result, "info")
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"countries": [results[name] for name in names]},
+    )
+
+
+@router.get(
+    "/warmest",
+    responses={
+        200: {
+            "description": "The warmest countries, from warmest to coldest. "
+            "If the deadline passed before all the temperatures were known, "
+            "the result is partial and `complete` is false.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "warmest": [
+                            {"country": "Brazil", "temperature": 28.4},
+                            {"country": "Peru", "temperature": 21.7},
+                        ],
+                        "complete": True,
+                        "pending": 0,
+                        "failed": 0,
+                    },
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "warmest": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "country": {"type": "string"},
+                                        "temperature": {"type": "number"},
+                                    },
+                                },
+                            },
+                            "complete": {
+                                "type": "boolean",
+                                "description": "Whether all the countries were "
+                                "compared.",
+                            },
+                            "pending": {
+                                "type": "integer",
+                                "description": "The number of countries still "
+                                "pending at the deadline.",
+                            },
+                            "failed": {
+                                "type": "integer",
+                                "description": "The number of countries whose "
+                                "temperature could not be retrieved.",
+                            },
+                        },
+                    },
+                }
+            },
+        },
+        400: {
+            "description": "Bad request. No continent or countries are given.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "A continent or a list of countries is required"
+                    },
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Error getting the countries"},
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+    },
+)
+async def get_warmest(
+    continent: str = Query(
+        None,
+        description="The continent of the countries.",
+        example="South America",
+    ),
+    countries: list[str] = Query(
+        None,
+        description="The names of the countries, if no continent is given.",
+        example=["Brazil", "Peru"],
+    ),
+    k: int = Query(1, description="The number of countries to return.", ge=1, le=50),
+    deadline: float = Query(
+        WARMEST_DEADLINE,
+        description="The number of seconds after which the warmest countries "
+        "found so far are returned.",
+        gt=0,
+        le=30,
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
+) -> Response:
+    """
+    This path will return the countries that are currently the warmest.
+    :param continent: The continent of the countries.
+    :param countries: The names of the countries, if no continent is given.
+    :param k: The number of countries to return.
+    :param deadline: The number of seconds to search for the warmest countries.
+    :return: The warmest countries, from warmest to coldest.
+    """
+    try:
+        names = await resolve_countries(client, continent, countries)
+    except UpstreamError as error:
+        return error.to_response()
+
+    # Min-heap with the k warmest countries found so far
+    warmest: list[tuple[float, str]] = []
+    pending = set(names)
+    failed = 0
+    try:
+        async with asyncio.timeout(deadline):
+            async for name, result in fan_out(
+                names, lambda name: country_temperature(client, name), batch_concurrency
+            ):
+                pending.discard(name)
+                if isinstance(result, UpstreamError):
+                    failed += 1
+                elif len(warmest) < k:
+                    heapq.heappush(warmest, (result.value, name))
+                else:
+                    heapq.heappushpop(warmest, (result.value, name))
+    except TimeoutError:
+        pass
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "warmest": [
+                {"country": name, "temperature": temperature}
+                for temperature, name in sorted(warmest, reverse=True)
+            ],
+            "complete": not pending,
+            "pending": len(pending),
+            "failed": failed,
+        },
+    )
+
+
+@router.get(
+    "/search",
+    responses={
+        200: {
+            "description": "The countries matching the query, best first. "
+            "Names starting with the query come first, then similar names.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "results": [
+                            {"country": "Spain", "name": "Spain", "match": "prefix"},
+                            {
+                                "country": "Spain",
+                                "name": "Spian",
+                                "match": "fuzzy",
+                                "distance": 2,
+                            },
+                        ]
+                    },
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "results": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "country": {
+                                            "type": "string",
+                                            "description": "The common name of "
+                                            "the country.",
+                                        },
+                                        "name": {
+                                            "type": "string",
+                                            "description": "The matched common "
+                                            "name, official name or alternative "
+                                            "spelling.",
+                                        },
+                                        "match": {
+                                            "type": "string",
+                                            "enum": ["prefix", "fuzzy"],
+                                        },
+                                        "distance": {
+                                            "type": "integer",
+                                            "description": "The edit distance "
+                                            "of a fuzzy match.",
+                                        },
+                                    },
+                                },
+                            }
+                        },
+                    },
+                }
+            },
+        },
+        503: {
+            "description": "Service unavailable. The country index is not loaded.",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "The country index is not loaded"},
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
+    },
+)
+async def search_countries(
+    q: str = Query(
+        ...,
+        description="The beginning of the name of the country, or a misspelled name.",
+        example="spa",
+        min_length=1,
+        max_length=100,
+    ),
+    limit: int = Query(
+        10, description="The maximum number of countries.", ge=1, le=MAX_RESULTS
+    ),
+) -> Response:
+    """
+    This path will return the countries matching a query, for autocompletion.
+    The common names, official names and alternative spellings are searched,
+    in any case and with or without accents.
+    :param q: The query.
+    :param limit: The maximum number of countries.
+    :return: The matching countries, best first.
+    """
+    index = get_index()
+    if index is None:
+        return Response(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content="The country index is not loaded",
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"results": index.search_index.search(q, limit)},
+    )
+
+
+# The response of the spatial queries over the capitals
+CAPITALS_RESPONSES = {
+    200: {
+        "description": "The countries with their capital, closest first.",
+        "content": {
+            "application/json": {
+                "example": {
+                    "results": [
+                        {
+                            "country": "Spain",
+                            "capital": ["Madrid"],
+                            "latitude": 40.4,
+                            "longitude": -3.68,
+                            "distance_km": 0.0,
+                        },
+                        {
+                            "country": "Andorra",
+                            "capital": ["Andorra la Vella"],
+                            "latitude": 42.5,
+                            "longitude": 1.52,
+                            "distance_km": 492.3,
+                        },
+                    ]
+                },
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "results": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "country": {
+                                        "type": "string",
+                                        "description": "The common name of the "
+                                        "country.",
+                                    },
+                                    "capital": {
+                                        "type": "array",
+                                        "items": {"type": "string"},
+                                    },
+                                    "latitude": {"type": "number"},
+                                    "longitude": {"type": "number"},
+                                    "distance_km": {
+                                        "type": "number",
+                                        "description": "The great-circle "
+                                        "distance to the capital, in kilometers.",
+                                    },
+                                },
+                            },
+                        }
+                    },
+                },
+            }
+        },
+    },
+    503: {
+        "description": "Service unavailable. The country index is not loaded.",
+        "content": {
+            "application/json": {
+                "example": {"detail": "The country index is not loaded"},
+                "schema": {
+                    "type": "string",
+                    "description": "The error message.",
+                },
+            }
+        },
+    },
+}
+
+
+@router.get("/nearest", responses=CAPITALS_RESPONSES)
+async def nearest_countries(
+    lat: float = Query(..., description="The latitude.", example=40.4, ge=-90, le=90),
+    lon: float = Query(
+        ..., description="The longitude.", example=-3.68, ge=-180, le=180
+    ),
+    k: int = Query(5, description="The number of countries.", ge=1, le=MAX_RESULTS),
+) -> Response:
+    """
+    This path will return the countries whose capital is the closest to a location.
+    :param lat: The latitude.
+    :param lon: The longitude.
+    :param k: The number of countries.
+    :return: The closest countries, closest first.
+    """
+    index = get_index()
+    if index is None:
+        return Response(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content="The country index is not loaded",
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=capitals_result(index, index.spatial_index.nearest(lat, lon, k)),
+    )
+
+
+@router.get("/within", responses=CAPITALS_RESPONSES)
+async def countries_within(
+    lat: float = Query(..., description="The latitude.", example=40.4, ge=-90, le=90),
+    lon: float = Query(
+        ..., description="The longitude.", example=-3.68, ge=-180, le=180
+    ),
+    radius_km: float = Query(
+        ...,
+        description="The distance to the capitals, in kilometers.",
+        example=500,
+        gt=0,
+        le=MAX_DISTANCE_KM,
+    ),
+) -> Response:
+    """
+    This path will return the countries whose capital is within a distance of
+    a location.
+    :param lat: The latitude.
+    :param lon: The longitude.
+    :param radius_km: The distance in kilometers.
+    :return: The countries within the distance, closest first.
+    """
+    index = get_index()
+    if index is None:
+        return Response(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content="The country index is not loaded",
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=capitals_result(index, index.spatial_index.within(lat, lon, radius_km)),
+    )
 
 
 @router.get(
@@ -168,7 +1057,8 @@ async def get_countries(
 async def get_country(
     country_name: str = Path(
         ..., description="The name of the country.", example="Spain"
-    )
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
 ) -> Response:
     """
     This path will return the information of a country.
@@ -179,35 +1069,14 @@ async def get_country(
     :param country_name: The name of the country.
     :return:
     """
-    url = f"{REST_COUNTRIES_URL}/name/{country_name}?fullText=true&fields=capital,population,area,capitalInfo"
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        if response.status_code != status.HTTP_200_OK:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error getting the country information",
-            )
-        try:
-            country = response.json()[0]
-            return Response(
-                status_code=status.HTTP_200_OK,
-                content=json.dumps(
-                    {
-                        "capital": country["capital"],
-                        "latitude": country["capitalInfo"]["latlng"][0],
-                        "longitude": country["capitalInfo"]["latlng"][1],
-                        "population": country["population"],
-                        "area": country["area"],
-                    },
-                    indent=4,
-                ),
-            )
-        except KeyError:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error parsing the response",
-            )
+    try:
+        info = await country_info(client, country_name)
+    except UpstreamError as error:
+        return error.to_response()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=info,
+    )
 
 
 @router.get(
@@ -274,67 +1143,24 @@ async def get_country(
 async def get_temperature(
     country_name: str = Path(
         ..., description="The name of the country.", example="Belgium"
-    )
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
 ) -> Response:
     """
     This path will return the temperature of a country.
     :param country_name: The name of the country.
     :return:
     """
-    # Get the country information (latitude and longitude of the capital)
-    url = f"{REST_COUNTRIES_URL}/name/{country_name}?fullText=true&fields=capitalInfo"
-
-    async with httpx.AsyncClient() as client:
-        try:
-            # Get the country information
-            response = await client.get(url)
-            if response.status_code != status.HTTP_200_OK:
-                return Response(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    content="Error getting the country information",
-                )
-
-            # Get the latitude and longitude of the capital
-            country = response.json()[0]
-            latitude = country["capitalInfo"]["latlng"][0]
-            longitude = country["capitalInfo"]["latlng"][1]
-
-            # Get the forecast from the OpenWeatherMap API
-            if not API_KEY:
-                return Response(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content="The API key is not set",
-                )
-
-            url = (
-                f"{OPENWEATHERMAP_URL}/weather?lat={latitude}&lon={longitude}"
-                f"&units=metric&appid={API_KEY}"
-            )
-            # Get the forecast
-            response = await client.get(url)
-            if response.status_code == status.HTTP_401_UNAUTHORIZED:
-                return Response(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content="The API key is not correct",
-                )
-
-            if response.status_code != status.HTTP_200_OK:
-                return Response(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    content="Error getting the temperature forecast",
-                )
-
-            # Get the temperature
-            temperature = response.json()["main"]["temp"]
-            return Response(
-                status_code=status.HTTP_200_OK,
-                content=json.dumps({"temperature": temperature}, indent=4),
-            )
-        except KeyError:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error parsing the response",
-            )
+    try:
+        # Get the temperature (cached by the weather module)
+        weather = await country_temperature(client, country_name)
+    except UpstreamError as error:
+        return error.to_response()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"temperature": weather.value},
+        headers=current_cache.cache_headers(weather),
+    )
 
 
 @router.get(
@@ -348,6 +1174,10 @@ async def get_temperature(
                 },
             },
         },
+        304: {
+            "description": "The chart did not change since the ETag given in "
+            "If-None-Match.",
+        },
         400: {
             "description": "Bad request. Unsupported number of days,"
             "or the API key is not set.",
@@ -389,15 +1219,20 @@ async def get_forecast(
         ge=1,
         le=5,
     ),
+    if_none_match: str = Header(
+        None,
+        description="The ETag of a chart the client already has. If the chart "
+        "did not change, an empty 304 response is returned.",
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
 ) -> Response:
     """
     This path will return the temperature of a country.
     :param days: The number of days to get the forecast. Maximum 5 days.
     :param country_name: The name of the country.
+    :param if_none_match: The ETag of the chart the client already has.
     :return: The temperature forecast chart for the given country.
     """
-    # Get the country information (latitude and longitude of the capital)
-    url = f"{REST_COUNTRIES_URL}/name/{country_name}?fullText=true&fields=capitalInfo"
     # Check if the number of days is supported
     if not 1 <= days <= 5:
         return Response(
@@ -405,75 +1240,61 @@ async def get_forecast(
             content="The number of days must be between 1 and 5",
         )
 
-    async with httpx.AsyncClient() as client:
-        try:
-            # Get the country information
-            response = await client.get(url)
-            if response.status_code != status.HTTP_200_OK:
-                return Response(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    content="Error getting the country information",
-                )
-
-            country = response.json()[0]
-
-            # Get the latitude and longitude of the capital
-            latitude = country["capitalInfo"]["latlng"][0]
-            longitude = country["capitalInfo"]["latlng"][1]
+    try:
+        # Get the country information (latitude and longitude of the capital)
+        with timing.span("country"):
+            country = await fetch_country(client, country_name)
 
-            # Calculate the number of 3-hour intervals
-            hours = days * 8 if days <= 5 else 0
-
-            # Get the forecast from the OpenWeatherMap API
-            if not API_KEY:
-                return Response(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content="The API key is not set",
-                )
+        # Get the latitude and longitude of the capital
+        latitude, longitude = capital_coordinates(country)
 
-            url = (
-                f"{OPENWEATHERMAP_URL}/forecast?lat={latitude}&lon={longitude}&cnt={hours}&"
-                f"units=metric&appid={API_KEY}"
+        # Get the forecast from the OpenWeatherMap API
+        if not API_KEY:
+            return Response(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content="The API key is not set",
             )
-            # Get the forecast
-            response = await client.get(url)
-
-            if response.status_code == status.HTTP_401_UNAUTHORIZED:
-                return Response(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content="The API key is not correct",
-                )
 
-            if response.status_code != status.HTTP_200_OK:
-                return Response(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    content="Error getting the temperature forecast",
-                )
+        # Get the full forecast (cached by the weather module)
+        with timing.span("forecast"):
+            forecast = await fetch_forecast(client, latitude, longitude)
+    except UpstreamError as error:
+        return error.to_response()
 
-            temperature = [
-                forecast["main"]["temp"] for forecast in response.json()["list"]
-            ]
-        except KeyError:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error parsing the response",
-            )
+    # Keep the 3-hour intervals of the requested days
+    slots = forecast.value[: days * 8]
+    timestamps = [timestamp for timestamp, _ in slots]
+    temperature = [temperature for _, temperature in slots]
 
-        return await get_chart(client, days, temperature, country_name)
+    with timing.span("chart"):
+        response = await get_chart(
+            client, timestamps, temperature, country_name, if_none_match
+        )
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response.headers.update(forecast_cache.cache_headers(forecast))
+    return response
 
 
 async def get_chart(
-    client: httpx.AsyncClient, days: int, temperature: list[float], country_name: str
+    client: httpx.AsyncClient,
+    timestamps: list[int],
+    temperature: list[float],
+    country_name: str,
+    if_none_match: str | None = None,
 ) -> Response:
     """
     This function will create a chart with the temperature forecast.
+    Rendered charts are cached by the hash of their configuration, which is
+    also their ETag.
 
     :param client: The HTTP client.
-    :param days: The number of days.
+    :param timestamps: The UNIX timestamps of the forecast.
     :param temperature: The temperature forecast.
     :param country_name: The name of the country.
+    :param if_none_match: The If-None-Match header of the request, if any.
 
-    :return: The chart as a response, or an error response..
+    :return: The chart as a response, a 304 response if the client already has
+        the chart, or an error response.
     """
 
     chart_options = {
@@ -505,7 +1326,7 @@ async def get_chart(
         "type": "line",
         "options": chart_options,
         "data": {
-            "labels": translate_hours_to_days(days),
+            "labels": translate_hours_to_days(timestamps),
             "datasets": [
                 {
                     "label": f"Temperature in {country_name} {emoji}",
@@ -515,37 +1336,68 @@ async def get_chart(
             ],
         },
     }
-    params = {"version": "2", "backgroundColor": "transparent", "chart": chart_param}
-    response = await client.post(QUICKCHART_URL, json=params)
-    if response.status_code != 200:
+    # The chart is content-addressed: the same configuration gives the same image
+    key = chart.chart_key(chart_param, "transparent")
+    etag = f'"{key}"'
+    if chart.etag_matches(if_none_match, etag):
         return Response(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content="Error creating the chart",
-        )
-    else:
-        return Response(
-            status_code=status.HTTP_200_OK,
-            content=response.content,
-            media_type="image/png",
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
         )
 
+    content = await chart.chart_cache.get(key)
+    if content is None:
+        # Render the chart locally, or with QuickChart
+        if chart.backend == chart.LOCAL:
+            try:
+                content = await chart.render(chart_param, "transparent")
+            except (OSError, RuntimeError, ValueError):
+                return Response(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    content="Error creating the chart",
+                )
+        else:
+            params = {
+                "version": "2",
+                "backgroundColor": "transparent",
+                "chart": chart_param,
+            }
+            response = await client.post(upstream.QUICKCHART_URL, json=params)
+            if response.status_code != 200:
+                return Response(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    content="Error creating the chart",
+                )
+            content = response.content
+        await chart.chart_cache.set(key, content)
+
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=content,
+        media_type="image/png",
+        headers={"ETag": etag},
+    )
 
-def translate_hours_to_days(days: int) -> list[str]:
+
+def translate_hours_to_days(timestamps: list[int]) -> list[str]:
     """
-    Starting from the current time, it will return the hours of the next days in
-    3-hour intervals.
+    It will return the labels of the 3-hour intervals of a forecast, with the date
+    and the hour (in UTC) of every interval.
 
-    :param days: The number of days.
+    :param timestamps: The UNIX timestamps of the forecast.
 
     :return: A list with the hours.
     """
-    time = datetime.now()
-    hours = []
-    # Get the hours of the next days from the current time
-    # Also add the date to the hours
-    for _ in range(days):
-        for _ in range(8):
-            time += timedelta(hours=3)
-            hours.append(time.strftime("%d-%m %H:%M"))
+    return [slot_label(timestamp) for timestamp in timestamps]
+
+
+@lru_cache(maxsize=1024)
+def slot_label(timestamp: int) -> str:
+    """
+    Get the label of a 3-hour interval of a forecast.
+    The labels are memoized, since the same intervals are used by every forecast.
+
+    :param timestamp: The UNIX timestamp of the interval.
 
-    return hours
+    :return: The date and the hour of the interval.
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%d-%m %H:%M")
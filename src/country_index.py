@@ -0,0 +1,246 @@
+"""
+This module contains the in-memory index of all the countries.
+The whole REST Countries dataset is loaded once (from a snapshot file or with a
+single bulk request) and refreshed periodically in the background, so the
+country paths can be served without any upstream call.
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+import httpx
+from fastapi import status
+
+from src import upstream
+from src.geo import SpatialIndex
+from src.responses import dumps
+from src.search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# The fields loaded for every country. The REST Countries API allows at most 10.
+INDEX_FIELDS = (
+    "name,altSpellings,region,subregion,continents,capital,capitalInfo,"
+    "population,area"
+)
+# By default, the index is refreshed once a day
+REFRESH_INTERVAL = 24 * 60 * 60
+
+
+class CountryIndex:
+    """
+    An immutable index over the countries of the REST Countries API.
+    A new index is built on every refresh and swapped in atomically.
+    """
+
+    def __init__(self, countries: list[dict]):
+        """
+        :param countries: The countries, as returned by the REST Countries API.
+        """
+        self.countries = sorted(countries, key=lambda c: c["name"]["common"])
+        # Sorted list with the common name of every country
+        self.names = [country["name"]["common"] for country in self.countries]
+        # Country by case-insensitive name. Common names take precedence over
+        # official names, which take precedence over alternative spellings.
+        self.by_name: dict[str, dict] = {}
+        for country in self.countries:
+            for spelling in country.get("altSpellings", []):
+                self.by_name.setdefault(spelling.casefold(), country)
+        for country in self.countries:
+            official = country["name"].get("official")
+            if official:
+                self.by_name[official.casefold()] = country
+        for country in self.countries:
+            self.by_name[country["name"]["common"].casefold()] = country
+        # Sorted country names by case-insensitive region, subregion or continent
+        by_region: dict[str, list[str]] = {}
+        for country in self.countries:
+            regions = {country.get("region"), country.get("subregion")}
+            regions.update(country.get("continents", []))
+            for region in regions:
+                if region:
+                    by_region.setdefault(region.casefold(), []).append(
+                        country["name"]["common"]
+                    )
+        self.by_region = by_region
+        # Latitude and longitude of the capital by country name
+        self.coordinates: dict[str, tuple[float, float]] = {
+            country["name"]["common"]: tuple(country["capitalInfo"]["latlng"])
+            for country in self.countries
+            if len(country.get("capitalInfo", {}).get("latlng", [])) == 2
+        }
+        # Nearest and radius queries over the capitals
+        self.spatial_index = SpatialIndex(self.coordinates)
+        # Prefix and fuzzy search over all the names, swapped with the index
+        self.search_index = SearchIndex(self.countries)
+        # The encoded JSON of the country lists, built on first use
+        self._encoded: dict[str | None, bytes] = {}
+
+    def __len__(self) -> int:
+        return len(self.countries)
+
+    def get(self, name: str) -> dict | None:
+        """
+        Get a country by its common name, official name or alternative spelling.
+        :param name: The name of the country, in any case, with or without accents.
+        :return: The country, or None if it is unknown.
+        """
+        country = self.by_name.get(name.casefold())
+        if country is None:
+            common = self.search_index.resolve(name)
+            if common is not None:
+                country = self.by_name.get(common.casefold())
+        return country
+
+    def region(self, region: str) -> list[str] | None:
+        """
+        Get the names of the countries of a region, subregion or continent.
+        :param region: The name of the region, in any case.
+        :return: The sorted country names, or None if the region is unknown.
+        """
+        return self.by_region.get(region.casefold())
+
+    def encoded_countries(self, region: str | None) -> bytes | None:
+        """
+        Get the JSON list of the countries of a region, or of all the countries.
+        The JSON is encoded once per index, since the index never changes.
+        :param region: The name of the region, or None for all the countries.
+        :return: The encoded JSON, or None if the region is unknown.
+        """
+        key = region.casefold() if region else None
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            countries = self.region(region) if region else self.names
+            if countries is None:
+                return None
+            encoded = self._encoded[key] = dumps({"countries": countries})
+        return encoded
+
+
+# The current index, or None if it is not loaded yet
+_index: CountryIndex | None = None
+
+
+def get_index() -> CountryIndex | None:
+    """
+    Get the current country index.
+    :return: The index, or None if it is not loaded.
+    """
+    return _index
+
+
+def set_index(index: CountryIndex | None) -> None:
+    """
+    Replace the current country index.
+    :param index: The new index.
+    """
+    global _index
+    _index = index
+
+
+async def fetch_countries(client: httpx.AsyncClient) -> list[dict]:
+    """
+    Get all the countries from the REST Countries API with one bulk request.
+    :param client: The HTTP client.
+    :return: The countries.
+    """
+    response = await client.get(
+        f"{upstream.REST_COUNTRIES_URL}/all?fields={INDEX_FIELDS}"
+    )
+    if response.status_code != status.HTTP_200_OK:
+        raise httpx.HTTPStatusError(
+            f"Error getting the countries: {response.status_code}",
+            request=response.request,
+            response=response,
+        )
+    return response.json()
+
+
+def read_snapshot(path: str) -> list[dict]:
+    """
+    Read the countries from a snapshot file.
+    :param path: The path of the snapshot.
+    :return: The countries.
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_snapshot(path: str, countries: list[dict]) -> None:
+    """
+    Write the countries to a snapshot file.
+    The file is replaced atomically, so readers never see a partial snapshot.
+    Every worker writes to its own temporary file, as they all refresh the index.
+    :param path: The path of the snapshot.
+    :param countries: The countries.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(countries, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def refresh(client: httpx.AsyncClient, snapshot: str | None = None) -> None:
+    """
+    Fetch all the countries and swap in a new index.
+    A snapshot that cannot be written is logged, the new index is kept.
+    :param client: The HTTP client.
+    :param snapshot: The path of the snapshot file to update, if any.
+    """
+    countries = await fetch_countries(client)
+    set_index(CountryIndex(countries))
+    logger.info("Loaded %d countries in the country index", len(countries))
+    if snapshot:
+        try:
+            await asyncio.to_thread(write_snapshot, snapshot, countries)
+        except OSError:
+            logger.exception("Error writing the country snapshot %s", snapshot)
+
+
+async def load(client: httpx.AsyncClient, snapshot: str | None = None) -> None:
+    """
+    Load the index when the application starts.
+    The snapshot is used if it exists, otherwise the countries are fetched.
+    If both fail, the index stays empty and the country paths fall back to the
+    REST Countries API.
+
+    :param client: The HTTP client.
+    :param snapshot: The path of the snapshot file, if any.
+    """
+    if snapshot and os.path.exists(snapshot):
+        try:
+            set_index(CountryIndex(read_snapshot(snapshot)))
+            return
+        except (OSError, ValueError, KeyError):
+            logger.exception("Error reading the country snapshot %s", snapshot)
+    try:
+        await refresh(client, snapshot)
+    except (httpx.HTTPError, ValueError, KeyError):
+        logger.exception("Error loading the country index")
+
+
+async def refresh_periodically(
+    client: httpx.AsyncClient,
+    interval: float = REFRESH_INTERVAL,
+    snapshot: str | None = None,
+) -> None:
+    """
+    Refresh the index forever. A failed refresh keeps the previous index.
+
+    :param client: The HTTP client.
+    :param interval: The number of seconds between two refreshes.
+    :param snapshot: The path of the snapshot file to update, if any.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh(client, snapshot)
+        except (httpx.HTTPError, ValueError, KeyError):
+            logger.exception("Error refreshing the country index")
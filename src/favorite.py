@@ -2,16 +2,24 @@
 This module contains API paths related to the favorite countries.
 """
 
-import json
+import asyncio
 
 import httpx
-from fastapi import APIRouter, Body, Response, status
+from fastapi import APIRouter, Body, Depends, Query, Response, status
 
+from src import country, upstream
+from src.batch import fan_out
+from src.client import UpstreamError, get_client, upstream_error
+from src.country_index import get_index
+from src.favorites_store import FavoritesStore, get_store
 from src.models import CountryName
+from src.responses import JSONResponse
 
-REST_COUNTRIES_URL = "https://restcountries.com/v3.1"
-
-favorite_countries = []
+# The live data that can be joined with the favorite countries
+EXPANSIONS = {
+    "info": country.country_info,
+    "temperature": country.temperature_value,
+}
 
 router = APIRouter(
     prefix="/favorite",
@@ -29,6 +37,72 @@ router = APIRouter(
 )
 
 
+async def resolve_country_name(client: httpx.AsyncClient, name: str) -> str:
+    """
+    Check that a country exists, and get its common name.
+    The name is looked up in the country index when it is loaded. Otherwise, only
+    the name of the country is requested from the REST Countries API.
+
+    :param client: The HTTP client.
+    :param name: The name of the country.
+
+    :return: The common name of the country.
+    :raises UpstreamError: If the country does not exist.
+    """
+    index = get_index()
+    if index is not None:
+        found = index.get(name)
+        if found is None:
+            raise country.country_not_found(name)
+        return found["name"]["common"]
+
+    url = f"{upstream.REST_COUNTRIES_URL}/name/{name}?fullText=true&fields=name"
+    response = await client.get(url)
+    if response.status_code != status.HTTP_200_OK:
+        raise UpstreamError(status.HTTP_404_NOT_FOUND, "Country not found")
+    try:
+        return response.json()[0]["name"]["common"]
+    except (KeyError, IndexError):
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+        )
+
+
+async def expand_favorite(
+    client: httpx.AsyncClient, name: str, fields: list[str]
+) -> dict:
+    """
+    Get the live data of a favorite country.
+    The fields are fetched concurrently. A field that fails is null, and its
+    error is reported in the `errors` of the country.
+
+    :param client: The HTTP client.
+    :param name: The name of the country.
+    :param fields: The fields to get, keys of EXPANSIONS.
+
+    :return: The country with its fields.
+    """
+    results = await asyncio.gather(
+        *(EXPANSIONS[field](client, name) for field in fields),
+        return_exceptions=True,
+    )
+    favorite = {"country": name}
+    for field, result in zip(fields, results):
+        if isinstance(result, httpx.HTTPError):
+            result = upstream_error(result)
+        if isinstance(result, UpstreamError):
+            favorite[field] = None
+            favorite.setdefault("errors", {})[field] = {
+                "error": result.detail,
+                "status": result.status_code,
+            }
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            favorite[field] = result
+    return favorite
+
+
 @router.get(
     "",
     responses={
@@ -36,30 +110,104 @@ router = APIRouter(
             "description": "List of favorite countries",
             "content": {
                 "application/json": {
-                    "example": {"favorites": ["Albania"]},
+                    "examples": {
+                        "list": {"value": {"favorites": ["Albania"]}},
+                        "expanded": {
+                            "value": {
+                                "favorites": [
+                                    {
+                                        "country": "Albania",
+                                        "info": {
+                                            "capital": ["Tirana"],
+                                            "latitude": 41.32,
+                                            "longitude": 19.82,
+                                            "population": 2837743,
+                                            "area": 28748.0,
+                                        },
+                                        "temperature": 14.2,
+                                    }
+                                ]
+                            }
+                        },
+                    },
                     "schema": {
                         "type": "object",
                         "properties": {
                             "favorites": {
                                 "type": "array",
-                                "items": {"type": "string"},
+                                "items": {
+                                    "type": "string",
+                                    "description": "The name of the country, or "
+                                    "an object with the country and its expanded "
+                                    "fields.",
+                                },
                             }
                         },
                     },
                 }
             },
-        }
+        },
+        400: {
+            "description": "Bad request. Unknown field to expand.",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Unknown field to expand: weather"},
+                    "schema": {
+                        "type": "string",
+                        "description": "The error message.",
+                    },
+                }
+            },
+        },
     },
 )
-async def get_favorite_countries() -> Response:
+async def get_favorite_countries(
+    expand: str = Query(
+        None,
+        description="Comma-separated live data to join with every favorite "
+        "country: info and/or temperature.",
+        example="info,temperature",
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
+    store: FavoritesStore = Depends(get_store),
+) -> Response:
     """
     This path will return the list of favorite countries.
+    With `expand`, the information and/or the current temperature of every
+    country are fetched concurrently and returned with it.
+
+    :param expand: The comma-separated fields to join with the countries.
+    :param client: The HTTP client.
+    :param store: The favorites store.
 
     :return: A response with the list of favorite countries.
     """
-    return Response(
+    favorites = await store.list()
+    if not expand:
+        return JSONResponse(
+            status_code=200,
+            content={"favorites": favorites},
+        )
+
+    fields = list(dict.fromkeys(field.strip() for field in expand.split(",")))
+    for field in fields:
+        if field not in EXPANSIONS:
+            return Response(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content=f"Unknown field to expand: {field}",
+            )
+
+    expanded = {}
+    async for name, result in fan_out(
+        favorites,
+        lambda name: expand_favorite(client, name, fields),
+        country.batch_concurrency,
+    ):
+        expanded[name] = result
+
+    return JSONResponse(
         status_code=200,
-        content=json.dumps({"favorites": favorite_countries}, indent=4),
+        content={"favorites": [expanded[name] for name in favorites]},
     )
 
 
@@ -121,51 +269,33 @@ async def get_favorite_countries() -> Response:
 async def add_favorite(
     country_name: CountryName = Body(
         ..., description="The name of the country", example={"name": "Albania"}
-    )
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
+    store: FavoritesStore = Depends(get_store),
 ) -> Response:
     """
     This path will add a country to the favorite list.
 
     :param country_name: The name of the country.
+    :param store: The favorites store.
 
     :return: A response with the result of the operation.
     """
     # Get the country
-    url = f"{REST_COUNTRIES_URL}/name/{country_name.name}?fullText=true"
+    try:
+        name = await resolve_country_name(client, country_name.name)
+    except UpstreamError as error:
+        return error.to_response()
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        if response.status_code != status.HTTP_200_OK:
-            return Response(
-                status_code=status.HTTP_404_NOT_FOUND, content="Country not found"
-            )
-        try:
-            country = response.json()[0]
-            if country["name"]["common"] not in favorite_countries:
-                favorite_countries.append(country["name"]["common"])
-                return Response(
-                    status_code=status.HTTP_200_OK,
-                    content=json.dumps(
-                        {
-                            "message": f"{country['name']['common']} added to the favorite list"
-                        },
-                        indent=4,
-                    ),
-                )
-            return Response(
-                status_code=status.HTTP_409_CONFLICT,
-                content=json.dumps(
-                    {
-                        "message": f"{country['name']['common']} is already in the favorite list"
-                    },
-                    indent=4,
-                ),
-            )
-        except KeyError:
-            return Response(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content="Error parsing the response",
-            )
+    if await store.add(name):
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={"message": f"{name} added to the favorite list"},
+        )
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"message": f"{name} is already in the favorite list"},
+    )
 
 
 @router.delete(
@@ -202,25 +332,207 @@ async def add_favorite(
 async def delete_favorite(
     country_name: CountryName = Body(
         ..., description="The name of the country", example={"name": "Albania"}
-    )
+    ),
+    store: FavoritesStore = Depends(get_store),
 ) -> Response:
     """
     This path will remove a country from the favorite list.
 
     :param country_name: The name of the country.
+    :param store: The favorites store.
 
     :return: A response with the result of the operation.
     """
-    if country_name.name in favorite_countries:
-        favorite_countries.remove(country_name.name)
-        return Response(
+    if await store.remove(country_name.name):
+        return JSONResponse(
             status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {"message": f"{country_name.name} removed from the favorite list"},
-                indent=4,
-            ),
+            content={"message": f"{country_name.name} removed from the favorite list"},
         )
     return Response(
         status_code=status.HTTP_404_NOT_FOUND,
         content="Country not found in the favorite list",
     )
+
+
+@router.post(
+    "/batch",
+    responses={
+        200: {
+            "description": "The result for every country, in the order of the "
+            "request. The status is 200 if the country was added, 404 if it was not "
+            "found and 409 if it was already in the favorite list.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "results": [
+                            {
+                                "country": "Albania",
+                                "status": 200,
+                                "message": "Albania added to the favorite list",
+                            },
+                            {
+                                "country": "Atlantis",
+                                "status": 404,
+                                "error": "Country not found",
+                            },
+                        ]
+                    },
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "results": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "country": {"type": "string"},
+                                        "status": {"type": "integer"},
+                                        "message": {"type": "string"},
+                                        "error": {"type": "string"},
+                                    },
+                                },
+                            }
+                        },
+                    },
+                }
+            },
+        },
+    },
+)
+async def add_favorites(
+    country_names: list[CountryName] = Body(
+        ...,
+        description="The names of the countries",
+        example=[{"name": "Albania"}, {"name": "Belgium"}],
+    ),
+    client: httpx.AsyncClient = Depends(get_client),
+    store: FavoritesStore = Depends(get_store),
+) -> Response:
+    """
+    This path will add many countries to the favorite list at once.
+    The countries are validated concurrently.
+
+    :param country_names: The names of the countries.
+    :param client: The HTTP client.
+    :param store: The favorites store.
+
+    :return: A response with the result for every country.
+    """
+    names = [country_name.name for country_name in country_names]
+    resolved = {}
+    async for name, result in fan_out(
+        list(dict.fromkeys(names)),
+        lambda name: resolve_country_name(client, name),
+        country.batch_concurrency,
+    ):
+        resolved[name] = result
+
+    # The countries are added in the order of the request
+    results = []
+    for name in names:
+        result = resolved[name]
+        if isinstance(result, UpstreamError):
+            results.append(
+                {"country": name, "status": result.status_code, "error": result.detail}
+            )
+        elif await store.add(result):
+            results.append(
+                {
+                    "country": result,
+                    "status": status.HTTP_200_OK,
+                    "message": f"{result} added to the favorite list",
+                }
+            )
+        else:
+            results.append(
+                {
+                    "country": result,
+                    "status": status.HTTP_409_CONFLICT,
+                    "message": f"{result} is already in the favorite list",
+                }
+            )
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content={"results": results})
+
+
+@router.delete(
+    "/batch",
+    responses={
+        200: {
+            "description": "The result for every country, in the order of the "
+            "request. The status is 200 if the country was removed and 404 if it was "
+            "not in the favorite list.",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "results": [
+                            {
+                                "country": "Albania",
+                                "status": 200,
+                                "message": "Albania removed from the favorite list",
+                            },
+                            {
+                                "country": "Atlantis",
+                                "status": 404,
+                                "error": "Country not found in the favorite list",
+                            },
+                        ]
+                    },
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "results": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "country": {"type": "string"},
+                                        "status": {"type": "integer"},
+                                        "message": {"type": "string"},
+                                        "error": {"type": "string"},
+                                    },
+                                },
+                            }
+                        },
+                    },
+                }
+            },
+        },
+    },
+)
+async def delete_favorites(
+    country_names: list[CountryName] = Body(
+        ...,
+        description="The names of the countries",
+        example=[{"name": "Albania"}, {"name": "Belgium"}],
+    ),
+    store: FavoritesStore = Depends(get_store),
+) -> Response:
+    """
+    This path will remove many countries from the favorite list at once.
+
+    :param country_names: The names of the countries.
+    :param store: The favorites store.
+
+    :return: A response with the result for every country.
+    """
+    results = []
+    for country_name in country_names:
+        if await store.remove(country_name.name):
+            results.append(
+                {
+                    "country": country_name.name,
+                    "status": status.HTTP_200_OK,
+                    "message": f"{country_name.name} removed from the favorite list",
+                }
+            )
+        else:
+            results.append(
+                {
+                    "country": country_name.name,
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "error": "Country not found in the favorite list",
+                }
+            )
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content={"results": results})
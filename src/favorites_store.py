@@ -0,0 +1,196 @@
+"""
+This module contains the storage backends of the favorite countries.
+The in-memory store is local to one process. The SQLite store keeps the
+favorites on disk and is shared by all the workers using the same database.
+Its queries run in a thread of their own, so a worker waiting for the write
+lock of another one keeps serving the other requests.
+"""
+
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import Request
+
+# The number of seconds a query waits for another worker to release the lock
+BUSY_TIMEOUT = 0.5
+
+
+def is_busy(error: sqlite3.OperationalError) -> bool:
+    """
+    Check whether a query failed because the database stayed locked, rather
+    than because of a fault such as a read-only database or a missing table.
+    :param error: The error of the query.
+    :return: True if the database was busy or locked.
+    """
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is None:
+        return "locked" in str(error)
+    # The extended result codes keep the primary code in their lowest byte
+    return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+class FavoritesStore(ABC):
+    """
+    An ordered set of favorite country names.
+    """
+
+    @abstractmethod
+    async def list(self) -> list[str]:
+        """
+        Get the favorite countries, in the order they were added.
+        :return: The names of the countries.
+        """
+
+    @abstractmethod
+    async def add(self, name: str) -> bool:
+        """
+        Add a country to the favorites.
+        :param name: The name of the country.
+        :return: False if the country was already a favorite.
+        """
+
+    @abstractmethod
+    async def remove(self, name: str) -> bool:
+        """
+        Remove a country from the favorites.
+        :param name: The name of the country.
+        :return: False if the country was not a favorite.
+        """
+
+    @abstractmethod
+    async def contains(self, name: str) -> bool:
+        """
+        Check whether a country is a favorite.
+        :param name: The name of the country.
+        :return: Whether the country is a favorite.
+        """
+
+    def close(self) -> None:
+        """
+        Release the resources of the store.
+        """
+
+
+class MemoryFavoritesStore(FavoritesStore):
+    """
+    A favorites store in the memory of the process.
+    A dictionary keeps the insertion order with constant-time lookups.
+    """
+
+    def __init__(self):
+        self._favorites: dict[str, None] = {}
+
+    async def list(self) -> list[str]:
+        return list(self._favorites)
+
+    async def add(self, name: str) -> bool:
+        if name in self._favorites:
+            return False
+        self._favorites[name] = None
+        return True
+
+    async def remove(self, name: str) -> bool:
+        if name not in self._favorites:
+            return False
+        del self._favorites[name]
+        return True
+
+    async def contains(self, name: str) -> bool:
+        return name in self._favorites
+
+
+class SQLiteFavoritesStore(FavoritesStore):
+    """
+    A favorites store in an SQLite database in WAL mode, so many worker
+    processes can read it while one of them writes.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The path of the database file.
+        """
+        self._connection = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # The unique constraint indexes the names; the position keeps the order
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS favorites ("
+            "position INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "name TEXT NOT NULL UNIQUE)"
+        )
+        # The connection is only used by this thread once the store is created
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="favorites")
+
+    async def _run(self, query: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Run a query in the thread of the store.
+        :param query: The function running the query on the connection.
+        :return: The result of the function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, query, self._connection)
+
+    async def list(self) -> list[str]:
+        rows = await self._run(
+            lambda connection: connection.execute(
+                "SELECT name FROM favorites ORDER BY position"
+            ).fetchall()
+        )
+        return [name for (name,) in rows]
+
+    async def add(self, name: str) -> bool:
+        cursor = await self._run(
+            lambda connection: connection.execute(
+                "INSERT OR IGNORE INTO favorites (name) VALUES (?)", (name,)
+            )
+        )
+        return cursor.rowcount == 1
+
+    async def remove(self, name: str) -> bool:
+        cursor = await self._run(
+            lambda connection: connection.execute(
+                "DELETE FROM favorites WHERE name = ?", (name,)
+            )
+        )
+        return cursor.rowcount == 1
+
+    async def contains(self, name: str) -> bool:
+        row = await self._run(
+            lambda connection: connection.execute(
+                "SELECT 1 FROM favorites WHERE name = ?", (name,)
+            ).fetchone()
+        )
+        return row is not None
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self._connection.close()
+
+
+def create_store(path: str | None = None) -> FavoritesStore:
+    """
+    Create the favorites store.
+    :param path: The path of the SQLite database, or None to keep the favorites
+        in memory.
+    :return: The store.
+    """
+    if path:
+        return SQLiteFavoritesStore(path)
+    return MemoryFavoritesStore()
+
+
+def get_store(request: Request) -> FavoritesStore:
+    """
+    Dependency returning the favorites store of the application.
+    :param request: The incoming request.
+    :return: The store.
+    """
+    return request.app.state.favorites
@@ -0,0 +1,245 @@
+"""
+This module contains the spatial index over the coordinates of the capitals.
+The capitals are bucketed in a grid of `CELL_DEGREES` degrees, so a query only
+computes the distance to the capitals of the cells its circle overlaps. The
+great-circle (haversine) distances of many candidates are computed at once
+with numpy, and those of a few candidates one by one, which is faster.
+numpy is only imported by the first query needing it, as it is slow to import.
+"""
+
+import functools
+import math
+
+# The mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+# No two points of the Earth are further apart
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+# The size of the cells of the grid, which divides 180
+CELL_DEGREES = 5
+ROWS = 180 // CELL_DEGREES
+COLUMNS = 360 // CELL_DEGREES
+# The number of kilometers of a degree of latitude
+KM_PER_DEGREE = MAX_DISTANCE_KM / 180
+# The number of candidates from which the distances are computed with numpy
+VECTORIZE_MIN = 64
+
+
+@functools.cache
+def _numpy():
+    """
+    Import numpy.
+    :return: The numpy module, or None if it is not installed.
+    """
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover - depends on the environment
+        return None
+    return numpy
+
+
+def haversine(
+    latitude1: float, longitude1: float, latitude2: float, longitude2: float
+) -> float:
+    """
+    Get the great-circle distance between two locations.
+    :param latitude1: The latitude of the first location.
+    :param longitude1: The longitude of the first location.
+    :param latitude2: The latitude of the second location.
+    :param longitude2: The longitude of the second location.
+    :return: The distance in kilometers.
+    """
+    latitude1, longitude1 = math.radians(latitude1), math.radians(longitude1)
+    latitude2, longitude2 = math.radians(latitude2), math.radians(longitude2)
+    a = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1)
+        * math.cos(latitude2)
+        * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def grid_cell(latitude: float, longitude: float) -> tuple[int, int]:
+    """
+    Get the cell of the grid containing a location.
+    :param latitude: The latitude.
+    :param longitude: The longitude.
+    :return: The row and the column of the cell.
+    """
+    row = min(max(int((latitude + 90) // CELL_DEGREES), 0), ROWS - 1)
+    return row, int((longitude + 180) // CELL_DEGREES) % COLUMNS
+
+
+class SpatialIndex:
+    """
+    An immutable grid index over named locations, answering nearest and radius
+    queries in kilometers.
+    """
+
+    def __init__(self, locations: dict[str, tuple[float, float]]):
+        """
+        :param locations: The latitude and longitude by name.
+        """
+        self.names = list(locations)
+        self.locations = [locations[name] for name in self.names]
+        # The positions of the locations by cell of the grid
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        for position, location in enumerate(self.locations):
+            self.cells.setdefault(grid_cell(*location), []).append(position)
+        # The latitudes and longitudes in radians, for numpy, built on first use
+        self._radians = None
+        # The shared locations by radius, built on first use
+        self._shared: dict[float, dict[tuple[float, float], tuple[float, float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def distances(
+        self, latitude: float, longitude: float, positions: list[int]
+    ) -> list[float]:
+        """
+        Get the distances from a location to some of the indexed locations.
+        :param latitude: The latitude.
+        :param longitude: The longitude.
+        :param positions: The positions of the indexed locations.
+        :return: The distances in kilometers, in the same order.
+        """
+        np = _numpy() if len(positions) >= VECTORIZE_MIN else None
+        if np is None:
+            return [
+                haversine(latitude, longitude, *self.locations[position])
+                for position in positions
+            ]
+        if self._radians is None:
+            self._radians = np.radians(
+                np.array(self.locations, dtype=float).reshape(-1, 2)
+            )
+        selected = self._radians[
+            np.fromiter(positions, dtype=np.intp, count=len(positions))
+        ]
+        latitudes, longitudes = selected[:, 0], selected[:, 1]
+        latitude, longitude = math.radians(latitude), math.radians(longitude)
+        a = (
+            np.sin((latitudes - latitude) / 2) ** 2
+            + math.cos(latitude)
+            * np.cos(latitudes)
+            * np.sin((longitudes - longitude) / 2) ** 2
+        )
+        return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+    def _candidates(
+        self, latitude: float, longitude: float, radius: float
+    ) -> list[int]:
+        """
+        Get the locations of the cells overlapped by a circle.
+        :param latitude: The latitude of the center.
+        :param longitude: The longitude of the center.
+        :param radius: The radius in kilometers.
+        :return: The positions of the locations, some of them outside the circle.
+        """
+        angle = radius / EARTH_RADIUS_KM
+        south = latitude - math.degrees(angle)
+        north = latitude + math.degrees(angle)
+        rows = range(grid_cell(south, 0)[0], grid_cell(north, 0)[0] + 1)
+        # The circle covers all the longitudes when it contains a pole
+        ratio = math.sin(angle) / math.cos(math.radians(latitude))
+        if south <= -90 or north >= 90 or angle >= math.pi / 2 or ratio >= 1:
+            return [
+                position
+                for (row, _), positions in self.cells.items()
+                if row in rows
+                for position in positions
+            ]
+        span = math.degrees(math.asin(ratio))
+        first = int((longitude - span + 180) // CELL_DEGREES)
+        last = int((longitude + span + 180) // CELL_DEGREES)
+        columns = {column % COLUMNS for column in range(first, last + 1)}
+        return [
+            position
+            for row in rows
+            for column in columns
+            for position in self.cells.get((row, column), ())
+        ]
+
+    def _within(
+        self, latitude: float, longitude: float, radius: float
+    ) -> list[tuple[float, int]]:
+        """
+        Get the locations within a distance of a location.
+        :param latitude: The latitude.
+        :param longitude: The longitude.
+        :param radius: The distance in kilometers.
+        :return: The (distance, position) pairs, the closest first.
+        """
+        positions = self._candidates(latitude, longitude, radius)
+        distances = self.distances(latitude, longitude, positions)
+        return sorted(
+            (distance, position)
+            for distance, position in zip(distances, positions)
+            if distance <= radius
+        )
+
+    def within(
+        self, latitude: float, longitude: float, radius: float
+    ) -> list[tuple[str, float]]:
+        """
+        Get the locations within a distance of a location.
+        :param latitude: The latitude.
+        :param longitude: The longitude.
+        :param radius: The distance in kilometers.
+        :return: The (name, distance in kilometers) pairs, the closest first.
+        """
+        return [
+            (self.names[position], distance)
+            for distance, position in self._within(latitude, longitude, radius)
+        ]
+
+    def nearest(
+        self, latitude: float, longitude: float, k: int = 1
+    ) -> list[tuple[str, float]]:
+        """
+        Get the locations closest to a location. The radius of the search is
+        doubled until it contains enough of them.
+        :param latitude: The latitude.
+        :param longitude: The longitude.
+        :param k: The number of locations.
+        :return: The (name, distance in kilometers) pairs, the closest first.
+        """
+        radius = CELL_DEGREES * KM_PER_DEGREE
+        while True:
+            found = self.within(latitude, longitude, radius)
+            if len(found) >= k or radius >= MAX_DISTANCE_KM:
+                return found[:k]
+            radius *= 2
+
+    def shared_locations(
+        self, radius: float
+    ) -> dict[tuple[float, float], tuple[float, float]]:
+        """
+        Group the locations closer than a distance, for them to share a value
+        such as the weather. The locations with the most neighbours are picked
+        first, and every group is made of the locations within the distance of
+        the one picked, which stands for them.
+        :param radius: The distance in kilometers.
+        :return: The location standing for every location in a group of
+            several, by location.
+        """
+        shared = self._shared.get(radius)
+        if shared is not None:
+            return shared
+        neighbours = [
+            [position for _, position in self._within(*location, radius)]
+            for location in self.locations
+        ]
+        shared = {}
+        for position in sorted(
+            range(len(self.locations)),
+            key=lambda p: (-len(neighbours[p]), self.names[p]),
+        ):
+            location = self.locations[position]
+            if location in shared or len(neighbours[position]) < 2:
+                continue
+            for neighbour in neighbours[position]:
+                shared.setdefault(self.locations[neighbour], location)
+        self._shared[radius] = shared
+        return shared
@@ -0,0 +1,219 @@
+"""
+This module contains the Prometheus metrics of the application: the latency of
+the requests by route, the latency of the upstream calls by host, the requests
+in progress and the cache events. They are exposed on /metrics when
+prometheus_client is installed.
+
+With several workers, every worker writes its metrics to files in the
+directory given by the PROMETHEUS_MULTIPROC_DIR environment variable, and the
+worker answering /metrics aggregates them. The server sets it up.
+"""
+
+import os
+import time
+
+import httpx
+from fastapi import Response, status
+
+from src import cache
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+except ImportError:  # pragma: no cover - depends on the environment
+    PROMETHEUS_AVAILABLE = False
+else:
+    PROMETHEUS_AVAILABLE = True
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+# The buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+if PROMETHEUS_AVAILABLE:
+    REQUEST_LATENCY = Histogram(
+        "http_request_duration_seconds",
+        "The latency of the requests, by route.",
+        ["method", "route", "status"],
+        buckets=LATENCY_BUCKETS,
+    )
+    REQUESTS_IN_PROGRESS = Gauge(
+        "http_requests_in_progress",
+        "The number of requests in progress.",
+        multiprocess_mode="livesum",
+    )
+    UPSTREAM_LATENCY = Histogram(
+        "upstream_request_duration_seconds",
+        "The time until the response headers of the upstream APIs, by host.",
+        ["host", "status"],
+        buckets=LATENCY_BUCKETS,
+    )
+    UPSTREAM_IN_PROGRESS = Gauge(
+        "upstream_requests_in_progress",
+        "The number of upstream requests in progress, by host.",
+        ["host"],
+        multiprocess_mode="livesum",
+    )
+    WORKER_START = Gauge(
+        "worker_start_seconds",
+        "The time the worker took to start, by phase: from the start of the "
+        "process until the application is imported, running its startup, and "
+        "the CPU time of the process until then.",
+        ["phase"],
+        multiprocess_mode="liveall",
+    )
+    CACHE_EVENTS = Counter(
+        "cache_events",
+        "The hits, misses and evictions of the caches.",
+        ["cache", "event"],
+    )
+
+    def _count_cache_event(name: str, event: str) -> None:
+        CACHE_EVENTS.labels(name, event).inc()
+
+    cache.listeners.append(_count_cache_event)
+
+
+def metrics_response() -> Response:
+    """
+    Get the current metrics, in the Prometheus text format.
+    :return: The metrics, aggregated over all the workers.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return Response(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            content="The metrics require prometheus_client",
+        )
+    registry = REGISTRY
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def record_start(seconds: dict[str, float]) -> None:
+    """
+    Record how long the worker took to start.
+    :param seconds: The number of seconds by phase, e.g. "import_seconds".
+    """
+    if PROMETHEUS_AVAILABLE:
+        for phase, value in seconds.items():
+            WORKER_START.labels(phase.removesuffix("_seconds")).set(value)
+
+
+def prepare_multiprocess_dir(path: str) -> None:
+    """
+    Empty the directory the workers write their metrics to, before they start.
+    :param path: The directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+
+
+def mark_process_dead() -> None:
+    """
+    Remove the live gauges of the current worker when it stops.
+    """
+    if PROMETHEUS_AVAILABLE and os.environ.get(MULTIPROC_DIR_ENV):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    Middleware measuring the latency of every request, labelled with the
+    template of its route (e.g. /country/{country_name}) to bound the number
+    of series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROMETHEUS_AVAILABLE:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status_code,
+            ).observe(time.perf_counter() - start)
+
+
+class UpstreamMetricsTransport(httpx.AsyncBaseTransport):
+    """
+    A transport measuring the upstream calls of the transport it wraps.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        """
+        :param transport: The transport sending the requests.
+        """
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        in_progress = UPSTREAM_IN_PROGRESS.labels(host)
+        in_progress.inc()
+        result = "error"
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+            result = str(response.status_code)
+            return response
+        finally:
+            in_progress.dec()
+            UPSTREAM_LATENCY.labels(host, result).observe(time.perf_counter() - start)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def instrument(transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+    """
+    Measure the upstream calls of a transport, if prometheus_client is installed.
+    :param transport: The transport.
+    :return: The instrumented transport, or the transport itself.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return transport
+    return UpstreamMetricsTransport(transport)
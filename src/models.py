@@ -1,6 +1,8 @@
 """
 This module contains the Pydantic models for the API parameters.
 """
+from enum import Enum
+
 from pydantic import BaseModel
 
 
@@ -17,3 +19,8 @@ class Country(BaseModel):
     language: str
     timezone: str
     continent: str
+
+
+class StreamFormat(str, Enum):
+    ndjson = "ndjson"
+    sse = "sse"
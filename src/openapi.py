@@ -0,0 +1,115 @@
+"""
+This module contains the pre-generated OpenAPI document of the application.
+The document is generated at build time into `static/openapi.json`, so the
+workers serve it as pre-encoded bytes instead of building the schema on the
+first request:
+
+    python -m src.openapi            # write static/openapi.json
+    python -m src.openapi --check    # fail if static/openapi.json is outdated
+"""
+
+import argparse
+import logging
+import sys
+
+from fastapi import FastAPI
+
+from src.responses import dumps
+
+logger = logging.getLogger(__name__)
+
+OPENAPI_PATH = "static/openapi.json"
+
+
+def build_openapi(app: FastAPI) -> bytes:
+    """
+    Generate the OpenAPI document of an application.
+    Like FastAPI, the root path of the application is added to the servers.
+    :param app: The application.
+    :return: The encoded JSON document.
+    """
+    schema = dict(app.openapi())
+    servers = list(schema.get("servers", []))
+    if app.root_path and all(s.get("url") != app.root_path for s in servers):
+        servers.insert(0, {"url": app.root_path})
+    if servers:
+        schema["servers"] = servers
+    return dumps(schema)
+
+
+def read_openapi(path: str = OPENAPI_PATH) -> bytes | None:
+    """
+    Read a pre-generated OpenAPI document.
+    :param path: The path of the document.
+    :return: The encoded JSON document, or None if it does not exist or is empty.
+    """
+    try:
+        with open(path, "rb") as f:
+            document = f.read()
+    except OSError:
+        return None
+    return document or None
+
+
+def write_openapi(app: FastAPI, path: str = OPENAPI_PATH) -> bytes:
+    """
+    Generate the OpenAPI document of an application and write it to a file.
+    :param app: The application.
+    :param path: The path of the document.
+    :return: The encoded JSON document.
+    """
+    document = build_openapi(app)
+    with open(path, "wb") as f:
+        f.write(document)
+    return document
+
+
+def load_openapi(app: FastAPI, path: str = OPENAPI_PATH) -> bytes:
+    """
+    Get the OpenAPI document served by an application.
+    The pre-generated document is used if it exists, otherwise it is generated.
+    :param app: The application.
+    :param path: The path of the pre-generated document.
+    :return: The encoded JSON document.
+    """
+    document = read_openapi(path)
+    if document is None:
+        logger.warning("%s is missing, generating the OpenAPI document", path)
+        document = build_openapi(app)
+    return document
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Write the OpenAPI document of the application, or check that it is current.
+    :param argv: The command line arguments, by default those of the process.
+    :return: The exit code.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate the OpenAPI document of the application."
+    )
+    parser.add_argument(
+        "--path", type=str, default=OPENAPI_PATH, help="The path of the document."
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Do not write the document, but fail if it is outdated.",
+    )
+    args = parser.parse_args(argv)
+
+    from app import app
+
+    if args.check:
+        if read_openapi(args.path) != build_openapi(app):
+            print(f"{args.path} is outdated, run `python -m src.openapi`")
+            return 1
+        print(f"{args.path} is up to date")
+        return 0
+    document = write_openapi(app, args.path)
+    print(f"Wrote {args.path} ({len(document)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+This module keeps the weather of the capitals warm: a background task reloads
+the current temperature and the forecast of the hot grid cells shortly before
+they expire, so the temperature and forecast paths are served from memory.
+
+The hot cells are those of the favorite countries and of the most requested
+countries, or of all the capitals. The reloads are background calls for the
+OpenWeatherMap quota: they wait behind the requests, and leave them part of
+the quota (see src/quota.py).
+"""
+
+import asyncio
+import logging
+
+import httpx
+
+from src import quota
+from src.cache import TTLCache
+from src.client import UpstreamError
+from src.country_index import get_index
+from src.favorites_store import FavoritesStore
+from src.weather import (
+    current_cache,
+    forecast_cache,
+    grid_cell,
+    key_pool,
+    load_forecast,
+    load_temperature,
+    requested_cells,
+)
+
+logger = logging.getLogger(__name__)
+
+OFF = "off"
+HOT = "hot"
+ALL = "all"
+MODES = (OFF, HOT, ALL)
+# The number of seconds between two passes over the hot cells
+INTERVAL = 60.0
+# The number of most requested cells kept warm
+HOT_CELLS = 50
+
+
+async def hot_cells(favorites: FavoritesStore, mode: str) -> list[tuple[float, float]]:
+    """
+    Get the grid cells to keep warm.
+    :param favorites: The favorite countries.
+    :param mode: "hot" for the favorite and the most requested countries, or
+        "all" for all the capitals.
+    :return: The grid cells, the most important first.
+    """
+    index = get_index()
+    cells = {}
+    if index is not None:
+        names = index.coordinates if mode == ALL else await favorites.list()
+        for name in names:
+            country = index.get(name)
+            coordinates = country and index.coordinates.get(country["name"]["common"])
+            if coordinates:
+                cells[grid_cell(*coordinates)] = None
+    for cell, _ in requested_cells.most_common(HOT_CELLS):
+        cells[cell] = None
+    return list(cells)
+
+
+def _expiring(cache: TTLCache, cell: tuple[float, float], interval: float) -> bool:
+    """
+    Check whether the value of a cell is missing or expires before the next pass.
+    :param cache: The cache.
+    :param cell: The grid cell.
+    :param interval: The number of seconds until the next pass.
+    :return: Whether to reload the value.
+    """
+    entry = cache.peek(cell)
+    return entry is None or entry.age >= cache.ttl - 2 * interval
+
+
+async def prefetch(
+    client: httpx.AsyncClient,
+    favorites: FavoritesStore,
+    mode: str = HOT,
+    interval: float = INTERVAL,
+) -> int:
+    """
+    Reload the weather of the hot cells that expire before the next pass.
+    The cells are reloaded one at a time, with the background priority.
+
+    :param client: The HTTP client.
+    :param favorites: The favorite countries.
+    :param mode: Which cells to keep warm, "hot" or "all".
+    :param interval: The number of seconds until the next pass.
+
+    :return: The number of values reloaded.
+    """
+    reloaded = 0
+    with quota.background():
+        for cell in await hot_cells(favorites, mode):
+            for cache, load in (
+                (current_cache, load_temperature),
+                (forecast_cache, load_forecast),
+            ):
+                if not _expiring(cache, cell, interval):
+                    continue
+                try:
+                    await cache.refresh(cell, lambda: load(client, cell))
+                    reloaded += 1
+                except (UpstreamError, httpx.HTTPError) as error:
+                    logger.debug("Error prefetching the weather of %s: %s", cell, error)
+    # Older requests count less, so the hot cells follow the traffic
+    for cell in list(requested_cells):
+        requested_cells[cell] //= 2
+        if not requested_cells[cell]:
+            del requested_cells[cell]
+    return reloaded
+
+
+async def prefetch_periodically(
+    client: httpx.AsyncClient,
+    favorites: FavoritesStore,
+    mode: str = HOT,
+    interval: float = INTERVAL,
+) -> None:
+    """
+    Keep the weather of the hot cells warm forever. A failed pass is logged,
+    and the next one is tried after the interval.
+
+    :param client: The HTTP client.
+    :param favorites: The favorite countries.
+    :param mode: Which cells to keep warm, "hot" or "all".
+    :param interval: The number of seconds between two passes.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if not key_pool.buckets:
+            continue
+        try:
+            reloaded = await prefetch(client, favorites, mode, interval)
+        except Exception:
+            # A failed pass must not stop the next ones
+            logger.exception("Error prefetching the weather")
+            continue
+        if reloaded:
+            logger.info("Prefetched %d weather values", reloaded)
@@ -0,0 +1,199 @@
+"""
+This module profiles slow requests with a sampling profiler: a thread records
+the stack of the event loop thread at a fixed interval, and the samples are
+written in the folded format read by flamegraph.pl and speedscope:
+
+    main (app.py:1);run (runners.py:118);get_forecast (country.py:1041) 12
+
+A request is profiled when an admin asks for it with `?profile=1` and the
+`X-Admin-Key` header, or when it is picked by the sampling rate and turns out
+slower than the threshold. Only one request is profiled at a time, and the
+samples include whatever the event loop ran during that request, e.g. the
+other requests in progress.
+"""
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+ADMIN_KEY_HEADER = b"x-admin-key"
+# The number of seconds between two samples
+INTERVAL = 0.005
+# The number of seconds after which a sampled request is written
+SLOW_THRESHOLD = 1.0
+PROFILE_DIR = "profiles"
+
+admin_key: str | None = None
+sample_rate = 0.0
+slow_threshold = SLOW_THRESHOLD
+profile_dir = PROFILE_DIR
+
+# Whether a request is being profiled
+_busy = False
+
+
+def configure(
+    key: str | None,
+    rate: float,
+    threshold: float = SLOW_THRESHOLD,
+    directory: str = PROFILE_DIR,
+) -> None:
+    """
+    Set which requests are profiled.
+    :param key: The key allowing `?profile=1` requests, or None to disable them.
+    :param rate: The fraction of the requests profiled, between 0 and 1.
+    :param threshold: The number of seconds after which a sampled request is
+        written.
+    :param directory: The directory the profiles are written to.
+    """
+    global admin_key, sample_rate, slow_threshold, profile_dir
+    admin_key = key
+    sample_rate = rate
+    slow_threshold = threshold
+    profile_dir = directory
+
+
+def _label(frame) -> str:
+    """
+    Get the label of a frame in a folded stack.
+    :param frame: The frame.
+    :return: The function, with its file and first line.
+    """
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class Sampler:
+    """
+    A thread sampling the stack of another thread.
+    """
+
+    def __init__(self, thread_id: int, interval: float = INTERVAL):
+        """
+        :param thread_id: The identifier of the thread to sample.
+        :param interval: The number of seconds between two samples.
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        """
+        Start sampling.
+        """
+        self._thread.start()
+
+    def stop(self) -> Counter[str]:
+        """
+        Stop sampling.
+        :return: The number of samples of every folded stack.
+        """
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+
+def write_profile(stacks: Counter[str], name: str) -> str:
+    """
+    Write samples in the folded format.
+    :param stacks: The number of samples of every folded stack.
+    :param name: A name identifying the request in the file name.
+    :return: The path of the file.
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+    path = os.path.join(profile_dir, f"{timestamp}-{safe_name or 'root'}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def _requested(scope) -> bool:
+    """
+    Check whether a request asks to be profiled, with a valid admin key.
+    :param scope: The ASGI scope of the request.
+    :return: Whether to profile the request.
+    """
+    if not admin_key or b"profile" not in scope["query_string"]:
+        return False
+    query = parse_qsl(scope["query_string"].decode("latin-1"))
+    if ("profile", "1") not in query:
+        return False
+    key = dict(scope["headers"]).get(ADMIN_KEY_HEADER, b"")
+    return hmac.compare_digest(key, admin_key.encode())
+
+
+class ProfilerMiddleware:
+    """
+    Middleware profiling the requests asked for by an admin, and a sample of
+    the others. The path of the profile of a requested profile is returned in
+    the `X-Profile` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _busy
+        if scope["type"] != "http" or _busy or not (admin_key or sample_rate):
+            await self.app(scope, receive, send)
+            return
+        requested = _requested(scope)
+        if not requested and random.random() >= sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        _busy = True
+        sampler = Sampler(threading.get_ident())
+        sampler.start()
+        start = time.perf_counter()
+        running = True
+
+        def finish() -> str | None:
+            nonlocal running
+            running = False
+            stacks = sampler.stop()
+            if requested or time.perf_counter() - start >= slow_threshold:
+                return write_profile(stacks, scope["path"])
+            return None
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and running:
+                # The handler is done when the headers are sent, except for the
+                # streamed responses
+                path = finish()
+                if requested:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-profile", path.encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if running:
+                finish()
+            _busy = False
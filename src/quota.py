@@ -0,0 +1,418 @@
+"""
+This module keeps the calls to the OpenWeatherMap API under its quota.
+Every API key has a token bucket refilled at the rate the quota allows, and
+the calls take a token from the key with the most tokens, so the throughput
+grows with the number of keys. When no key has a token, the calls wait in a
+queue where the interactive requests go before the background refreshes, and
+the background refreshes leave some tokens to the interactive requests.
+
+The buckets never allow more than the quota in any minute: a bucket holds at
+most `burst` tokens, and is refilled with the rest of the quota over the minute.
+The tokens are taken by a transport, for every attempt of a request, so the
+retries and the hedged requests are counted too.
+
+A call made by a load shared by several callers, such as a cache load, gets
+the highest priority of the callers still waiting for it: once they are all
+gone (e.g. their requests were cancelled), it waits like a background call.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+import httpx
+
+from src import timing, upstream
+
+# The priorities of the calls, the lowest first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# The free plan of OpenWeatherMap allows 60 calls per minute
+CALLS_PER_MINUTE = 60
+# The fraction of the quota that can be used at once
+BURST_FRACTION = 0.1
+# The number of seconds an interactive call waits for the quota before failing
+QUEUE_TIMEOUT = 5.0
+# The number of seconds a key is not used after the API said it exceeded its quota
+THROTTLE_SECONDS = 60.0
+# The fraction of the burst the background calls leave to the interactive calls
+BACKGROUND_RESERVE = 0.5
+
+_priority: ContextVar[int] = ContextVar("priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """
+    Make the calls of a block of code wait behind the interactive calls.
+    """
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class QuotaExceededError(Exception):
+    """
+    Raised when no API key has quota left in time.
+    """
+
+
+@dataclass(order=True)
+class _Waiter:
+    """
+    A call waiting for the quota, ordered by priority, then by arrival.
+    """
+
+    priority: int
+    order: int
+    future: asyncio.Future = field(compare=False)
+    # The task making the call, whose priority can change while it waits
+    task: asyncio.Task | None = field(compare=False)
+    timer: asyncio.TimerHandle | None = field(default=None, compare=False)
+
+
+class TokenBucket:
+    """
+    A bucket of `capacity` tokens, refilled with `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: The number of tokens added per second.
+        :param capacity: The maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self) -> float:
+        """
+        Add the tokens earned since the last update.
+        :return: The number of tokens.
+        """
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+        return self.tokens
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """
+        Get the number of seconds until the bucket has some tokens.
+        :param tokens: The number of tokens.
+        :return: The number of seconds, 0 if the bucket has them.
+        """
+        missing = tokens - self.refill()
+        paused = max(self.updated - time.monotonic(), 0.0)
+        return paused + max(missing, 0.0) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """
+        Empty the bucket, and refill it only after some time.
+        :param seconds: The number of seconds before the bucket is refilled.
+        """
+        self.tokens = 0.0
+        self.updated = time.monotonic() + seconds
+
+
+class KeyPool:
+    """
+    The API keys of OpenWeatherMap, with their quota.
+    """
+
+    def __init__(
+        self,
+        calls_per_minute: float = CALLS_PER_MINUTE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        """
+        :param calls_per_minute: The quota of every key.
+        :param queue_timeout: The number of seconds an interactive call waits for
+            the quota.
+        """
+        self.calls_per_minute = calls_per_minute
+        self.queue_timeout = queue_timeout
+        self.buckets: dict[str, TokenBucket] = {}
+        self._waiters: list[_Waiter] = []
+        self._order = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        # The priorities of the callers waiting for the tasks making calls
+        self._callers: dict[asyncio.Task, Counter[int]] = {}
+        self.waited = 0
+        self.rejected = 0
+
+    def configure(self, calls_per_minute: float, queue_timeout: float) -> None:
+        """
+        Change the quota of the keys.
+        :param calls_per_minute: The quota of every key.
+        :param queue_timeout: The number of seconds an interactive call waits for
+            the quota.
+        """
+        self.calls_per_minute = calls_per_minute
+        self.queue_timeout = queue_timeout
+        self.set_keys(list(self.buckets))
+
+    def set_keys(self, keys: list[str]) -> None:
+        """
+        Set the API keys.
+        :param keys: The API keys.
+        """
+        burst = max(1.0, self.calls_per_minute * BURST_FRACTION)
+        rate = max(self.calls_per_minute - burst, 1.0) / 60
+        self.buckets = {key: TokenBucket(rate, burst) for key in keys}
+
+    async def acquire(self, priority: int | None = None) -> str:
+        """
+        Take a call from the quota of a key, waiting until one has some left.
+        Interactive calls fail after the queue timeout, background calls wait
+        as long as needed.
+
+        :param priority: The priority of the call, by default that of the
+            callers waiting for the current task (see `waiting`), or else that
+            of the current context.
+
+        :return: The API key to call the API with.
+        :raises QuotaExceededError: If no key had quota left in time.
+        """
+        task = None
+        if priority is None:
+            task = asyncio.current_task()
+            priority = self._task_priority(task)
+            if priority is None:
+                priority = _priority.get()
+        if not self.buckets:
+            raise QuotaExceededError("No OpenWeatherMap API key is set")
+        if not self._waiters:
+            key = self._take(priority)
+            if key is not None:
+                return key
+
+        self.waited += 1
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._order), loop.create_future(), task)
+        heapq.heappush(self._waiters, waiter)
+        self._set_timeout(waiter)
+        # The call may go before the others, which may need more tokens
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+        try:
+            return await waiter.future
+        except QuotaExceededError:
+            self.rejected += 1
+            raise
+        finally:
+            if waiter.timer is not None:
+                waiter.timer.cancel()
+
+    @contextmanager
+    def waiting(self, task: asyncio.Task):
+        """
+        Declare that the current caller waits for a task making calls, such as
+        a load shared by the callers of a cache. The calls of the task get the
+        highest priority of the callers in this block, and the background
+        priority when there are none.
+        :param task: The task.
+        """
+        if task.done():
+            yield
+            return
+        callers = self._callers.get(task)
+        if callers is None:
+            callers = self._callers[task] = Counter()
+            task.add_done_callback(lambda done: self._callers.pop(done, None))
+        priority = _priority.get()
+        callers[priority] += 1
+        self._reprioritize(task)
+        try:
+            yield
+        finally:
+            callers[priority] -= 1
+            if not callers[priority]:
+                del callers[priority]
+            self._reprioritize(task)
+
+    def throttle(self, key: str) -> None:
+        """
+        Stop using a key for a while, after the API said it exceeded its quota.
+        :param key: The API key.
+        """
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.pause(THROTTLE_SECONDS)
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of the pool.
+        :return: A dictionary with the number of keys and of waiting calls.
+        """
+        return {
+            "keys": len(self.buckets),
+            "calls_per_minute": self.calls_per_minute * len(self.buckets),
+            "waiting": sum(not waiter.future.done() for waiter in self._waiters),
+            "waited": self.waited,
+            "rejected": self.rejected,
+        }
+
+    @staticmethod
+    def _needed(bucket: TokenBucket, priority: int) -> float:
+        """
+        Get the number of tokens a bucket must have for a call to take one.
+        The background calls leave a reserve to the interactive calls.
+        :param bucket: The bucket.
+        :param priority: The priority of the call.
+        :return: The number of tokens.
+        """
+        if priority == INTERACTIVE:
+            return 1.0
+        return max(1.0, min(1 + bucket.capacity * BACKGROUND_RESERVE, bucket.capacity))
+
+    def _task_priority(self, task: asyncio.Task | None) -> int | None:
+        """
+        Get the priority of the calls of a task, from the callers waiting for it.
+        :param task: The task.
+        :return: The priority, or None if nobody declared waiting for the task.
+        """
+        callers = self._callers.get(task)
+        if callers is None:
+            return None
+        return min(callers, default=BACKGROUND)
+
+    def _set_timeout(self, waiter: _Waiter) -> None:
+        """
+        Make a waiting call fail after the queue timeout if it is interactive.
+        :param waiter: The waiting call.
+        """
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+            waiter.timer = None
+        if waiter.priority == INTERACTIVE:
+            waiter.timer = asyncio.get_running_loop().call_later(
+                self.queue_timeout, self._expire, waiter
+            )
+
+    def _expire(self, waiter: _Waiter) -> None:
+        """
+        Fail a call that waited too long.
+        :param waiter: The waiting call.
+        """
+        if not waiter.future.done():
+            waiter.future.set_exception(
+                QuotaExceededError("The OpenWeatherMap quota is exhausted")
+            )
+
+    def _reprioritize(self, task: asyncio.Task) -> None:
+        """
+        Move the waiting calls of a task to the priority of its callers.
+        :param task: The task.
+        """
+        priority = self._task_priority(task)
+        if priority is None:
+            return
+        changed = False
+        for waiter in self._waiters:
+            if (
+                waiter.task is task
+                and waiter.priority != priority
+                and not waiter.future.done()
+            ):
+                waiter.priority = priority
+                self._set_timeout(waiter)
+                changed = True
+        if changed:
+            heapq.heapify(self._waiters)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._dispatch()
+
+    def _take(self, priority: int) -> str | None:
+        """
+        Take a token from the key with the most tokens.
+        :param priority: The priority of the call.
+        :return: The key, or None if no key has enough tokens.
+        """
+        best = None
+        for key, bucket in self.buckets.items():
+            if bucket.refill() >= self._needed(bucket, priority) and (
+                best is None or bucket.tokens > self.buckets[best].tokens
+            ):
+                best = key
+        if best is not None:
+            self.buckets[best].tokens -= 1
+        return best
+
+    def _schedule(self) -> None:
+        """
+        Wake up the waiting calls when the next token is available.
+        """
+        if self._timer is not None or not self._waiters or not self.buckets:
+            return
+        priority = self._waiters[0].priority
+        delay = min(
+            bucket.wait_time(self._needed(bucket, priority))
+            for bucket in self.buckets.values()
+        )
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self) -> None:
+        """
+        Give the available tokens to the waiting calls, by priority.
+        """
+        self._timer = None
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.future.done():
+                # The call timed out or was cancelled
+                heapq.heappop(self._waiters)
+                continue
+            key = self._take(waiter.priority)
+            if key is None:
+                break
+            heapq.heappop(self._waiters)
+            waiter.future.set_result(key)
+        self._schedule()
+
+
+class QuotaTransport(httpx.AsyncBaseTransport):
+    """
+    A transport taking a call from the quota of the API keys for every
+    OpenWeatherMap request it sends, and adding the key to it. The other
+    requests are sent as they are.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, pool: KeyPool):
+        """
+        :param transport: The transport sending the requests.
+        :param pool: The API keys.
+        """
+        self.transport = transport
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if upstream.service(str(request.url)) != "openweathermap":
+            return await self.transport.handle_async_request(request)
+        with timing.span("quota"):
+            key = await self.pool.acquire()
+        request.url = request.url.copy_merge_params({"appid": key})
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 429:
+            self.pool.throttle(key)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+# The API keys of OpenWeatherMap, shared by the client and the weather module
+key_pool = KeyPool()
@@ -0,0 +1,302 @@
+"""
+This module makes the upstream calls resilient to a slow or failing provider.
+Every upstream host gets a transport that:
+
+- retries the idempotent requests (GET, HEAD, OPTIONS) that failed with a
+  connection error, a timeout or a 502/503/504, after a random ("full jitter")
+  exponential backoff, within a time budget covering all the attempts;
+- stops calling the host for a while after consecutive failures (circuit
+  breaker), so the requests fail fast instead of waiting for timeouts, and the
+  caches serve their stale values;
+- optionally sends a second (hedged) request when the first one is slower than
+  the 95th percentile of the recent latencies, and keeps the fastest response.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+import httpx
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUSES = {502, 503, 504}
+RETRIES = 2
+# The base and the maximum number of seconds waited before a retry
+RETRY_BACKOFF = 0.1
+MAX_BACKOFF = 2.0
+# The maximum number of seconds of all the attempts of a request
+BUDGET = 10.0
+# The number of consecutive failures opening the circuit, and the number of
+# seconds it stays open before a request is let through to test the host
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 30.0
+# The latencies the hedging delay is computed from
+HEDGE_PERCENTILE = 95
+HEDGE_SAMPLES = 100
+HEDGE_MIN_SAMPLES = 20
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """
+    Raised instead of calling a host that is failing.
+    """
+
+
+class CircuitBreaker:
+    """
+    Counts the consecutive failures of a host. The circuit opens after
+    `threshold` failures: the calls fail fast for `reset` seconds, after which
+    one call is let through (half-open). Its success closes the circuit, and
+    its failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int = BREAKER_THRESHOLD,
+        reset: float = BREAKER_RESET,
+    ):
+        """
+        :param name: The name of the host, used in the logs.
+        :param threshold: The number of consecutive failures opening the circuit.
+        :param reset: The number of seconds the circuit stays open.
+        """
+        self.name = name
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """
+        The state of the circuit: "closed", "open" or "half_open".
+        """
+        if self.opened is None:
+            return "closed"
+        if time.monotonic() - self.opened < self.reset:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """
+        Check whether a call can be made, and reserve the trial call if the
+        circuit is half-open.
+        :return: Whether to make the call.
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self) -> None:
+        """
+        Record a successful call, which closes the circuit.
+        """
+        self.failures = 0
+        self.opened = None
+        self._trial = False
+
+    def failure(self) -> None:
+        """
+        Record a failed call, which opens the circuit after too many of them.
+        """
+        self.failures += 1
+        if self._trial or self.failures == self.threshold:
+            logger.warning(
+                "%s failed %d times in a row, not calling it for %.0f seconds",
+                self.name,
+                self.failures,
+                self.reset,
+            )
+        if self._trial or self.failures >= self.threshold:
+            self.opened = time.monotonic()
+        self._trial = False
+
+    def release(self) -> None:
+        """
+        Release the trial call of a half-open circuit that was cancelled.
+        """
+        self._trial = False
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """
+    A transport adding retries, a circuit breaker and hedged requests to the
+    transport it wraps. It is meant to wrap the transport of a single host.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        breaker: CircuitBreaker,
+        retries: int = RETRIES,
+        backoff: float = RETRY_BACKOFF,
+        budget: float = BUDGET,
+        hedge: bool = False,
+    ):
+        """
+        :param transport: The transport sending the requests.
+        :param breaker: The circuit breaker of the host.
+        :param retries: The maximum number of retries of an idempotent request.
+        :param backoff: The base number of seconds waited before a retry.
+        :param budget: The maximum number of seconds of all the attempts.
+        :param hedge: Whether to send hedged requests.
+        """
+        self.transport = transport
+        self.retries = retries
+        self.backoff = backoff
+        self.budget = budget
+        self.breaker = breaker
+        self.hedge = hedge
+        self.latencies: deque[float] = deque(maxlen=HEDGE_SAMPLES)
+        self.retried = 0
+        self.hedged = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        idempotent = request.method in IDEMPOTENT_METHODS
+        deadline = time.monotonic() + self.budget
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"The circuit of {request.url.host} is open", request=request
+                )
+            self._limit_timeout(request, deadline)
+            try:
+                if self.hedge and idempotent:
+                    response = await self._send_hedged(request)
+                else:
+                    response = await self._send(request)
+            except httpx.TransportError:
+                self.breaker.failure()
+                if not self._retry(idempotent, attempt, deadline):
+                    raise
+            except BaseException:
+                # Cancelled, or failed before reaching the host (e.g. no quota)
+                self.breaker.release()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.success()
+                    return response
+                self.breaker.failure()
+                if not self._retry(idempotent, attempt, deadline):
+                    return response
+                await response.aclose()
+
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+            self.retried += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+    def _delay(self, attempt: int) -> float:
+        """
+        Get the number of seconds to wait before a retry ("full jitter").
+        :param attempt: The number of the failed attempt, from 0.
+        :return: The number of seconds.
+        """
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2**attempt))
+
+    def _retry(self, idempotent: bool, attempt: int, deadline: float) -> bool:
+        """
+        Check whether a failed request can be retried.
+        :param idempotent: Whether the request is idempotent.
+        :param attempt: The number of the failed attempt, from 0.
+        :param deadline: The end of the time budget of the request.
+        :return: Whether to retry.
+        """
+        return (
+            idempotent
+            and attempt < self.retries
+            # The longest wait must leave some time for the next attempt
+            and time.monotonic() + min(MAX_BACKOFF, self.backoff * 2**attempt)
+            < deadline
+        )
+
+    @staticmethod
+    def _limit_timeout(request: httpx.Request, deadline: float) -> None:
+        """
+        Shorten the timeouts of an attempt so it ends within the time budget.
+        :param request: The request.
+        :param deadline: The end of the time budget of the request.
+        """
+        remaining = max(deadline - time.monotonic(), 0.001)
+        timeout = request.extensions.get("timeout", {})
+        request.extensions["timeout"] = {
+            name: remaining if value is None else min(value, remaining)
+            for name, value in timeout.items()
+        }
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        """
+        Send a request once, and record its latency.
+        :param request: The request.
+        :return: The response.
+        """
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def _hedge_delay(self) -> float | None:
+        """
+        Get the number of seconds after which a hedged request is sent.
+        :return: The percentile of the recent latencies, or None if there are
+            not enough of them.
+        """
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * HEDGE_PERCENTILE / 100) - 1]
+
+    async def _send_hedged(self, request: httpx.Request) -> httpx.Response:
+        """
+        Send a request, and a second one if the first is slow.
+        :param request: The request.
+        :return: The first successful response.
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._send(request)
+
+        # The requests still in flight are cancelled whatever happens, including
+        # when the caller is cancelled
+        pending = {asyncio.create_task(self._send(request))}
+        error = None
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+
+            self.hedged += 1
+            pending.add(asyncio.create_task(self._send(request)))
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                responses = []
+                for task in done:
+                    if task.exception() is None:
+                        responses.append(task.result())
+                    else:
+                        error = task.exception()
+                if responses:
+                    # Close the responses of the requests finishing together
+                    for response in responses[1:]:
+                        await response.aclose()
+                    return responses[0]
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
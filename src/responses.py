@@ -0,0 +1,94 @@
+"""
+This module contains the JSON response class shared by all the paths.
+Responses are serialized to compact bytes with orjson when it is installed.
+Indented JSON can still be requested with the `pretty=1` query parameter.
+"""
+
+import json
+from contextvars import ContextVar
+from typing import Any
+from urllib.parse import parse_qsl
+
+from fastapi import Response
+
+from src import timing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# Whether the current request asked for indented JSON
+_pretty: ContextVar[bool] = ContextVar("pretty", default=False)
+
+PRETTY_VALUES = {"1", "true", "yes"}
+
+
+def dumps(content: Any, pretty: bool = False) -> bytes:
+    """
+    Serialize a value to JSON.
+    :param content: The value.
+    :param pretty: Whether to indent the JSON.
+    :return: The JSON, encoded in UTF-8.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_INDENT_2 if pretty else 0,
+        )
+    if pretty:
+        return json.dumps(content, indent=2, ensure_ascii=False).encode()
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def wants_pretty() -> bool:
+    """
+    Check whether the current request asked for indented JSON.
+    :return: Whether to indent the JSON.
+    """
+    return _pretty.get()
+
+
+class JSONResponse(Response):
+    """
+    A JSON response, compact unless the request asked for indented JSON.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with timing.span("serialize"):
+            return dumps(content, _pretty.get())
+
+
+class EncodedJSONResponse(Response):
+    """
+    A JSON response for a payload that was already serialized to bytes,
+    such as an immutable payload encoded once and reused for every request.
+    """
+
+    media_type = "application/json"
+
+
+class PrettyJSONMiddleware:
+    """
+    Middleware reading the `pretty` query parameter of every request,
+    so the JSON responses know whether to indent their content.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or b"pretty" not in scope["query_string"]:
+            await self.app(scope, receive, send)
+            return
+        query = parse_qsl(scope["query_string"].decode("latin-1"))
+        pretty = any(
+            key == "pretty" and value.lower() in PRETTY_VALUES for key, value in query
+        )
+        token = _pretty.set(pretty)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _pretty.reset(token)
@@ -0,0 +1,230 @@
+"""
+This module contains the search index over the country names.
+Prefix matches are answered by a trie, and misspelled names by a trigram
+index re-ranked with the edit distance.
+"""
+
+import unicodedata
+
+# The maximum number of results of a search
+MAX_RESULTS = 25
+# The minimum similarity of a misspelled name, as the Dice coefficient of the
+# trigrams of the query and of the name
+MIN_SIMILARITY = 0.3
+
+
+def normalize(name: str) -> str:
+    """
+    Normalize a name for searching: case-insensitive and without accents.
+    :param name: The name.
+    :return: The normalized name.
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).strip()
+
+
+def trigrams(name: str) -> set[str]:
+    """
+    Get the trigrams of a normalized name, padded so short names have some.
+    :param name: The normalized name.
+    :return: The trigrams.
+    """
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Get the Levenshtein distance between two strings.
+    :param a: The first string.
+    :param b: The second string.
+    :return: The number of insertions, deletions and substitutions.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+class _Node:
+    """
+    A node of the trie, with the best results for its prefix.
+    """
+
+    __slots__ = ("children", "results")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # (rank, country name, matched name), sorted and capped after the build
+        self.results: list[tuple[tuple, str, str]] = []
+
+
+class SearchIndex:
+    """
+    An immutable search index over the common, official and alternative names
+    of the countries.
+    """
+
+    def __init__(self, countries: list[dict]):
+        """
+        :param countries: The countries, as returned by the REST Countries API.
+        """
+        # (normalized name, country name, matched name, kind) of every name
+        self.entries: list[tuple[str, str, str, int]] = []
+        for country in countries:
+            common = country["name"]["common"]
+            names = [(common, 0)]
+            if country["name"].get("official"):
+                names.append((country["name"]["official"], 1))
+            names.extend((spelling, 2) for spelling in country.get("altSpellings", []))
+            seen = set()
+            for name, kind in names:
+                key = normalize(name)
+                if key and key not in seen:
+                    seen.add(key)
+                    self.entries.append((key, common, name, kind))
+
+        # Exact names
+        self.exact: dict[str, str] = {}
+        for key, common, _, kind in sorted(self.entries, key=lambda e: e[3]):
+            self.exact.setdefault(key, common)
+
+        # Trie of the names, every node keeping the best results for its prefix:
+        # common names first, then the shortest names
+        self.root = _Node()
+        for key, common, name, kind in self.entries:
+            rank = (kind, len(key), key)
+            node = self.root
+            node.results.append((rank, common, name))
+            for char in key:
+                node = node.children.setdefault(char, _Node())
+                node.results.append((rank, common, name))
+        self._finish(self.root)
+
+        # Trigram index of the names, for the misspelled names
+        self.by_trigram: dict[str, list[int]] = {}
+        self.entry_trigrams = []
+        for i, (key, _, _, _) in enumerate(self.entries):
+            grams = trigrams(key)
+            self.entry_trigrams.append(len(grams))
+            for gram in grams:
+                self.by_trigram.setdefault(gram, []).append(i)
+
+    def _finish(self, root: _Node) -> None:
+        """
+        Sort the results of every node, keep one result per country and cap them.
+        """
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            results = []
+            seen = set()
+            for result in sorted(node.results):
+                if result[1] not in seen:
+                    seen.add(result[1])
+                    results.append(result)
+                    if len(results) == MAX_RESULTS:
+                        break
+            node.results = results
+            stack.extend(node.children.values())
+
+    def resolve(self, name: str) -> str | None:
+        """
+        Get the country with exactly this common name, official name or
+        alternative spelling, in any case and with or without accents.
+        :param name: The name.
+        :return: The common name of the country, or None if it is unknown.
+        """
+        return self.exact.get(normalize(name))
+
+    def prefix(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        """
+        Get the countries with a name starting with the query.
+        :param query: The beginning of the name.
+        :param limit: The maximum number of results.
+        :return: The matches, best first.
+        """
+        node = self.root
+        for char in normalize(query):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return [
+            {"country": common, "name": name, "match": "prefix"}
+            for _, common, name in node.results[:limit]
+        ]
+
+    def fuzzy(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        """
+        Get the countries with a name similar to the query, to tolerate typos.
+        :param query: The (misspelled) name.
+        :param limit: The maximum number of results.
+        :return: The matches, best first.
+        """
+        key = normalize(query)
+        grams = trigrams(key)
+        shared: dict[int, int] = {}
+        for gram in grams:
+            for i in self.by_trigram.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+
+        candidates = []
+        for i, count in shared.items():
+            similarity = 2 * count / (len(grams) + self.entry_trigrams[i])
+            if similarity >= MIN_SIMILARITY:
+                candidates.append((similarity, i))
+        # Re-rank the most similar names with the edit distance
+        candidates.sort(reverse=True)
+        ranked = []
+        for similarity, i in candidates[: limit * 4]:
+            entry_key, common, name, kind = self.entries[i]
+            ranked.append(
+                (edit_distance(key, entry_key), -similarity, kind, common, name)
+            )
+        ranked.sort()
+
+        results = []
+        seen = set()
+        for distance, _, _, common, name in ranked:
+            if common not in seen:
+                seen.add(common)
+                results.append(
+                    {
+                        "country": common,
+                        "name": name,
+                        "match": "fuzzy",
+                        "distance": distance,
+                    }
+                )
+                if len(results) == limit:
+                    break
+        return results
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        """
+        Get the countries matching a query: prefix matches first, then similar
+        names.
+        :param query: The query.
+        :param limit: The maximum number of results.
+        :return: The matches, best first.
+        """
+        results = self.prefix(query, limit)
+        if len(results) < limit:
+            seen = {result["country"] for result in results}
+            for result in self.fuzzy(query, limit):
+                if result["country"] not in seen:
+                    results.append(result)
+                    if len(results) == limit:
+                        break
+        return results
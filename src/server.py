@@ -0,0 +1,88 @@
+"""
+This module runs the application with uvicorn:
+
+    python -m src.server --api_key <YOUR API KEY> --workers 4
+
+It is kept apart from app.py, so the worker processes only import the
+application once.
+"""
+
+import copy
+import logging
+import os
+import tempfile
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+
+def log_config() -> dict:
+    """
+    Get the logging configuration of the server: the uvicorn configuration,
+    with the messages of the application logged like those of uvicorn.
+    :return: The logging configuration.
+    """
+    import uvicorn.config
+
+    config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    for name in ("app", "src"):
+        config["loggers"][name] = {
+            "handlers": ["default"],
+            "level": "INFO",
+            "propagate": False,
+        }
+    return config
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Run the server.
+    The settings are passed to the worker processes through the environment.
+    On SIGTERM, the server stops accepting connections and gives the requests in
+    progress some time to finish before the workers stop.
+
+    :param argv: The command line arguments, by default those of the process.
+    """
+    settings = config.parse_args(argv)
+    if not settings.api_key:
+        logger.warning("The API key is not set, the temperature paths will fail")
+    if settings.worker_processes > 1 and not settings.favorites_db:
+        logger.warning(
+            "The favorites are kept in memory, so every worker has its own. "
+            "Set a favorites database to share them."
+        )
+    # Only the server needs uvicorn, the workers import it themselves
+    import uvicorn
+
+    if settings.worker_processes > 1:
+        # Every worker writes its metrics to this directory, and /metrics
+        # aggregates them
+        from src import metrics
+
+        settings.metrics_dir = settings.metrics_dir or tempfile.mkdtemp(
+            prefix="metrics-"
+        )
+        metrics.prepare_multiprocess_dir(settings.metrics_dir)
+        os.environ[metrics.MULTIPROC_DIR_ENV] = settings.metrics_dir
+
+    os.environ.update(settings.to_env())
+    uvicorn.run(
+        "bootstrap:app",
+        host=settings.host,
+        port=settings.port,
+        workers=None if settings.reload else settings.workers,
+        reload=settings.reload,
+        loop=settings.loop,
+        http=settings.http,
+        backlog=settings.backlog,
+        timeout_keep_alive=settings.keep_alive,
+        limit_concurrency=settings.limit_concurrency,
+        timeout_graceful_shutdown=settings.graceful_shutdown,
+        access_log=settings.access_log,
+        log_config=log_config(),
+    )
+
+
+if __name__ == "__main__":
+    main()
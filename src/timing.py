@@ -0,0 +1,140 @@
+"""
+This module measures where the time of a request goes. Spans (the upstream
+calls, the phases of the handlers, the serialization of the response) are
+recorded for the current request and sent back in a `Server-Timing` header,
+which the browser developer tools display:
+
+    Server-Timing: restcountries;dur=48.2, openweathermap;dur=95.0,
+        chart;dur=31.4, total;dur=176.9
+
+Spans with the same name, e.g. the upstream calls of a batch path, are added
+up, and their number is given in the description.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from src import upstream
+
+# The spans of the current request: name -> [seconds, count]
+_spans: ContextVar[dict[str, list] | None] = ContextVar("spans", default=None)
+
+enabled = True
+
+
+def set_enabled(value: bool) -> None:
+    """
+    Set whether the responses get a Server-Timing header.
+    :param value: Whether to add the header.
+    """
+    global enabled
+    enabled = value
+
+
+def record(name: str, seconds: float) -> None:
+    """
+    Record a span of the current request, if it is measured.
+    :param name: The name of the span.
+    :param seconds: The duration of the span.
+    """
+    spans = _spans.get()
+    if spans is None:
+        return
+    current = spans.get(name)
+    if current is None:
+        spans[name] = [seconds, 1]
+    else:
+        current[0] += seconds
+        current[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    """
+    Measure a block of code as a span of the current request.
+    :param name: The name of the span.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def header(spans: dict[str, list], total: float) -> bytes:
+    """
+    Format spans as a Server-Timing header.
+    :param spans: The spans, by name.
+    :param total: The duration of the whole request in seconds.
+    :return: The value of the header.
+    """
+    metrics = []
+    for name, (seconds, count) in spans.items():
+        metric = f"{name};dur={seconds * 1000:.1f}"
+        if count > 1:
+            metric += f';desc="{count} calls"'
+        metrics.append(metric)
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics).encode("latin-1")
+
+
+class ServerTimingMiddleware:
+    """
+    Middleware collecting the spans of every request, and adding them to the
+    Server-Timing header of its response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        spans = {}
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # The response is complete when its headers are sent, except
+                # for the streamed responses
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (
+                        b"server-timing",
+                        header(spans, time.perf_counter() - start),
+                    ),
+                ]
+            await send(message)
+
+        token = _spans.set(spans)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _spans.reset(token)
+
+
+class TimingTransport(httpx.AsyncBaseTransport):
+    """
+    A transport recording the upstream calls of the transport it wraps as
+    spans, named after the upstream API.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        """
+        :param transport: The transport sending the requests.
+        """
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if _spans.get() is None:
+            return await self.transport.handle_async_request(request)
+        with span(upstream.service(str(request.url))):
+            return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
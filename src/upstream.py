@@ -0,0 +1,46 @@
+"""
+This module contains the base URLs of the upstream APIs.
+They can be changed, e.g. to run the application against a local fake upstream
+for benchmarking.
+"""
+
+REST_COUNTRIES_URL = "https://restcountries.com/v3.1"
+OPENWEATHERMAP_URL = "https://api.openweathermap.org/data/2.5"
+QUICKCHART_URL = "https://quickchart.io/chart"
+
+
+def set_urls(rest_countries: str, openweathermap: str, quickchart: str) -> None:
+    """
+    Set the base URLs of the upstream APIs.
+    :param rest_countries: The base URL of the REST Countries API.
+    :param openweathermap: The base URL of the OpenWeatherMap API.
+    :param quickchart: The URL of the QuickChart chart API.
+    """
+    global REST_COUNTRIES_URL, OPENWEATHERMAP_URL, QUICKCHART_URL
+    REST_COUNTRIES_URL = rest_countries.rstrip("/")
+    OPENWEATHERMAP_URL = openweathermap.rstrip("/")
+    QUICKCHART_URL = quickchart
+
+
+def urls() -> list[str]:
+    """
+    Get the URLs of all the upstream APIs.
+    :return: The URLs.
+    """
+    return [REST_COUNTRIES_URL, OPENWEATHERMAP_URL, QUICKCHART_URL]
+
+
+def service(url: str) -> str:
+    """
+    Get the name of the upstream API a URL belongs to.
+    :param url: The URL of a request.
+    :return: "restcountries", "openweathermap", "quickchart" or "other".
+    """
+    for name, base in (
+        ("restcountries", REST_COUNTRIES_URL),
+        ("openweathermap", OPENWEATHERMAP_URL),
+        ("quickchart", QUICKCHART_URL),
+    ):
+        if url.startswith(base):
+            return name
+    return "other"
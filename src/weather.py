@@ -0,0 +1,195 @@
+"""
+This module contains the calls to the OpenWeatherMap API.
+The results are cached by rounded coordinates, so capitals sharing a grid cell
+share their weather, for as long as the provider does not update its data.
+Capitals closer than `share_radius` kilometers, such as Rome and Vatican City
+or Marigot and Philipsburg, also share the weather of one of them.
+The calls are spread over the API keys and kept under their quota by the
+transport of the HTTP client, see src/quota.py.
+"""
+
+from collections import Counter
+
+import httpx
+from fastapi import status
+
+from src import upstream
+from src.cache import CacheEntry, TTLCache
+from src.client import UpstreamError
+from src.country_index import get_index
+from src.quota import QuotaExceededError, key_pool
+
+# The number of decimals the coordinates are rounded to (about 11 km)
+COORDINATE_PRECISION = 1
+# The distance in kilometers under which capitals share their weather
+SHARE_RADIUS = 25.0
+# OpenWeatherMap updates the current weather about every 10 minutes,
+# and the forecast every 3 hours
+CURRENT_TTL = 10 * 60
+FORECAST_TTL = 3 * 60 * 60
+WEATHER_CACHE_SIZE = 1024
+# The number of seconds an expired weather is still served when OpenWeatherMap
+# cannot be reached
+CURRENT_STALE_IF_ERROR = 60 * 60
+FORECAST_STALE_IF_ERROR = 6 * 60 * 60
+# The forecast is always fetched for its full horizon: 5 days in 3-hour intervals
+FORECAST_SLOTS = 5 * 8
+
+current_cache = TTLCache(
+    "weather",
+    maxsize=WEATHER_CACHE_SIZE,
+    ttl=CURRENT_TTL,
+    stale_if_error=CURRENT_STALE_IF_ERROR,
+    waiting=key_pool.waiting,
+)
+forecast_cache = TTLCache(
+    "forecast",
+    maxsize=WEATHER_CACHE_SIZE,
+    ttl=FORECAST_TTL,
+    stale_if_error=FORECAST_STALE_IF_ERROR,
+    waiting=key_pool.waiting,
+)
+
+share_radius = SHARE_RADIUS
+# The number of requests of every grid cell, to keep the most requested ones warm
+requested_cells: Counter[tuple[float, float]] = Counter()
+
+
+def set_share_radius(radius: float) -> None:
+    """
+    Set the distance under which capitals share their weather.
+    :param radius: The distance in kilometers, 0 to never share it.
+    """
+    global share_radius
+    share_radius = radius
+
+
+def grid_cell(latitude: float, longitude: float) -> tuple[float, float]:
+    """
+    Get the grid cell of a location. A capital close to other capitals gets the
+    cell of the one standing for them in the spatial index.
+    :param latitude: The latitude.
+    :param longitude: The longitude.
+    :return: The rounded latitude and longitude.
+    """
+    index = get_index()
+    if index is not None and share_radius > 0:
+        shared = index.spatial_index.shared_locations(share_radius)
+        latitude, longitude = shared.get((latitude, longitude), (latitude, longitude))
+    return (
+        round(latitude, COORDINATE_PRECISION),
+        round(longitude, COORDINATE_PRECISION),
+    )
+
+
+async def _get(client: httpx.AsyncClient, path: str) -> dict:
+    """
+    Call the OpenWeatherMap API. The transport of the client adds an API key
+    once one of them has quota left.
+    :param client: The HTTP client.
+    :param path: The path and the query to call, without the API key.
+    :return: The JSON response.
+    :raises UpstreamError: If the API key is wrong, the quota is exhausted or
+        the call failed.
+    """
+    try:
+        response = await client.get(f"{upstream.OPENWEATHERMAP_URL}{path}")
+    except QuotaExceededError as error:
+        raise UpstreamError(status.HTTP_503_SERVICE_UNAVAILABLE, str(error))
+    if response.status_code == status.HTTP_401_UNAUTHORIZED:
+        raise UpstreamError(status.HTTP_400_BAD_REQUEST, "The API key is not correct")
+    if response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+        raise UpstreamError(
+            status.HTTP_503_SERVICE_UNAVAILABLE, "The OpenWeatherMap quota is exhausted"
+        )
+    if response.status_code != status.HTTP_200_OK:
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "Error getting the temperature forecast",
+        )
+    return response.json()
+
+
+async def load_temperature(
+    client: httpx.AsyncClient, cell: tuple[float, float]
+) -> float:
+    """
+    Call the OpenWeatherMap API for the current temperature of a grid cell.
+    :param client: The HTTP client.
+    :param cell: The grid cell.
+    :return: The temperature in Celsius.
+    :raises UpstreamError: If the temperature could not be retrieved.
+    """
+    path = f"/weather?lat={cell[0]}&lon={cell[1]}&units=metric"
+    try:
+        return (await _get(client, path))["main"]["temp"]
+    except KeyError:
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+        )
+
+
+async def load_forecast(
+    client: httpx.AsyncClient, cell: tuple[float, float]
+) -> list[tuple[int, float]]:
+    """
+    Call the OpenWeatherMap API for the full temperature forecast of a grid cell.
+    :param client: The HTTP client.
+    :param cell: The grid cell.
+    :return: The (UNIX timestamp, temperature in Celsius) pairs of the forecast.
+    :raises UpstreamError: If the forecast could not be retrieved.
+    """
+    path = f"/forecast?lat={cell[0]}&lon={cell[1]}&cnt={FORECAST_SLOTS}&units=metric"
+    try:
+        forecast = [
+            (slot["dt"], slot["main"]["temp"])
+            for slot in (await _get(client, path))["list"]
+        ]
+    except KeyError:
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "Error parsing the response"
+        )
+    if not forecast:
+        raise UpstreamError(
+            status.HTTP_500_INTERNAL_SERVER_ERROR, "The forecast is empty"
+        )
+    return forecast
+
+
+async def fetch_temperature(
+    client: httpx.AsyncClient, latitude: float, longitude: float
+) -> CacheEntry:
+    """
+    Get the current temperature of a location.
+
+    :param client: The HTTP client.
+    :param latitude: The latitude.
+    :param longitude: The longitude.
+
+    :return: The cache entry with the temperature in Celsius.
+    :raises UpstreamError: If the temperature could not be retrieved.
+    """
+    cell = grid_cell(latitude, longitude)
+    requested_cells[cell] += 1
+    return await current_cache.get_entry(cell, lambda: load_temperature(client, cell))
+
+
+async def fetch_forecast(
+    client: httpx.AsyncClient, latitude: float, longitude: float
+) -> CacheEntry:
+    """
+    Get the temperature forecast of a location, in 3-hour intervals.
+    The full forecast horizon is fetched once and shared by all the requests,
+    whatever number of days they ask for.
+
+    :param client: The HTTP client.
+    :param latitude: The latitude.
+    :param longitude: The longitude.
+
+    :return: The cache entry with the (UNIX timestamp, temperature in Celsius)
+        pairs of the forecast.
+    :raises UpstreamError: If the forecast could not be retrieved.
+    """
+    cell = grid_cell(latitude, longitude)
+    requested_cells[cell] += 1
+    return await forecast_cache.get_entry(cell, lambda: load_forecast(client, cell))
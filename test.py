@@ -18,31 +18,29 @@ async def run_warmest_country(client: httpx.AsyncClient):
     countries = response.json()["countries"]
     print(f"The countries in South America are {', '.join(countries)}")
 
-    # Get the temperature of the countries, and find the warmest one
+    # Get the warmest country, ranked by the API. The temperatures of a cold
+    # cache can take a while under the quota of the API key, so the search is
+    # given a longer deadline.
     warmest_country = {"name": "", "temperature": -1000}
-    patience = 3
-
-    for country in countries:
-
-        # wait 3 turns before giving up
-        if patience < 0:
-            break
-
-        # Get the temperature of the country
-        response = await client.get(f"{base_url}/country/{country}/temperature")
-
-        # If temperature is not available, try again with another country,
-        # but up to 3 times
-        if response.status_code != 200:
-            print(f"Error getting the temperature for {country}. "
-                  f"Is the API key correct?")
-            patience -= 1
-            continue
+    response = await client.get(f"{base_url}/country/warmest",
+                                params={"continent": "south america", "k": 1,
+                                        "deadline": 20},
+                                timeout=25)
+    if response.status_code != 200:
+        return response.content
 
-        temperature = response.json()["temperature"]
-        print(f"The temperature in {country} is {temperature}")
-        if temperature > warmest_country["temperature"]:
-            warmest_country = {"name": country, "temperature": temperature}
+    result = response.json()
+    warmest = result["warmest"]
+    if not result["complete"]:
+        print(f"Warning: the temperature of {result['pending']} of the "
+              f"{len(countries)} countries was still pending at the deadline, "
+              f"the warmest country may be another one.")
+    if result["failed"]:
+        print(f"Warning: the temperature of {result['failed']} countries "
+              f"could not be fetched.")
+    if warmest:
+        warmest_country = {"name": warmest[0]["country"],
+                           "temperature": warmest[0]["temperature"]}
 
     if warmest_country["temperature"] == -1000:
         print("There was an error getting the temperature for all the countries. "
@@ -0,0 +1,19 @@
+"""
+The fixtures shared by all the tests.
+"""
+
+import pytest
+
+from src import cache
+
+
+@pytest.fixture(autouse=True)
+def restore_caches():
+    """
+    Unregister the caches created by a test, so they do not show in the
+    statistics and the metrics of the application in the later tests.
+    """
+    registered = dict(cache.caches)
+    yield
+    cache.caches.clear()
+    cache.caches.update(registered)
@@ -0,0 +1,171 @@
+"""
+Tests of the in-process caches and of the ETags of the cached charts.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from src.cache import ByteLRUCache, TTLCache
+from src.chart import etag_matches
+
+
+def make_loader(values: list) -> tuple:
+    """
+    Create a loader returning a sequence of values, or raising the exceptions
+    of the sequence.
+    :param values: The values, in order.
+    :return: The loader and the list of its calls.
+    """
+    calls = []
+
+    async def loader():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        value = values[min(len(calls), len(values)) - 1]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    return loader, calls
+
+
+def age(cache: TTLCache, key: str, seconds: float) -> None:
+    """
+    Make an entry of a cache older.
+    :param cache: The cache.
+    :param key: The key of the entry.
+    :param seconds: The number of seconds to add to its age.
+    """
+    cache.peek(key).created -= seconds
+
+
+def test_concurrent_loads_are_collapsed():
+    async def run():
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        loader, calls = make_loader(["value"])
+        values = await asyncio.gather(*(cache.get("key", loader) for _ in range(5)))
+        return values, calls, cache.stats()
+
+    values, calls, stats = asyncio.run(run())
+    assert values == ["value"] * 5
+    assert len(calls) == 1
+    assert stats["misses"] == 1 and stats["coalesced"] == 4
+
+
+def test_fresh_values_are_not_reloaded():
+    async def run():
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        loader, calls = make_loader(["first", "second"])
+        await cache.get("key", loader)
+        return await cache.get("key", loader), calls
+
+    value, calls = asyncio.run(run())
+    assert value == "first"
+    assert len(calls) == 1
+
+
+def test_errors_are_not_cached():
+    async def run():
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        loader, calls = make_loader([ValueError("failed"), "value"])
+        with pytest.raises(ValueError):
+            await cache.get("key", loader)
+        return await cache.get("key", loader), calls
+
+    value, calls = asyncio.run(run())
+    assert value == "value"
+    assert len(calls) == 2
+
+
+def test_stale_value_is_served_while_it_is_reloaded():
+    async def run():
+        cache = TTLCache("test", maxsize=10, ttl=60, stale_ttl=60)
+        loader, calls = make_loader(["old", "new"])
+        await cache.get("key", loader)
+        age(cache, "key", 90)
+        stale = await cache.get("key", loader)
+        await asyncio.sleep(0.05)
+        return stale, await cache.get("key", loader), calls, cache.stale_hits
+
+    stale, fresh, calls, stale_hits = asyncio.run(run())
+    assert (stale, fresh) == ("old", "new")
+    assert len(calls) == 2
+    assert stale_hits == 1
+
+
+def test_expired_value_is_served_when_the_reload_fails():
+    async def run():
+        cache = TTLCache("test", maxsize=10, ttl=60, stale_if_error=60)
+        loader, _ = make_loader(["old", ValueError("failed")])
+        await cache.get("key", loader)
+        age(cache, "key", 90)
+        value = await cache.get("key", loader)
+        age(cache, "key", 60)
+        with pytest.raises(ValueError):
+            await cache.get("key", loader)
+        return value, cache.stale_errors
+
+    value, stale_errors = asyncio.run(run())
+    assert value == "old"
+    assert stale_errors == 1
+
+
+def test_least_recently_used_value_is_evicted():
+    async def run():
+        cache = TTLCache("test", maxsize=2, ttl=60)
+        for key in ("a", "b"):
+            cache.set(key, key)
+        loader, _ = make_loader(["reloaded"])
+        await cache.get("a", loader)
+        cache.set("c", "c")
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.peek("b") is None
+    assert cache.peek("a").value == "a" and cache.peek("c").value == "c"
+    assert cache.evictions == 1
+
+
+def test_bytes_are_spilled_to_disk_and_loaded_back(tmp_path):
+    async def run():
+        cache = ByteLRUCache("test", max_bytes=10)
+        cache.configure(10, str(tmp_path))
+        await cache.set("a", b"aaaaaa")
+        await cache.set("b", b"bbbbbb")
+        evicted = len(cache), cache.size
+        return evicted, await cache.get("a"), await cache.get("missing"), cache
+
+    (size, total), value, missing, cache = asyncio.run(run())
+    assert (size, total) == (1, 6)
+    assert value == b"aaaaaa" and missing is None
+    assert cache.disk_hits == 1 and cache.misses == 1
+    # Loading a back evicted b, and no temporary file is left
+    assert sorted(os.listdir(tmp_path)) == ["a", "b"]
+
+
+def test_bytes_larger_than_the_cache_are_not_stored():
+    async def run():
+        cache = ByteLRUCache("test", max_bytes=4)
+        await cache.set("a", b"aaaaaa")
+        return await cache.get("a")
+
+    assert asyncio.run(run()) is None
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [
+        (None, False),
+        ("", False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"other", "abc"', True),
+        ("*", True),
+        ('"other"', False),
+        ("abc", False),
+    ],
+)
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, '"abc"') is matches
@@ -0,0 +1,66 @@
+"""
+Tests of the settings read from the environment and the command line.
+"""
+
+import pytest
+
+from src.config import Settings, parse_args
+
+
+def test_defaults_without_environment():
+    assert Settings.from_env({}) == Settings()
+
+
+def test_values_are_converted_to_the_type_of_the_settings():
+    settings = Settings.from_env(
+        {
+            "APP_WORKERS": "4",
+            "APP_OWM_CALLS_PER_MINUTE": "30.5",
+            "APP_API_KEY": "a,b",
+            "APP_FAVORITES_DB": "favorites.db",
+            "APP_LIMIT_CONCURRENCY": "100",
+            "OTHER_WORKERS": "8",
+        }
+    )
+    assert settings.workers == 4
+    assert settings.owm_calls_per_minute == 30.5
+    assert settings.api_key == "a,b"
+    assert settings.favorites_db == "favorites.db"
+    assert settings.limit_concurrency == 100
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("1", True), ("true", True), ("YES", True), ("0", False), ("no", False)],
+)
+def test_booleans(value, expected):
+    assert Settings.from_env({"APP_ACCESS_LOG": value}).access_log is expected
+
+
+def test_empty_value_unsets_an_optional_setting():
+    settings = Settings.from_env({"APP_FAVORITES_DB": "", "APP_ADMIN_KEY": ""})
+    assert settings.favorites_db is None and settings.admin_key is None
+
+
+def test_invalid_value_fails():
+    with pytest.raises(ValueError):
+        Settings.from_env({"APP_WORKERS": "many"})
+
+
+def test_environment_round_trip():
+    settings = Settings(workers=3, http2=False, favorites_db="f.db", hedge=True)
+    assert Settings.from_env(settings.to_env()) == settings
+
+
+def test_command_line_overrides_the_environment(monkeypatch):
+    monkeypatch.setenv("APP_WORKERS", "4")
+    monkeypatch.setenv("APP_PORT", "9000")
+    monkeypatch.setenv("APP_HTTP2", "0")
+    settings = parse_args(["--workers", "2", "--http2"])
+    assert (settings.workers, settings.port, settings.http2) == (2, 9000, True)
+
+
+def test_worker_processes():
+    assert Settings(workers=4).worker_processes == 4
+    assert Settings(workers=4, reload=True).worker_processes == 1
+    assert Settings(workers=0).worker_processes == 1
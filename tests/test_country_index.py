@@ -0,0 +1,86 @@
+"""
+Tests of the in-memory index of the countries and of its snapshot file.
+"""
+
+import asyncio
+import multiprocessing
+import os
+
+import httpx
+import pytest
+
+from src import country_index
+from src.country_index import CountryIndex, read_snapshot, write_snapshot
+
+COUNTRIES = [
+    {
+        "name": {"common": "Peru", "official": "Republic of Peru"},
+        "altSpellings": ["PE"],
+        "region": "Americas",
+        "subregion": "South America",
+        "continents": ["South America"],
+        "capitalInfo": {"latlng": [-12.05, -77.05]},
+    },
+    {
+        "name": {"common": "Chile", "official": "Republic of Chile"},
+        "altSpellings": ["CL"],
+        "region": "Americas",
+        "subregion": "South America",
+        "continents": ["South America"],
+        "capitalInfo": {"latlng": [-33.45, -70.67]},
+    },
+]
+
+
+@pytest.fixture(autouse=True)
+def restore_index():
+    """
+    Restore the current country index after every test.
+    """
+    index = country_index.get_index()
+    yield
+    country_index.set_index(index)
+
+
+def write_many(path: str) -> None:
+    """
+    Write a snapshot several times, as a worker refreshing the index would.
+    :param path: The path of the snapshot.
+    """
+    for _ in range(20):
+        write_snapshot(path, COUNTRIES)
+
+
+def test_index_lookups():
+    index = CountryIndex(COUNTRIES)
+    assert index.names == ["Chile", "Peru"]
+    assert index.get("republic of peru")["name"]["common"] == "Peru"
+    assert index.get("cl")["name"]["common"] == "Chile"
+    assert index.region("south america") == ["Chile", "Peru"]
+    assert index.region("Europe") is None
+
+
+def test_workers_write_the_snapshot_at_the_same_time(tmp_path):
+    path = str(tmp_path / "countries.json")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=write_many, args=(path,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0, 0, 0]
+    assert read_snapshot(path) == COUNTRIES
+    assert os.listdir(tmp_path) == ["countries.json"]
+
+
+def test_failed_snapshot_keeps_the_new_index(tmp_path):
+    async def run():
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, json=COUNTRIES)
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            await country_index.refresh(client, str(tmp_path / "missing" / "c.json"))
+
+    asyncio.run(run())
+    assert len(country_index.get_index()) == 2
+    assert os.listdir(tmp_path) == []
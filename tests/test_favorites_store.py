@@ -0,0 +1,92 @@
+"""
+Tests of the storage backends of the favorite countries.
+"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from src.favorites_store import (
+    MemoryFavoritesStore,
+    SQLiteFavoritesStore,
+    create_store,
+    is_busy,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    """
+    A store of every kind, closed after the test.
+    """
+    store = (
+        create_store(str(tmp_path / "favorites.db"))
+        if request.param == "sqlite"
+        else create_store()
+    )
+    yield store
+    store.close()
+
+
+def test_create_store(tmp_path):
+    assert isinstance(create_store(), MemoryFavoritesStore)
+    store = create_store(str(tmp_path / "favorites.db"))
+    assert isinstance(store, SQLiteFavoritesStore)
+    store.close()
+
+
+def test_add_list_and_remove(store):
+    async def run():
+        added = [await store.add(name) for name in ("Peru", "Chile", "Peru")]
+        favorites = await store.list()
+        contains = await store.contains("Chile"), await store.contains("Spain")
+        removed = [await store.remove(name) for name in ("Peru", "Peru")]
+        return added, favorites, contains, removed, await store.list()
+
+    added, favorites, contains, removed, remaining = asyncio.run(run())
+    assert added == [True, True, False]
+    # In the order they were added
+    assert favorites == ["Peru", "Chile"]
+    assert contains == (True, False)
+    assert removed == [True, False]
+    assert remaining == ["Chile"]
+
+
+def test_sqlite_stores_share_the_favorites(tmp_path):
+    path = str(tmp_path / "favorites.db")
+    first, second = SQLiteFavoritesStore(path), SQLiteFavoritesStore(path)
+
+    async def run():
+        await first.add("Peru")
+        await second.add("Chile")
+        return await first.list(), await second.contains("Peru")
+
+    try:
+        assert asyncio.run(run()) == (["Peru", "Chile"], True)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_locked_database_is_busy(tmp_path):
+    path = str(tmp_path / "favorites.db")
+    store = SQLiteFavoritesStore(path)
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute("BEGIN EXCLUSIVE")
+    try:
+        with pytest.raises(sqlite3.OperationalError) as error:
+            asyncio.run(store.add("Peru"))
+        assert is_busy(error.value)
+    finally:
+        lock.execute("ROLLBACK")
+        lock.close()
+        store.close()
+
+
+def test_missing_table_is_not_busy():
+    connection = sqlite3.connect(":memory:")
+    with pytest.raises(sqlite3.OperationalError) as error:
+        connection.execute("SELECT name FROM favorites")
+    connection.close()
+    assert not is_busy(error.value)
@@ -0,0 +1,114 @@
+"""
+Tests of the spatial index over the coordinates of the capitals.
+"""
+
+import random
+
+import pytest
+
+from src import geo
+from src.geo import SpatialIndex, haversine
+
+
+def brute_force(
+    locations: dict[str, tuple[float, float]], latitude: float, longitude: float
+) -> list[tuple[str, float]]:
+    """
+    Get the distances to all the locations, the closest first.
+    :param locations: The latitude and longitude by name.
+    :param latitude: The latitude.
+    :param longitude: The longitude.
+    :return: The (name, distance in kilometers) pairs.
+    """
+    return sorted(
+        (
+            (name, haversine(latitude, longitude, *location))
+            for name, location in locations.items()
+        ),
+        key=lambda pair: (pair[1], pair[0]),
+    )
+
+
+def random_locations(count: int) -> dict[str, tuple[float, float]]:
+    """
+    Get random locations all over the Earth.
+    :param count: The number of locations.
+    :return: The latitude and longitude by name.
+    """
+    rng = random.Random(42)
+    return {
+        f"l{i}": (rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(count)
+    }
+
+
+@pytest.fixture(params=["python", "numpy"])
+def vectorize(request, monkeypatch):
+    """
+    Compute the distances one by one, or all at once with numpy.
+    """
+    if request.param == "numpy":
+        if geo._numpy() is None:
+            pytest.skip("numpy is not installed")
+        monkeypatch.setattr(geo, "VECTORIZE_MIN", 0)
+    else:
+        monkeypatch.setattr(geo, "VECTORIZE_MIN", float("inf"))
+    return request.param
+
+
+def test_haversine():
+    # Paris to London
+    assert haversine(48.86, 2.35, 51.51, -0.13) == pytest.approx(343, abs=2)
+    assert haversine(10, 20, 10, 20) == 0
+    assert haversine(90, 0, -90, 0) == pytest.approx(geo.MAX_DISTANCE_KM)
+
+
+def test_within_across_the_dateline(vectorize):
+    index = SpatialIndex({"east": (0.0, 179.9), "west": (0.0, -179.9)})
+    assert [name for name, _ in index.within(0.0, 179.99, 50)] == ["east", "west"]
+    assert [name for name, _ in index.within(0.0, -179.99, 11)] == ["west"]
+
+
+def test_within_around_the_poles(vectorize):
+    locations = {f"north{lon}": (89.0, float(lon)) for lon in (-90, 0, 90, 180)}
+    locations["south"] = (-89.5, 45.0)
+    index = SpatialIndex(locations)
+    north = index.within(90.0, 0.0, 200)
+    assert len(north) == 4
+    assert all(distance == pytest.approx(111.2, abs=0.5) for _, distance in north)
+    assert index.nearest(-90.0, 0.0) == [("south", pytest.approx(55.6, abs=0.5))]
+
+
+def test_nearest_and_within_match_brute_force(vectorize):
+    locations = random_locations(300)
+    index = SpatialIndex(locations)
+    rng = random.Random(7)
+    for _ in range(20):
+        latitude, longitude = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        expected = brute_force(locations, latitude, longitude)
+        nearest = index.nearest(latitude, longitude, k=5)
+        assert [name for name, _ in nearest] == [name for name, _ in expected[:5]]
+        assert [d for _, d in nearest] == pytest.approx([d for _, d in expected[:5]])
+        radius = rng.uniform(100, 5000)
+        within = index.within(latitude, longitude, radius)
+        assert {name for name, _ in within} == {
+            name for name, distance in expected if distance <= radius
+        }
+
+
+def test_nearest_returns_all_the_locations_when_there_are_fewer():
+    index = SpatialIndex({"a": (0.0, 0.0), "b": (10.0, 10.0)})
+    assert [name for name, _ in index.nearest(80.0, -170.0, k=5)] == ["b", "a"]
+
+
+def test_close_locations_share_one_of_them():
+    index = SpatialIndex(
+        {"a": (50.0, 5.0), "b": (50.05, 5.05), "c": (50.1, 5.1), "far": (0.0, 0.0)}
+    )
+    shared = index.shared_locations(10)
+    # b is within 10 km of both a and c, so it stands for them
+    assert shared == {
+        (50.0, 5.0): (50.05, 5.05),
+        (50.05, 5.05): (50.05, 5.05),
+        (50.1, 5.1): (50.05, 5.05),
+    }
+    assert index.shared_locations(10) is shared
@@ -0,0 +1,241 @@
+"""
+Tests of the quota of the OpenWeatherMap API keys.
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src import upstream
+from src.cache import TTLCache, caches
+from src.quota import (
+    BACKGROUND,
+    INTERACTIVE,
+    KeyPool,
+    QuotaExceededError,
+    QuotaTransport,
+    TokenBucket,
+    background,
+)
+from src.resilience import CircuitBreaker, ResilientTransport
+
+
+def make_pool(rate: float, tokens: float = 0.0, **kwargs) -> KeyPool:
+    """
+    Create a pool with a single key.
+    :param rate: The number of tokens added per second.
+    :param tokens: The number of tokens of the key.
+    :param kwargs: The other arguments of the pool.
+    :return: The pool.
+    """
+    pool = KeyPool(**kwargs)
+    bucket = TokenBucket(rate, capacity=1.0)
+    bucket.tokens = tokens
+    pool.buckets = {"key": bucket}
+    return pool
+
+
+def test_bucket_refill():
+    bucket = TokenBucket(rate=10.0, capacity=2.0)
+    bucket.tokens = 0.0
+    bucket.updated -= 0.1
+    assert bucket.refill() == pytest.approx(1.0, abs=0.05)
+    bucket.updated -= 10
+    assert bucket.refill() == 2.0
+
+
+def test_bucket_wait_time_and_pause():
+    bucket = TokenBucket(rate=10.0, capacity=2.0)
+    assert bucket.wait_time() == 0.0
+    bucket.tokens = 0.0
+    assert bucket.wait_time() == pytest.approx(0.1, abs=0.01)
+    bucket.pause(5.0)
+    assert bucket.wait_time() > 5.0
+
+
+def test_keys_share_the_quota_per_minute():
+    pool = KeyPool(calls_per_minute=60)
+    pool.set_keys(["a", "b"])
+    for bucket in pool.buckets.values():
+        assert bucket.capacity == 6
+        assert bucket.rate == pytest.approx(54 / 60)
+
+
+def test_takes_the_key_with_the_most_tokens():
+    pool = KeyPool(calls_per_minute=60)
+    pool.set_keys(["a", "b"])
+    pool.buckets["a"].tokens = 2.0
+    assert asyncio.run(pool.acquire()) == "b"
+
+
+def test_background_calls_leave_a_reserve():
+    pool = KeyPool()
+    pool.buckets = {"key": TokenBucket(rate=0.001, capacity=10.0)}
+    pool.buckets["key"].tokens = 5.0
+    assert pool._take(BACKGROUND) is None
+    assert pool._take(INTERACTIVE) == "key"
+
+
+def test_interactive_calls_go_first():
+    async def run():
+        pool = make_pool(rate=50.0)
+        order = []
+
+        async def call(name: str) -> None:
+            await pool.acquire()
+            order.append(name)
+
+        with background():
+            first = asyncio.create_task(call("background"))
+        await asyncio.sleep(0)
+        await asyncio.gather(first, call("interactive"))
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "background"]
+
+
+def test_interactive_calls_time_out():
+    async def run():
+        pool = make_pool(rate=0.001, queue_timeout=0.05)
+        started = time.monotonic()
+        with pytest.raises(QuotaExceededError):
+            await pool.acquire()
+        assert time.monotonic() - started < 1.0
+        assert pool.rejected == 1
+        assert pool.stats()["waiting"] == 0
+
+    asyncio.run(run())
+
+
+def test_background_calls_do_not_time_out():
+    async def run():
+        pool = make_pool(rate=20.0, queue_timeout=0.01)
+        assert await pool.acquire(BACKGROUND) == "key"
+        assert pool.rejected == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_calls_leave_their_token():
+    async def run():
+        pool = make_pool(rate=20.0)
+        cancelled = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        started = time.monotonic()
+        assert await pool.acquire() == "key"
+        # The token was refilled once, for the second call only
+        assert time.monotonic() - started < 0.06
+        assert pool.buckets["key"].tokens < 0.5
+
+    asyncio.run(run())
+
+
+def test_load_nobody_waits_for_goes_to_the_background():
+    async def run():
+        pool = make_pool(rate=10.0, queue_timeout=0.2)
+        cache = TTLCache("test_orphan", maxsize=10, ttl=60, waiting=pool.waiting)
+        loads = []
+
+        async def load():
+            key = await pool.acquire()
+            loads.append("orphan")
+            return key
+
+        # The caller gives up, the load goes on without it
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(cache.get_entry("cell", load), 0.01)
+        # A new request goes first, and the load does not fail after the
+        # queue timeout of the interactive calls
+        await pool.acquire()
+        loads.append("request")
+        await asyncio.sleep(0.3)
+        return loads, pool.rejected, cache.peek("cell")
+
+    loads, rejected, entry = asyncio.run(run())
+    assert loads == ["request", "orphan"]
+    assert rejected == 0
+    assert entry is not None
+
+
+def test_new_caller_brings_the_load_back_to_the_front():
+    async def run():
+        pool = make_pool(rate=20.0, queue_timeout=1.0)
+        cache = TTLCache("test_adopt", maxsize=10, ttl=60, waiting=pool.waiting)
+        order = []
+
+        async def load():
+            await pool.acquire()
+            order.append("load")
+
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(cache.get_entry("cell", load), 0.01)
+        with background():
+            other = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0)
+        await cache.get_entry("cell", load)
+        await other
+        order.append("background")
+        return order
+
+    assert asyncio.run(run()) == ["load", "background"]
+
+
+def test_every_attempt_takes_a_token():
+    async def run():
+        pool = KeyPool(calls_per_minute=600)
+        pool.set_keys(["key"])
+        statuses = iter([503, 200])
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(next(statuses))
+
+        transport = ResilientTransport(
+            QuotaTransport(httpx.MockTransport(handler), pool),
+            CircuitBreaker("test"),
+            backoff=0.0,
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.get(f"{upstream.OPENWEATHERMAP_URL}/weather")
+        return response, requests, pool.buckets["key"]
+
+    response, requests, bucket = asyncio.run(run())
+    assert response.status_code == 200
+    assert [request.url.params["appid"] for request in requests] == ["key", "key"]
+    assert bucket.tokens == pytest.approx(bucket.capacity - 2, abs=0.1)
+
+
+def test_too_many_requests_throttles_the_key():
+    async def run():
+        pool = KeyPool(calls_per_minute=600)
+        pool.set_keys(["key"])
+        transport = QuotaTransport(
+            httpx.MockTransport(lambda request: httpx.Response(429)), pool
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            await client.get(f"{upstream.OPENWEATHERMAP_URL}/weather")
+        return pool.buckets["key"]
+
+    assert asyncio.run(run()).wait_time() > 30
+
+
+def test_other_hosts_do_not_take_tokens():
+    async def run():
+        pool = KeyPool()
+        transport = QuotaTransport(
+            httpx.MockTransport(lambda request: httpx.Response(200)), pool
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.get(f"{upstream.REST_COUNTRIES_URL}/all")
+        return response
+
+    # The pool has no key, so taking a token would fail
+    assert asyncio.run(run()).status_code == 200
+
+
+def test_test_caches_are_unregistered():
+    assert "test_orphan" not in caches and "test_adopt" not in caches
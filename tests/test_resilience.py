@@ -0,0 +1,228 @@
+"""
+Tests of the circuit breaker, the retries and the hedged requests of the upstream
+transport.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from src.resilience import (
+    HEDGE_MIN_SAMPLES,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientTransport,
+)
+
+
+def make_transport(
+    responses: list, breaker: CircuitBreaker | None = None, **kwargs
+) -> tuple[ResilientTransport, list[httpx.Request]]:
+    """
+    Create a transport answering with a sequence of responses.
+    :param responses: The status codes to answer with, or exceptions to raise.
+    :param breaker: The circuit breaker, by default one that never opens.
+    :param kwargs: The other arguments of the transport.
+    :return: The transport and the list of the requests it received.
+    """
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        response = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return httpx.Response(response)
+
+    kwargs.setdefault("backoff", 0.0)
+    transport = ResilientTransport(
+        httpx.MockTransport(handler),
+        breaker or CircuitBreaker("test", threshold=100),
+        **kwargs,
+    )
+    return transport, requests
+
+
+def send(transport: ResilientTransport, method: str = "GET") -> httpx.Response:
+    """
+    Send a request through a transport.
+    :param transport: The transport.
+    :param method: The method of the request.
+    :return: The response.
+    """
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.request(method, "http://upstream/path")
+
+    return asyncio.run(run())
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("test", threshold=2, reset=60)
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker("test", threshold=2, reset=60)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker("test", threshold=1, reset=0)
+    breaker.failure()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_failed_trial_opens_again():
+    breaker = CircuitBreaker("test", threshold=3, reset=0)
+    for _ in range(3):
+        breaker.failure()
+    assert breaker.allow()
+    breaker.reset = 60
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_release_frees_the_trial():
+    breaker = CircuitBreaker("test", threshold=1, reset=0)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_retries_retryable_statuses():
+    transport, requests = make_transport([503, 502, 200], retries=2)
+    assert send(transport).status_code == 200
+    assert len(requests) == 3
+    assert transport.retried == 2
+
+
+def test_returns_last_response_after_the_retries():
+    transport, requests = make_transport([503], retries=2)
+    assert send(transport).status_code == 503
+    assert len(requests) == 3
+
+
+def test_does_not_retry_other_statuses():
+    transport, requests = make_transport([500, 200], retries=2)
+    assert send(transport).status_code == 500
+    assert len(requests) == 1
+
+
+def test_does_not_retry_non_idempotent_requests():
+    transport, requests = make_transport([503, 200], retries=2)
+    assert send(transport, "POST").status_code == 503
+    assert len(requests) == 1
+
+
+def test_retries_transport_errors():
+    transport, requests = make_transport(
+        [httpx.ConnectError("refused"), 200], retries=2
+    )
+    assert send(transport).status_code == 200
+    assert len(requests) == 2
+
+
+def test_raises_the_last_transport_error():
+    transport, requests = make_transport([httpx.ReadTimeout("slow")], retries=1)
+    with pytest.raises(httpx.ReadTimeout):
+        send(transport)
+    assert len(requests) == 2
+
+
+def test_no_retry_when_the_backoff_exceeds_the_budget():
+    transport, requests = make_transport([503, 200], backoff=1.0, budget=0.5)
+    assert send(transport).status_code == 503
+    assert len(requests) == 1
+
+
+def test_timeouts_are_limited_to_the_budget():
+    transport, requests = make_transport([200], budget=0.5)
+    send(transport)
+    timeouts = requests[0].extensions["timeout"]
+    assert timeouts and all(0 < value <= 0.5 for value in timeouts.values())
+
+
+def test_open_circuit_fails_fast():
+    breaker = CircuitBreaker("test", threshold=2, reset=60)
+    transport, requests = make_transport([503], breaker, retries=5)
+    # The second failure opens the circuit, which stops the retries
+    with pytest.raises(CircuitOpenError):
+        send(transport)
+    assert len(requests) == 2
+    with pytest.raises(CircuitOpenError):
+        send(transport)
+    assert len(requests) == 2
+
+
+def make_hedged_transport(delays: list[float]) -> tuple[ResilientTransport, list]:
+    """
+    Create a hedging transport whose recent latencies are all 10 ms.
+    :param delays: The number of seconds every request takes to answer, in order.
+    :return: The transport and the list of the outcomes of the requests:
+        "answered" or "cancelled".
+    """
+    outcomes = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        number = len(outcomes)
+        outcomes.append(None)
+        try:
+            await asyncio.sleep(delays[number])
+        except asyncio.CancelledError:
+            outcomes[number] = "cancelled"
+            raise
+        outcomes[number] = "answered"
+        return httpx.Response(200, text=str(number))
+
+    transport = ResilientTransport(
+        httpx.MockTransport(handler),
+        CircuitBreaker("test", threshold=100),
+        backoff=0.0,
+        hedge=True,
+    )
+    transport.latencies.extend([0.01] * HEDGE_MIN_SAMPLES)
+    return transport, outcomes
+
+
+def test_fast_request_is_not_hedged():
+    transport, outcomes = make_hedged_transport([0.0])
+    assert send(transport).text == "0"
+    assert outcomes == ["answered"]
+    assert transport.hedged == 0
+
+
+def test_hedged_request_wins_and_the_slow_one_is_cancelled():
+    transport, outcomes = make_hedged_transport([1.0, 0.0])
+    assert send(transport).text == "1"
+    assert outcomes == ["cancelled", "answered"]
+    assert transport.hedged == 1
+
+
+def test_cancelled_caller_cancels_the_request_in_flight():
+    async def run():
+        transport, outcomes = make_hedged_transport([1.0])
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(TimeoutError):
+                await asyncio.wait_for(client.get("http://upstream/path"), 0.001)
+            await asyncio.sleep(0)
+        # Before asyncio.run cancels the tasks left
+        return list(outcomes)
+
+    assert asyncio.run(run()) == ["cancelled"]
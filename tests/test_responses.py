@@ -0,0 +1,19 @@
+"""
+Tests of the serialization of the JSON responses.
+"""
+
+import pytest
+
+from src import responses
+from src.responses import dumps
+
+CONTENT = {"country": "Côte d'Ivoire", "temperature": 27.5, "capital": ["Yamoussoukro"]}
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+def test_orjson_and_json_give_the_same_bytes(monkeypatch, pretty):
+    if responses.orjson is None:
+        pytest.skip("orjson is not installed")
+    encoded = dumps(CONTENT, pretty)
+    monkeypatch.setattr(responses, "orjson", None)
+    assert dumps(CONTENT, pretty) == encoded
@@ -0,0 +1,97 @@
+"""
+Tests of the search index over the country names.
+"""
+
+import pytest
+
+from src.search import SearchIndex, edit_distance, normalize
+
+COUNTRIES = [
+    {
+        "name": {"common": "United States", "official": "United States of America"},
+        "altSpellings": ["US", "USA"],
+    },
+    {
+        "name": {
+            "common": "United Kingdom",
+            "official": "United Kingdom of Great Britain and Northern Ireland",
+        },
+        "altSpellings": ["GB", "UK", "Great Britain"],
+    },
+    {
+        "name": {"common": "Ivory Coast", "official": "Republic of Côte d'Ivoire"},
+        "altSpellings": ["CI", "Côte d'Ivoire"],
+    },
+    {"name": {"common": "Uganda", "official": "Republic of Uganda"}},
+]
+
+
+@pytest.fixture(scope="module")
+def index() -> SearchIndex:
+    """
+    The search index over the test countries.
+    """
+    return SearchIndex(COUNTRIES)
+
+
+def test_normalize():
+    assert normalize("  Côte d'IVOIRE ") == "cote d'ivoire"
+
+
+def test_edit_distance():
+    assert edit_distance("kitten", "sitting") == 3
+    assert edit_distance("", "abc") == 3
+    assert edit_distance("same", "same") == 0
+
+
+def test_prefix_ranks_the_shortest_common_names_first(index):
+    assert [result["country"] for result in index.prefix("uni")] == [
+        "United States",
+        "United Kingdom",
+    ]
+    assert [result["country"] for result in index.prefix("u")][:3] == [
+        "Uganda",
+        "United States",
+        "United Kingdom",
+    ]
+    assert index.prefix("zz") == []
+
+
+def test_prefix_matches_other_names_once_per_country(index):
+    results = index.prefix("cote")
+    assert results == [
+        {"country": "Ivory Coast", "name": "Côte d'Ivoire", "match": "prefix"}
+    ]
+    assert [result["country"] for result in index.prefix("u", limit=1)] == ["Uganda"]
+
+
+def test_fuzzy_tolerates_typos(index):
+    results = index.fuzzy("Untied Kingdom")
+    assert results[0]["country"] == "United Kingdom"
+    assert results[0]["distance"] == 2
+    assert index.fuzzy("xyz") == []
+
+
+def test_search_gives_the_prefix_matches_first(index):
+    results = index.search("Uganada")
+    assert results[0] == {
+        "country": "Uganda",
+        "name": "Uganda",
+        "match": "fuzzy",
+        "distance": 1,
+    }
+    assert index.search("united")[0]["match"] == "prefix"
+
+
+@pytest.mark.parametrize(
+    "name, country",
+    [
+        ("usa", "United States"),
+        ("UNITED STATES OF AMERICA", "United States"),
+        ("cote d'ivoire", "Ivory Coast"),
+        ("Uganda", "Uganda"),
+        ("Unit", None),
+    ],
+)
+def test_resolve(index, name, country):
+    assert index.resolve(name) == country